@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Run thousands of concurrent 5xx and up checks of many HAProxy on one event loop with haproxy_async.
+
+Every host is a local stand-in for the stats page, answering after --latency-ms on an event loop of its own thread,
+and counting how many of its fetches were in flight at once. Every check samples its backend over --interval
+seconds, all intervals overlapping::
+
+    python -m benchmarks.bench_async --hosts 10 --backends 100 --servers 20 --checks 5000 --interval 1
+"""
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import threading
+import time
+
+from check_haproxy_stats import haproxy_async
+
+from .statsgen import generate_stats_csv
+
+
+class StatsPage(object):
+    """A stand-in for the stats page of one HAProxy."""
+
+    def __init__(self, payload, latency):
+        self.payload = payload
+        self.latency = latency
+        self.fetches = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def handle(self, reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        self.fetches += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\n" + self.payload)
+        await writer.drain()
+        writer.close()
+
+
+def serve_stats_pages(count, payload, latency):
+    """Serve count stats pages on random local ports from a thread of their own.
+
+    :return: ([page], [port])
+    """
+    loop = asyncio.new_event_loop()
+    pages = [StatsPage(payload, latency) for _ in range(count)]
+    servers = [loop.run_until_complete(asyncio.start_server(page.handle, "127.0.0.1", 0, backlog=1024))
+               for page in pages]
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    return pages, [server.sockets[0].getsockname()[1] for server in servers]
+
+
+async def run_checks(ports, backends, checks, interval, max_concurrency):
+    fetcher = haproxy_async.AsyncStatsFetcher(max_concurrency)
+    coroutines = []
+    for i in range(checks):
+        base_url_path = "127.0.0.1:{0}/haproxy/stats".format(ports[i % len(ports)])
+        backend = "=backend-{0}".format(i // len(ports) % backends)
+        if i % 2:
+            coroutines.append(haproxy_async.get_hrsp_5xx_ratio(backend, base_url_path, None, None, interval,
+                                                               fetcher=fetcher))
+        else:
+            coroutines.append(haproxy_async.get_haproxy_services_up_count_for_backends(
+                base_url_path, backends=[backend], fetcher=fetcher))
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    return [r for r in results if isinstance(r, Exception)], fetcher.fetches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--backends", type=int, default=100)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--checks", type=int, default=5000)
+    parser.add_argument("--interval", type=float, default=1)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--max-concurrency", type=int, default=2, help="Fetches of a host in flight at once.")
+    args = parser.parse_args()
+
+    payload = generate_stats_csv(args.backends, args.servers).encode("utf-8")
+    pages, ports = serve_stats_pages(args.hosts, payload, args.latency_ms / 1000.0)
+    started = time.perf_counter()
+    errors, fetches = asyncio.run(run_checks(ports, args.backends, args.checks, args.interval,
+                                             args.max_concurrency))
+    elapsed = time.perf_counter() - started
+    print("{0} checks of {1} hosts ({2} KiB of stats each) over {3} s intervals: {4:.2f} s on one thread, "
+          "{5} fetches, at most {6} in flight per host, {7} errors".format(
+              args.checks, args.hosts, len(payload) // 1024, args.interval, elapsed, fetches,
+              max(page.peak for page in pages), len(errors)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Measure how long prometheus-haproxy-stats takes to render a snapshot, and how long scrapes of it take.
+
+The default 400 backends of 20 servers make about 50k series::
+
+    python -m benchmarks.bench_exporter --backends 400 --servers 20
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from check_haproxy_stats import prometheus_haproxy_stats
+
+from .statsgen import generate_stats_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=400)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--scrapes", type=int, default=1000)
+    args = parser.parse_args()
+
+    stats_csv = generate_stats_csv(args.backends, args.servers)
+    cache = prometheus_haproxy_stats.SnapshotCache(lambda: stats_csv, refresh_interval=3600)
+
+    start = time.process_time()
+    body = cache.get()
+    render = time.process_time() - start
+    series = sum(1 for line in body.splitlines() if not line.startswith(b"#"))
+    print("snapshot: {0} series, {1} bytes, rendered in {2:.2f} ms cpu".format(series, len(body), render * 1000))
+
+    start = time.process_time()
+    for _ in range(args.scrapes):
+        cache.get()
+    print("cached scrape: {0:.4f} ms cpu".format((time.process_time() - start) * 1000 / args.scrapes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Fill a history file of many backends, then time appending a sample and reading windows from it.
+
+The cost of both stays the same however full the file is, since an append writes one record per backend and a
+window reads a few records of each backend by binary search::
+
+    python -m benchmarks.bench_history --backends 100 --capacity 1440 --appends 2880
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from check_haproxy_stats import counter_history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=100)
+    parser.add_argument("--capacity", type=int, default=1440)
+    parser.add_argument("--appends", type=int, default=2880, help="Samples appended, wrapping around past capacity.")
+    parser.add_argument("--poll-interval", type=int, default=60)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "history.ring")
+        names = ["backend-{0}".format(i) for i in range(args.backends)]
+        up_counts = dict((name, {"count": 20, "up_count": 19}) for name in names)
+        appended = 0
+        with counter_history.HistoryFile(path, args.backends, args.capacity, writable=True) as history:
+            for i in range(args.appends):
+                request_stats = dict((name, (0, 100 * i, 0, 0, i, 0)) for name in names)
+                started = time.perf_counter()
+                history.append(1500000000 + i * args.poll_interval, request_stats, up_counts)
+                appended += time.perf_counter() - started
+        print("{0} samples of {1} backends in a {2:.1f} MiB file: {3:.3f} ms per append".format(
+            args.appends, args.backends, os.path.getsize(path) / 1048576.0, 1000 * appended / args.appends))
+
+        with counter_history.HistoryFile(path) as history:
+            for window in (60, 3600, (min(args.capacity, args.appends) - 1) * args.poll_interval):
+                started = time.perf_counter()
+                for _ in range(100):
+                    history.get_hrsp_5xx_ratios(None, window)
+                print("5xx ratios of every backend over {0} s: {1:.3f} ms".format(
+                    window, 10 * (time.perf_counter() - started)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Compare bytes on the wire and latency of repeated fetches of the stats page with and without HAProxyStatsClient.
+
+A local stand-in for the stats page serves the same synthetic payload, gzip-compressed when asked to. Each new
+connection can be delayed to stand for the handshake with a remote HAProxy::
+
+    python -m benchmarks.bench_http_client --backends 100 --servers 20 --repeat 20 --connect-delay-ms 2
+"""
+
+from __future__ import print_function
+
+import argparse
+import gzip
+import io
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+from check_haproxy_stats import haproxy_util
+
+from .statsgen import generate_stats_csv
+
+
+class CountingWriter(object):
+    """File-like wrapper adding the length of everything written to the totals of its server."""
+
+    def __init__(self, f, server):
+        self.f = f
+        self.server = server
+
+    def write(self, data):
+        self.server.bytes_sent += len(data)
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class StatsPageServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    bytes_sent = 0
+    connections = 0
+
+
+def serve_http(payload, connect_delay):
+    """Serve payload as a keep-alive CSV stats page on a random local port and return the server."""
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode="wb") as f:
+        f.write(payload)
+    compressed = compressed.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            self.server.connections += 1
+            time.sleep(connect_delay)
+            self.wfile = CountingWriter(self.wfile, self.server)
+
+        def do_GET(self):
+            gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+            body = compressed if gzipped else payload
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            if gzipped:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = StatsPageServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def fetch_uncompressed(base_url_path):
+    r = requests.get("http://{0}/;csv;norefresh".format(base_url_path), headers={"Accept-Encoding": "identity"},
+                     timeout=5)
+    r.raise_for_status()
+    return r.text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=100)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--connect-delay-ms", type=float, default=0, help="Delay of every new connection.")
+    args = parser.parse_args()
+
+    payload = generate_stats_csv(args.backends, args.servers).encode("utf-8")
+    server = serve_http(payload, args.connect_delay_ms / 1000.0)
+    base_url_path = "127.0.0.1:{0}/haproxy/stats".format(server.server_address[1])
+    print("payload: {0} bytes, {1} server rows, {2} fetches".format(
+        len(payload), args.backends * args.servers, args.repeat))
+    client = haproxy_util.HAProxyStatsClient(base_url_path)
+    candidates = [("new connection, identity", lambda: fetch_uncompressed(base_url_path)),
+                  ("new connection, gzip", lambda: haproxy_util.fetch_stats_http(base_url_path)),
+                  ("HAProxyStatsClient", client.fetch)]
+    try:
+        for name, fetch in candidates:
+            server.bytes_sent = server.connections = 0
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                fetch()
+                timings.append(time.perf_counter() - start)
+            print("{0:>26}: {1:3d} connections  {2:9.1f} KiB sent  min {3:7.2f} ms  mean {4:7.2f} ms".format(
+                name, server.connections, server.bytes_sent / 1024.0, min(timings) * 1000,
+                sum(timings) / len(timings) * 1000))
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Compare CPU time and peak memory of parsing the stats with haproxystats and with haproxy_util.iter_stats.
+
+The stats are generated locally, so only parsing and aggregation are measured::
+
+    python -m benchmarks.bench_parser --backends 500 --servers 40
+
+--select also measures selecting every Nth backend by name, e.g. 1000 of 5000 backends with ``--select 5``.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+import tracemalloc
+
+from mock import patch
+
+from check_haproxy_stats import check_haproxy_stats_up, haproxy_util
+
+from .statsgen import generate_stats_csv
+
+try:
+    import haproxystats
+except ImportError:  # only needed for the comparison, see requirements_dev.txt
+    haproxystats = None
+
+
+def haproxystats_request_stats(stats_csv):
+    """Return per backend hrsp_* counters the way get_request_stats did with haproxystats."""
+    with patch.object(haproxystats.HAProxyServer, "_fetch", return_value=stats_csv):
+        h = haproxystats.HAProxyServer("127.0.0.1/haproxy/stats")
+    return dict((b.name, (b.hrsp_1xx, b.hrsp_2xx, b.hrsp_3xx, b.hrsp_4xx, b.hrsp_5xx, b.hrsp_other))
+                for b in h.backends)
+
+
+def haproxystats_up_count(stats_csv):
+    """Return per backend up counts the way get_haproxy_services_up_count_for_backends did with haproxystats."""
+    with patch.object(haproxystats.HAProxyServer, "_fetch", return_value=stats_csv):
+        h = haproxystats.HAProxyServer("127.0.0.1/haproxy/stats")
+    counts = {}
+    for listener in h.listeners:
+        if listener.status not in ["no check", "MAINT"]:
+            count, up_count = counts.get(listener.pxname, (0, 0))
+            counts[listener.pxname] = (count + 1, up_count + ("UP" in listener.status))
+    return counts
+
+
+def iter_stats_request_stats(stats_csv):
+    with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=stats_csv):
+        return haproxy_util.get_request_stats_for_backends(None)
+
+
+def iter_stats_up_count(stats_csv):
+    with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=stats_csv):
+        return check_haproxy_stats_up.get_haproxy_services_up_count_for_backends("127.0.0.1/haproxy/stats")
+
+
+def selected_request_stats(backends):
+    def f(stats_csv):
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=stats_csv):
+            return haproxy_util.get_request_stats_for_backends(backends)
+    return f
+
+
+def selected_up_count(backends):
+    def f(stats_csv):
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=stats_csv):
+            return check_haproxy_stats_up.get_haproxy_services_up_count_for_backends(
+                "127.0.0.1/haproxy/stats", backends=backends)
+    return f
+
+
+def measure(f, stats_csv):
+    """Return (CPU seconds, peak bytes allocated) of f(stats_csv), each measured in a separate run."""
+    start = time.process_time()
+    f(stats_csv)
+    cpu = time.process_time() - start
+    tracemalloc.start()
+    f(stats_csv)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=500)
+    parser.add_argument("--servers", type=int, default=40)
+    parser.add_argument("--select", type=int, default=0, help="Also select every Nth backend by name.")
+    args = parser.parse_args()
+
+    stats_csv = generate_stats_csv(args.backends, args.servers)
+    print("payload: {0} bytes, {1} server rows".format(len(stats_csv), args.backends * args.servers))
+    candidates = [("iter_stats request stats", iter_stats_request_stats),
+                  ("iter_stats up count", iter_stats_up_count)]
+    if args.select:
+        backends = ["backend-{0}".format(b) for b in range(0, args.backends, args.select)]
+        candidates += [("selected request stats", selected_request_stats(backends)),
+                       ("selected up count", selected_up_count(backends))]
+    if haproxystats is not None:
+        candidates = [("haproxystats request stats", haproxystats_request_stats),
+                      ("haproxystats up count", haproxystats_up_count)] + candidates
+    for name, f in candidates:
+        cpu, peak = measure(f, stats_csv)
+        print("{0:>28}: cpu {1:9.2f} ms  peak {2:9.1f} KiB".format(name, cpu * 1000, peak / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
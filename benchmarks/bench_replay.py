@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Record a synthetic hour of stats, then replay it through get_hrsp_5xx_ratio and check_haproxy_up_rates.
+
+Every poll moves the counters of a share of the servers and of every backend, like live traffic does. The size of
+the recording is compared with gzip of every whole snapshot, and the replay is timed::
+
+    python -m benchmarks.bench_replay --backends 100 --servers 20 --duration 3600 --poll-interval 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import gzip
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from check_haproxy_stats import check_haproxy_stats_up, haproxy_util, stats_recording
+
+from .statsgen import FIELDS, generate_stats_csv
+
+MOVING = [FIELDS.index(field) for field in ("stot", "req_tot", "hrsp_2xx", "hrsp_5xx", "scur", "qcur")]
+
+
+def evolve(stats_csv, rng, share):
+    """Return stats_csv with the moving counters of share of the servers, and of every backend, increased."""
+    lines = stats_csv.split("\n")
+    for i, line in enumerate(lines[1:], 1):
+        cells = line.split(",")
+        if len(cells) < len(FIELDS) or cells[1] == "FRONTEND" or cells[1] != "BACKEND" and rng.random() > share:
+            continue
+        for column in MOVING:
+            cells[column] = str(int(cells[column] or 0) + rng.randint(0, 20))
+        lines[i] = ",".join(cells)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=100)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--duration", type=int, default=3600)
+    parser.add_argument("--poll-interval", type=int, default=10)
+    parser.add_argument("--moving-share", type=float, default=0.2, help="Share of the servers moving every poll.")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "haproxy.rec.gz")
+        stats_csv = generate_stats_csv(args.backends, args.servers)
+        whole = io.BytesIO()
+        recorded = 0
+        with stats_recording.StatsRecorder(path) as recorder, \
+                gzip.GzipFile(fileobj=whole, mode="wb", compresslevel=6) as f:
+            for timestamp in range(0, args.duration + 1, args.poll_interval):
+                started = time.perf_counter()
+                recorder.record(stats_csv, 1500000000 + timestamp)
+                recorded += time.perf_counter() - started
+                f.write(stats_csv.encode("utf-8"))
+                stats_csv = evolve(stats_csv, rng, args.moving_share)
+        print("{0} snapshots of {1} bytes: recording {2:.1f} KiB, gzip of whole snapshots {3:.1f} KiB, "
+              "recorded in {4:.2f} s".format(recorder.recorded, len(stats_csv), os.path.getsize(path) / 1024.0,
+                                             len(whole.getvalue()) / 1024.0, recorded))
+
+        started = time.perf_counter()
+        checks = 0
+        with stats_recording.StatsReplay(path) as replay:
+            while not replay.finished:
+                haproxy_util.get_hrsp_5xx_ratio("backend-1", "replay", None, None, 60, cache=replay)
+                check_haproxy_stats_up.get_haproxy_services_up_count_for_backends("replay", cache=replay)
+                checks += 1
+        print("replayed {0} s of stats through {1} 5xx and up checks in {2:.2f} s".format(
+            args.duration, checks, time.perf_counter() - started))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Measure the cold-start time of every subcommand, as Sensu pays it on every run of a check.
+
+Each subcommand is started --runs times in a fresh interpreter with --help, which exits right after parsing the
+arguments, and the median wall time is reported next to the import time of the package from ``-X importtime``::
+
+    python -m benchmarks.bench_startup --runs 20
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from check_haproxy_stats import cli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(args):
+    """Return (wall seconds, import time of the package in microseconds) of a fresh interpreter running args."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-X", "importtime"] + args, cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    wall = time.perf_counter() - start
+    package = 0
+    for line in stderr.decode("utf-8").splitlines():
+        fields = line[len("import time:"):].split("|")
+        if line.startswith("import time:") and len(fields) == 3 and fields[2].strip().startswith("check_haproxy"):
+            package = max(package, int(fields[1]))
+    return wall, package
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = sorted(_run(["-c", "pass"])[0] for _ in range(args.runs))[args.runs // 2]
+    print("{0:>12}: wall {1:8.1f} ms".format("python", baseline * 1000))
+    for name, _, _, _ in cli.SUBCOMMANDS:
+        runs = sorted(_run(["-m", "check_haproxy_stats.cli", name, "--help"]) for _ in range(args.runs))
+        wall, package = runs[args.runs // 2]
+        print("{0:>12}: wall {1:8.1f} ms  package import {2:8.1f} ms".format(name, wall * 1000, package / 1000.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Compare get_request_stats over the HTTP stats page and over the stats socket.
+
+Both transports are served locally from the same synthetic payload::
+
+    python -m benchmarks.bench_stats_socket --backends 100 --servers 20 --repeat 20
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import timeit
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from check_haproxy_stats import haproxy_util
+
+from .statsgen import generate_stats_csv
+
+
+def serve_http(payload):
+    """Serve payload as the CSV stats page on a random local port and return the base url path."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "127.0.0.1:{0}/haproxy/stats".format(server.server_address[1])
+
+
+def serve_socket(payload, path):
+    """Answer every connection on the UNIX socket path with payload, like ``show stat``."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(16)
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            conn.recv(1024)
+            conn.sendall(payload)
+            conn.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=100)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = generate_stats_csv(args.backends, args.servers).encode("utf-8")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        stats_socket = os.path.join(tmpdir, "haproxy.sock")
+        serve_socket(payload, stats_socket)
+        base_url_path = serve_http(payload)
+        print("payload: {0} bytes, {1} server rows".format(len(payload), args.backends * args.servers))
+        for name, kwargs in [("http", {"base_url_path": base_url_path}),
+                             ("socket", {"base_url_path": base_url_path, "stats_socket": stats_socket})]:
+            timings = timeit.repeat(
+                lambda: haproxy_util.get_request_stats("backend-", **kwargs), number=1, repeat=args.repeat)
+            print("{0:>8}: min {1:8.2f} ms  mean {2:8.2f} ms".format(
+                name, min(timings) * 1000, sum(timings) / len(timings) * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
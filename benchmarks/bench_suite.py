@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Time the public functions of the checks on generated stats from 10 to 100k rows and compare against a baseline.
+
+The stats are generated locally and fetching is stubbed out, so the suite runs offline and measures parsing,
+aggregation and checking only. Every case reports the best wall time of --repeat runs and the tracemalloc peak of
+one more run. Save a report, change the code, and compare::
+
+    python -m benchmarks.bench_suite --output baseline.json
+    python -m benchmarks.bench_suite --baseline baseline.json --output current.json
+
+With --baseline the exit code is 1 when any case got slower by more than --threshold, and by more than --min-delta-ms
+so that timer noise on the smallest scales is not reported.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from mock import patch
+
+from check_haproxy_stats import check_haproxy_stats_up, haproxy_util
+
+from .statsgen import generate_stats_csv
+
+
+def _get_request_stats():
+    haproxy_util.get_request_stats("backend-0")
+
+
+def _get_hrsp_5xx_ratio():
+    with patch("time.sleep"):
+        haproxy_util.get_hrsp_5xx_ratio("backend-0", "127.0.0.1/haproxy/stats", None, None, 60)
+
+
+def _get_haproxy_services_up_count_for_backends():
+    check_haproxy_stats_up.get_haproxy_services_up_count_for_backends("127.0.0.1/haproxy/stats")
+
+
+def _check_haproxy_up_rates():
+    with patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True):
+        check_haproxy_stats_up.check_haproxy_up_rates("127.0.0.1/haproxy/stats")
+
+
+CASES = [
+    ("get_request_stats", _get_request_stats),
+    ("get_hrsp_5xx_ratio", _get_hrsp_5xx_ratio),
+    ("get_haproxy_services_up_count_for_backends", _get_haproxy_services_up_count_for_backends),
+    ("check_haproxy_up_rates", _check_haproxy_up_rates),
+]
+
+
+def measure(f, repeat):
+    """Return (best wall seconds of repeat runs, peak bytes allocated by one more run) of f()."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(rows_list, servers, repeat, seed):
+    """Return the results of every case at every scale."""
+    results = []
+    for rows in rows_list:
+        backend_servers = max(min(servers, rows - 2), 1)
+        backends = max(rows // (backend_servers + 1), 1)
+        stats_csv = generate_stats_csv(backends, backend_servers, seed=seed)
+        actual_rows = 1 + backends * (backend_servers + 1)
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=stats_csv):
+            for name, f in CASES:
+                wall, peak = measure(f, repeat)
+                results.append({"case": name, "rows": actual_rows, "wall_ms": wall * 1000, "peak_kib": peak / 1024.0})
+                print("{0:>44} {1:>7} rows: wall {2:10.3f} ms  peak {3:10.1f} KiB".format(
+                    name, actual_rows, wall * 1000, peak / 1024.0))
+    return results
+
+
+def compare(results, baseline, threshold, min_delta_ms=1.0):
+    """Print the change of every case against the baseline and return the cases that regressed."""
+    previous = dict(((r["case"], r["rows"]), r) for r in baseline["results"])
+    regressions = []
+    print()
+    print("{0:>44} {1:>7}  {2:>10}  {3:>10}".format("vs baseline", "rows", "wall", "peak"))
+    for r in results:
+        before = previous.get((r["case"], r["rows"]))
+        if before is None:
+            continue
+        wall_change = r["wall_ms"] / before["wall_ms"] - 1 if before["wall_ms"] else 0.0
+        peak_change = r["peak_kib"] / before["peak_kib"] - 1 if before["peak_kib"] else 0.0
+        regressed = wall_change > threshold and r["wall_ms"] - before["wall_ms"] > min_delta_ms
+        print("{0:>44} {1:>7}  {2:>+9.1%}  {3:>+9.1%}{4}".format(
+            r["case"], r["rows"], wall_change, peak_change, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--servers", type=int, default=10, help="Servers per backend.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File to save the report to, as JSON.")
+    parser.add_argument("--baseline", help="Report of a previous run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Slowdown of a case reported as a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="Slowdown (in ms) never reported as a regression.")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.servers, args.repeat, args.seed)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "servers": args.servers,
+              "repeat": args.repeat, "seed": args.seed, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold, args.min_delta_ms):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
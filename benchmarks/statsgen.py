@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Generate synthetic HAProxy stats CSV payloads for benchmarks."""
+
+import random
+
+FIELDS = [
+    "pxname", "svname", "qcur", "qmax", "scur", "smax", "slim", "stot", "bin", "bout", "dreq", "dresp", "ereq",
+    "econ", "eresp", "wretr", "wredis", "status", "weight", "act", "bck", "chkfail", "chkdown", "lastchg",
+    "downtime", "qlimit", "pid", "iid", "sid", "throttle", "lbtot", "tracked", "type", "rate", "rate_lim",
+    "rate_max", "check_status", "check_code", "check_duration", "hrsp_1xx", "hrsp_2xx", "hrsp_3xx", "hrsp_4xx",
+    "hrsp_5xx", "hrsp_other", "hanafail", "req_rate", "req_rate_max", "req_tot", "cli_abrt", "srv_abrt",
+    "comp_in", "comp_out", "comp_byp", "comp_rsp", "lastsess", "last_chk", "last_agt", "qtime", "ctime", "rtime",
+    "ttime", "agent_status", "agent_code", "agent_duration", "check_desc", "agent_desc", "check_rise",
+    "check_fall", "check_health", "agent_rise", "agent_fall", "agent_health", "addr", "cookie", "mode", "algo",
+    "conn_rate", "conn_rate_max", "conn_tot", "intercepted", "dcon", "dses",
+]
+
+HRSP_FIELDS = ["hrsp_1xx", "hrsp_2xx", "hrsp_3xx", "hrsp_4xx", "hrsp_5xx", "hrsp_other"]
+
+# Share of each response class in generated traffic.
+HRSP_WEIGHTS = [0.001, 0.9, 0.05, 0.04, 0.008, 0.001]
+
+STATUSES = [("UP", 0.85), ("DOWN", 0.05), ("no check", 0.05), ("MAINT", 0.03), ("UP 1/3", 0.02)]
+
+
+def _pick_status(rng, statuses):
+    r = rng.random()
+    for status, weight in statuses:
+        if r < weight:
+            return status
+        r -= weight
+    return "UP"
+
+
+def _row(values):
+    return ",".join(str(values.get(f, "")) for f in FIELDS) + ","
+
+
+def _server_values(rng, pxname, svname, iid, sid, requests, statuses=STATUSES, hrsp_weights=HRSP_WEIGHTS):
+    values = {
+        "pxname": pxname, "svname": svname, "iid": iid, "sid": sid, "pid": 1, "type": 2, "mode": "http",
+        "status": _pick_status(rng, statuses), "weight": 1, "act": 1, "bck": 0, "lbtot": requests, "stot": requests,
+        "scur": rng.randint(0, 50), "smax": rng.randint(50, 200), "slim": 256, "qcur": rng.randint(0, 3),
+        "qmax": rng.randint(3, 20), "qlimit": "", "bin": requests * 512, "bout": requests * 4096,
+        "qtime": rng.randint(0, 5), "ctime": rng.randint(0, 5), "rtime": rng.randint(5, 200),
+        "ttime": rng.randint(10, 400), "check_status": "L7OK", "check_code": 200, "check_duration": 1,
+        "addr": "10.0.{0}.{1}:80".format(iid % 256, sid % 256), "req_tot": requests,
+    }
+    remaining = requests
+    for field, weight in zip(HRSP_FIELDS[1:], hrsp_weights[1:]):
+        count = int(requests * weight * rng.uniform(0.5, 1.5))
+        values[field] = count
+        remaining -= count
+    values["hrsp_1xx"] = max(remaining, 0)
+    return values
+
+
+def generate_stats_csv(backends=10, servers=10, frontends=1, max_requests=1000000, seed=0, statuses=STATUSES,
+                       hrsp_weights=HRSP_WEIGHTS):
+    """Return a stats CSV payload with backends x servers server rows plus FRONTEND and BACKEND rows.
+
+    Server rows carry statuses drawn from statuses ((status, probability) pairs) and up to max_requests requests split
+    between response classes by hrsp_weights. BACKEND rows carry the sums of their servers just like HAProxy.
+    The same arguments always produce the same payload.
+    """
+    rng = random.Random(seed)
+    lines = ["# " + ",".join(FIELDS) + ","]
+    for i in range(frontends):
+        lines.append(_row({"pxname": "frontend-{0}".format(i), "svname": "FRONTEND", "iid": i + 1, "type": 0,
+                           "status": "OPEN", "mode": "http"}))
+    for b in range(backends):
+        iid = frontends + b + 1
+        pxname = "backend-{0}".format(b)
+        totals = dict.fromkeys(HRSP_FIELDS + ["stot", "scur", "qcur", "bin", "bout", "req_tot"], 0)
+        for s in range(servers):
+            values = _server_values(rng, pxname, "server-{0}".format(s), iid, s + 1, rng.randint(0, max_requests),
+                                    statuses, hrsp_weights)
+            for field in totals:
+                totals[field] += values[field]
+            lines.append(_row(values))
+        totals.update({"pxname": pxname, "svname": "BACKEND", "iid": iid, "sid": 0, "pid": 1, "type": 1,
+                       "status": "UP", "mode": "http", "act": servers, "bck": 0, "slim": 256 * servers,
+                       "algo": "roundrobin"})
+        lines.append(_row(totals))
+    return "\n".join(lines) + "\n\n"
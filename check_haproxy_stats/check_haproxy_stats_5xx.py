@@ -5,7 +5,7 @@ from __future__ import print_function
 import argparse
 import sys
 
-from . import haproxy_util
+from . import counter_history, haproxy_util, stats_cache, timing
 
 RETURN_CODES = {"OK": 0, "WARNING": 1, "CRITICAL": 2, "UNKNOWN": 3}
 
@@ -21,6 +21,15 @@ def unknown_exception(f):
     return f_wrapper
 
 
+def _parse_window(value):
+    """Return (seconds, warning ratio, critical ratio) of a --window given as SECONDS:WARNING:CRITICAL."""
+    try:
+        seconds, warning_ratio, critical_ratio = value.split(":")
+        return int(seconds), float(warning_ratio), float(critical_ratio)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected SECONDS:WARNING:CRITICAL, got {0}".format(value))
+
+
 def _get_parser():
     """Return an argparse parser.
 
@@ -28,15 +37,67 @@ def _get_parser():
     :rtype: :py:class:`argparse.ArgumentParser`
     """
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("--backend", required=True, help="Backend to check 5xx ratio.")
+    parser.add_argument(
+        "--backend", dest="backends", action="append", required=True,
+        help="Backend to check 5xx ratio, may be repeated. Matches backends starting with it, or named exactly it with "
+             "a leading '=', or matching it when a glob or a regex with a leading '~'. 'all' checks every backend "
+             "separately.")
     parser.add_argument(
         "--warning-ratio", type=float, default=0.01, help="500x ratio above which we should throw warning.")
     parser.add_argument(
         "--critical-ratio", type=float, default=0.02, help="500x ratio above which we should throw critical.")
-    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument(
+        "--base-url-path", dest="base_url_paths", action="append", default=[],
+        help="Stats endpoint, may be repeated to check a fleet of nodes concurrently. Defaults to "
+             "127.0.0.1/haproxy/stats")
     parser.add_argument("--username", help="Username to login to haproxy stats page.")
     parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser)
     parser.add_argument("--interval", type=int, default=60, help="Time to observe 500 rates (in seconds).")
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for each stats fetch (in seconds).")
+    parser.add_argument(
+        "--daemon-socket",
+        help="Ask the check-haproxy-statsd daemon listening on this socket, fetching the stats directly only if it "
+             "cannot answer.")
+    parser.add_argument(
+        "--window", dest="windows", action="append", type=_parse_window, metavar="SECONDS:WARNING:CRITICAL",
+        help="Check the ratio over the last SECONDS with its own thresholds instead of --interval, may be repeated "
+             "(e.g. 60:0.05:0.1 and 900:0.01:0.02). Every window is answered from the samples of --daemon-socket "
+             "or --history-file.")
+    parser.add_argument(
+        "--state-file",
+        help="Save counters to this file and compute the ratio against the previous run instead of sleeping.")
+    parser.add_argument(
+        "--history-file",
+        help="Append the counters to this fixed-size ring file and compute the ratio over the samples it holds "
+             "instead of sleeping, see check-haproxy-stats history.")
+    parser.add_argument(
+        "--history-slots", type=int, default=128, help="Backends a new --history-file has room for.")
+    parser.add_argument(
+        "--history-capacity", type=int, default=1440, help="Samples of every backend a new --history-file keeps.")
+    parser.add_argument(
+        "--max-state-age", type=int, default=300,
+        help="Age (in seconds) above which a saved snapshot, or the oldest sample of --history-file, is ignored and "
+             "--interval is sampled instead.")
+    parser.add_argument(
+        "--outliers", action="store_true",
+        help="Also check the 5xx ratio of every server against the other servers of its backend, from the same "
+             "samples. A server is WARNING when it is an outlier, CRITICAL when its ratio is also above "
+             "--critical-ratio.")
+    parser.add_argument(
+        "--outlier-deviations", type=float, default=3.0,
+        help="Standard deviations above the ratio of its peers from which a server is an outlier.")
+    parser.add_argument(
+        "--outlier-min-requests", type=int, default=100,
+        help="Requests a server must have served during --interval to be checked for outliers.")
+    parser.add_argument(
+        "--sample-interval", type=int,
+        help="Sample the stats every this many seconds during --interval, and report as soon as the ratio of every "
+             "backend is surely above --critical-ratio or below --warning-ratio.")
+    parser.add_argument(
+        "--early-exit-deviations", type=float, default=3.0,
+        help="Standard deviations the ratio of a backend must be above --critical-ratio, or below --warning-ratio, "
+             "to report before the end of --interval.")
     return parser
 
 
@@ -96,23 +157,200 @@ def _handle_unknown(exception_message):
     return RETURN_CODES["UNKNOWN"]
 
 
-@unknown_exception
-def _check_haproxy_rates(backend, warning_ratio, critical_ratio, base_url_path, username, password, interval):
-    """Return appropriate exit code and print informational message.
+def _check_ratios(hrsp_5xx_ratios, backends, warning_ratio, critical_ratio, interval, location=""):
+    """Print informational message for every backend and return the most severe exit code.
+
+    :return: Exit Code (depending on severity)
+    :rtype: :py:class:`int`
+    """
+    if not backends and not hrsp_5xx_ratios:
+        return _handle_unknown("Did not find any backends{0}".format(location))
+
+    rc = RETURN_CODES["OK"]
+    for backend in backends or sorted(hrsp_5xx_ratios):
+        if backend not in hrsp_5xx_ratios:
+            rc = max(rc, _handle_unknown("Did not find backends starting with {0}{1}".format(backend, location)))
+            continue
+
+        hrsp_5xx_ratio_interval = hrsp_5xx_ratios[backend]
+        if hrsp_5xx_ratio_interval > critical_ratio:
+            handler = _handle_critical
+        elif hrsp_5xx_ratio_interval > warning_ratio:
+            handler = _handle_warning
+        else:
+            handler = _handle_ok
+
+        rc = max(rc, handler(backend + location, hrsp_5xx_ratio_interval, warning_ratio, critical_ratio, interval))
+    return rc
+
+
+def _check_outliers(outliers, backends, critical_ratio, interval):
+    """Print informational message for every outlier server and return the most severe exit code.
 
     :return: Exit Code (depending on severity)
     :rtype: :py:class:`int`
     """
-    hrsp_5xx_ratio_interval = haproxy_util.get_hrsp_5xx_ratio(backend, base_url_path, username, password, interval)
+    rc = RETURN_CODES["OK"]
+    for backend in backends or sorted(outliers):
+        for server, requests, ratio, peers_ratio, deviations in outliers.get(backend, ()):
+            print("{backend} server {server} has HTTP 5xx ratio of {ratio:.4f} over {requests} requests in the past "
+                  "{interval} seconds, {deviations:.1f} standard deviations above its peers ({peers_ratio:.4f})".format(
+                      backend=backend, server=server, ratio=ratio, requests=requests, interval=interval,
+                      deviations=deviations, peers_ratio=peers_ratio))
+            rc = max(rc, RETURN_CODES["CRITICAL"] if ratio > critical_ratio else RETURN_CODES["WARNING"])
+    return rc
+
+
+def _check_fleet_rates(backends, warning_ratio, critical_ratio, endpoints, username, password, interval, timeout,
+                       cache=None):
+    """Check every node of a fleet and the fleet as a whole from concurrent samples of all nodes.
+
+    A node that cannot be sampled, or a backend missing from a node, is reported UNKNOWN without affecting the status
+    of the check: only the backends found on a node and the fleet as a whole are.
 
-    if hrsp_5xx_ratio_interval > critical_ratio:
-        handler = _handle_critical
-    elif hrsp_5xx_ratio_interval > warning_ratio:
-        handler = _handle_warning
+    :return: Exit Code (depending on severity)
+    :rtype: :py:class:`int`
+    """
+    nodes, cluster_ratios = haproxy_util.get_hrsp_5xx_ratios_for_endpoints(
+        backends, endpoints, username, password, interval, timeout, cache)
+
+    rc = RETURN_CODES["OK"]
+    answered = 0
+    for endpoint in endpoints:
+        hrsp_5xx_ratios, error = nodes[endpoint]
+        if error is not None:
+            _handle_unknown("{0} on node {1}".format(str(error)[:256], endpoint))
+            continue
+        answered += 1
+        location = " on {0}".format(endpoint)
+        found = [backend for backend in backends or () if backend in hrsp_5xx_ratios]
+        for backend in backends or ():
+            if backend not in hrsp_5xx_ratios:  # the fleet-wide check tells whether it is missing everywhere
+                _handle_unknown("Did not find backends starting with {0}{1}".format(backend, location))
+        if hrsp_5xx_ratios and (found or not backends):
+            rc = max(rc, _check_ratios(
+                hrsp_5xx_ratios, found or None, warning_ratio, critical_ratio, interval, location))
+
+    if not answered:
+        return _handle_unknown("None of the {0} nodes could be sampled".format(len(endpoints)))
+    return max(rc, _check_ratios(
+        cluster_ratios, backends, warning_ratio, critical_ratio, interval, " across {0} nodes".format(answered)))
+
+
+def _get_history_windows(backends, seconds, history_file):
+    """Return the results of every window of seconds from history_file, like the daemon answers them."""
+    results = []
+    with counter_history.HistoryFile(history_file) as history:
+        for window in seconds:
+            try:
+                ratios, interval = history.get_hrsp_5xx_ratios(backends, window)
+                results.append({"ratios": ratios, "interval": interval})
+            except ValueError as e:
+                results.append({"error": str(e)})
+    return {"windows": results}
+
+
+def _check_windows(backends, windows, daemon_socket, history_file=None):
+    """Check the ratios over every (seconds, warning ratio, critical ratio) of windows from one query of the daemon.
+
+    With history_file the windows are read from that ring file (see :py:class:`counter_history.HistoryFile`) instead.
+
+    :return: Exit Code (depending on severity)
+    :rtype: :py:class:`int`
+    """
+    seconds = [window for window, _, _ in windows]
+    if history_file:
+        response = _get_history_windows(backends, seconds, history_file)
     else:
-        handler = _handle_ok
+        response = haproxy_util.query_daemon(daemon_socket, {"check": "5xx", "backends": backends, "windows": seconds})
+    rc = RETURN_CODES["OK"]
+    for (seconds, warning_ratio, critical_ratio), result in zip(windows, response["windows"]):
+        if "error" in result:
+            rc = max(rc, _handle_unknown(result["error"]))
+            continue
+        rc = max(rc, _check_ratios(
+            result["ratios"], backends, warning_ratio, critical_ratio, int(round(result["interval"]))))
+    return rc
+
+
+@unknown_exception
+def _check_haproxy_rates(backends, warning_ratio, critical_ratio, base_url_path, username, password, interval,
+                         state_file=None, max_state_age=300, stats_socket=None, timeout=5, daemon_socket=None,
+                         windows=None, cache=None, outliers=None, early_exit=None, history_file=None,
+                         history_slots=128, history_capacity=1440):
+    """Print informational message for every backend and return the most severe exit code.
+
+    All backends are computed from the same pair of stats snapshots, None checks every backend. base_url_path may be
+    a list of stats endpoints, which are then sampled concurrently and checked per node and fleet-wide. With
+    daemon_socket the ratios come from the check-haproxy-statsd daemon when it can answer. windows, a list of
+    (seconds, warning ratio, critical ratio), are all answered by the daemon in place of interval and the ratios.
+    With a cache (see :py:class:`stats_cache.StatsCache`) the stats are shared with the checks run at the same time.
+    outliers, (minimum requests, deviations), also checks every server against its peers from the same samples.
+    early_exit, (sample interval, deviations), samples interval in steps and returns once every ratio is decided.
+    history_file, a :py:class:`counter_history.HistoryFile` of history_slots backends of history_capacity samples
+    when new, takes the place of state_file and answers windows too.
 
-    return handler(backend, hrsp_5xx_ratio_interval, warning_ratio, critical_ratio, interval)
+    :return: Exit Code (depending on severity)
+    :rtype: :py:class:`int`
+    """
+    endpoints = base_url_path if isinstance(base_url_path, (list, tuple)) else [base_url_path]
+    if outliers:
+        if len(endpoints) > 1 or state_file or history_file or daemon_socket or windows:
+            raise ValueError("--outliers needs both samples of every server, it only supports a single "
+                             "--base-url-path without --state-file, --history-file, --daemon-socket or --window")
+        min_requests, deviations = outliers
+        hrsp_5xx_ratios, server_outliers = haproxy_util.get_hrsp_5xx_ratios_and_outliers(
+            backends, endpoints[0], username, password, interval, stats_socket, timeout, cache, min_requests,
+            deviations)
+        return max(_check_ratios(hrsp_5xx_ratios, backends, warning_ratio, critical_ratio, interval),
+                   _check_outliers(server_outliers, backends, critical_ratio, interval))
+    if early_exit:
+        if len(endpoints) > 1 or state_file or history_file or daemon_socket or windows:
+            raise ValueError("--sample-interval samples a single --base-url-path, it does not support --state-file, "
+                             "--history-file, --daemon-socket or --window")
+        sample_interval, deviations = early_exit
+        hrsp_5xx_ratios, interval = haproxy_util.get_hrsp_5xx_ratios_adaptive(
+            backends, endpoints[0], username, password, interval, warning_ratio, critical_ratio, sample_interval,
+            deviations, stats_socket, timeout, cache)
+        return _check_ratios(hrsp_5xx_ratios, backends, warning_ratio, critical_ratio, int(round(interval)))
+    if len(endpoints) > 1:
+        if state_file or history_file or stats_socket or daemon_socket:
+            raise ValueError("--state-file, --history-file, --stats-socket and --daemon-socket only support a single "
+                             "--base-url-path")
+        return _check_fleet_rates(backends, warning_ratio, critical_ratio, endpoints, username, password, interval,
+                                  timeout, cache)
+    if state_file and history_file:
+        raise ValueError("--state-file and --history-file both keep the counters between runs, use only one")
+    if windows:
+        if not daemon_socket and not history_file:
+            raise ValueError("--window needs --daemon-socket or --history-file, only they keep samples covering every "
+                             "window")
+        return _check_windows(backends, windows, daemon_socket, history_file)
+
+    response = None
+    if daemon_socket:
+        try:
+            response = haproxy_util.query_daemon(
+                daemon_socket, {"check": "5xx", "backends": backends, "interval": interval})
+        except Exception:  # daemon down or still collecting, fetch directly
+            pass
+
+    if response is not None:
+        hrsp_5xx_ratios, interval = response["ratios"], int(round(response["interval"]))
+    elif state_file:
+        hrsp_5xx_ratios, interval = haproxy_util.get_hrsp_5xx_ratios_stateful(
+            backends, endpoints[0], username, password, interval, state_file, max_state_age, stats_socket, timeout,
+            cache)
+        interval = int(round(interval))
+    elif history_file:
+        hrsp_5xx_ratios, interval = counter_history.get_hrsp_5xx_ratios_history(
+            backends, endpoints[0], username, password, interval, history_file, stats_socket, timeout, cache,
+            history_slots, history_capacity, max_state_age)
+        interval = int(round(interval))
+    else:
+        hrsp_5xx_ratios = haproxy_util.get_hrsp_5xx_ratios(
+            backends, endpoints[0], username, password, interval, stats_socket, timeout, cache)
+    return _check_ratios(hrsp_5xx_ratios, backends, warning_ratio, critical_ratio, interval)
 
 
 def main():
@@ -123,13 +361,35 @@ def main():
     """
     parser = _get_parser()
     args = parser.parse_args()
-    rc = _check_haproxy_rates(backend=args.backend,
-                              warning_ratio=args.warning_ratio,
-                              critical_ratio=args.critical_ratio,
-                              base_url_path=args.base_url_path,
-                              username=args.username,
-                              password=args.password,
-                              interval=args.interval)
+    if args.cache_dir and args.cache_ttl >= args.interval:
+        parser.error("--cache-ttl must be shorter than --interval, or both samples would be the same stats")
+    if args.cache_dir and args.sample_interval and args.cache_ttl >= args.sample_interval:
+        parser.error("--cache-ttl must be shorter than --sample-interval, or samples would be the same stats")
+    if args.outliers and args.sample_interval:
+        parser.error("--outliers needs both samples of the whole --interval, it does not support --sample-interval")
+    cache = stats_cache.StatsCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None
+    outliers = (args.outlier_min_requests, args.outlier_deviations) if args.outliers else None
+    early_exit = (args.sample_interval, args.early_exit_deviations) if args.sample_interval else None
+    with timing.Report(enabled=args.perfdata):
+        rc = _check_haproxy_rates(backends=None if "all" in args.backends else args.backends,
+                                  warning_ratio=args.warning_ratio,
+                                  critical_ratio=args.critical_ratio,
+                                  base_url_path=args.base_url_paths or ["127.0.0.1/haproxy/stats"],
+                                  username=args.username,
+                                  password=args.password,
+                                  interval=args.interval,
+                                  state_file=args.state_file,
+                                  max_state_age=args.max_state_age,
+                                  stats_socket=args.stats_socket,
+                                  timeout=args.timeout,
+                                  daemon_socket=args.daemon_socket,
+                                  windows=args.windows,
+                                  cache=cache,
+                                  outliers=outliers,
+                                  early_exit=early_exit,
+                                  history_file=args.history_file,
+                                  history_slots=args.history_slots,
+                                  history_capacity=args.history_capacity)
     return rc
 
 
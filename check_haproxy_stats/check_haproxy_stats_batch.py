@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Run many checks of one HAProxy from a config file, all evaluated against the same fetches of the stats."""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+from . import check_haproxy_stats_5xx, check_haproxy_stats_latency, check_haproxy_stats_saturation
+from . import check_haproxy_stats_up, haproxy_util, timing
+
+RETURN_CODES = {"OK": 0, "WARNING": 1, "CRITICAL": 2, "UNKNOWN": 3}
+
+STATUSES = dict((code, status) for status, code in RETURN_CODES.items())
+
+# Options every type of check accepts on top of name, type and backends, with their defaults.
+CHECK_OPTIONS = {
+    "5xx": {"warning_ratio": 0.01, "critical_ratio": 0.02},
+    "up": {"warning_percent": 0.9, "critical_percent": 0.6, "warning_down": None, "critical_down": None,
+           "print_ok": False},
+    "latency": {"metric": "rtime", "warning_ms": 500, "critical_ms": 1000, "slowest": 0},
+    "saturation": {"warning_sessions": 0.8, "critical_sessions": 0.95, "warning_queue": 0.5, "critical_queue": 1.0,
+                   "servers": True, "print_ok": False},
+}
+
+
+class FetchedStats(object):
+    """A cache (see :py:class:`stats_cache.StatsCache`) answering every fetch with stats fetched beforehand.
+
+    Given to the checks of a batch, it makes them all evaluate the same fetch of the stats.
+    """
+
+    def __init__(self, stats_csv):
+        self.stats_csv = stats_csv
+
+    def get(self, key, fetch):
+        return self.stats_csv
+
+
+def load_checks(path):
+    """Return the checks listed in a JSON or YAML (``.yaml``/``.yml``, needs PyYAML) config file.
+
+    The file holds a list of checks, or a mapping with the list under ``checks``. Every check is a mapping with a
+    ``type`` (a key of CHECK_OPTIONS), optional ``backends`` (a name, a list, or ``all``), ``name`` and thresholds
+    named like the options of its command, e.g. ``{"type": "5xx", "backends": ["api"], "critical_ratio": 0.05}``.
+
+    :return: checks with every option of their type filled in
+    :rtype: :py:class:`list(dict)`
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    if isinstance(config, dict):
+        config = config.get("checks")
+    if not isinstance(config, list):
+        raise ValueError("{0} does not list any checks".format(path))
+
+    checks = []
+    for i, check in enumerate(config):
+        if check.get("type") not in CHECK_OPTIONS:
+            raise ValueError("Check {0} of {1} has no type among {2}".format(i, path, ", ".join(sorted(CHECK_OPTIONS))))
+        options = CHECK_OPTIONS[check["type"]]
+        unknown = set(check) - set(options) - set(["name", "type", "backends"])
+        if unknown:
+            raise ValueError("Check {0} of {1} has unknown options {2}".format(i, path, ", ".join(sorted(unknown))))
+        backends = check.get("backends")
+        if isinstance(backends, (str, type(u""))):
+            backends = [backends]
+        if backends and "all" in backends:
+            backends = None
+        filled = dict(options, type=check["type"], backends=backends)
+        filled.update((key, value) for key, value in check.items() if key in options)
+        filled["name"] = check.get("name") or "{0} {1}".format(check["type"], ",".join(backends or ["all"]))
+        checks.append(filled)
+    return checks
+
+
+def _run_check(check, base_url_path, cache, delta, interval):
+    """Evaluate check against the stats of cache, or against delta (BACKEND rows) over interval seconds for 5xx.
+
+    :return: Exit code (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    backends = check["backends"]
+    if check["type"] == "5xx":
+        return check_haproxy_stats_5xx._check_ratios(
+            delta.ratios("hrsp_5xx", backends), backends, check["warning_ratio"], check["critical_ratio"], interval)
+    if check["type"] == "up":
+        return check_haproxy_stats_up.check_haproxy_up_rates(
+            base_url_path, backends=backends or [], warning_percent=check["warning_percent"],
+            critical_percent=check["critical_percent"], warning_down=check["warning_down"],
+            critical_down=check["critical_down"], print_ok=check["print_ok"], cache=cache)
+    if check["type"] == "latency":
+        return check_haproxy_stats_latency._check_latencies(
+            backends, check["metric"], check["warning_ms"], check["critical_ms"], base_url_path, None, None,
+            check["slowest"], cache=cache)
+    return check_haproxy_stats_saturation.check_haproxy_saturation(
+        base_url_path, backends=backends, warning_sessions=check["warning_sessions"],
+        critical_sessions=check["critical_sessions"], warning_queue=check["warning_queue"],
+        critical_queue=check["critical_queue"], servers=check["servers"], print_ok=check["print_ok"], cache=cache)
+
+
+def run_checks(checks, base_url_path, username, password, interval, stats_socket=None, timeout=5):
+    """Run every check against the same fetches of the stats and print the result of each one after its messages.
+
+    The stats are fetched once, or twice interval seconds apart when a 5xx check needs their increase. Each check
+    then prints its messages like its own command does, followed by ``<STATUS>: <name>``.
+
+    :return: Exit code of the most severe check.
+    :rtype: :py:class:`int`
+    """
+    with haproxy_util.HAProxyStatsClient(base_url_path, username, password, stats_socket, timeout) as client:
+        stats_initial = client.fetch() if any(check["type"] == "5xx" for check in checks) else None
+        if stats_initial is not None:
+            haproxy_util.sleep(interval)
+        stats_final = client.fetch()
+    delta = None
+    if stats_initial is not None:
+        delta = haproxy_util.parse_snapshot(stats_final).delta(haproxy_util.parse_snapshot(stats_initial))
+
+    cache = FetchedStats(stats_final)
+    rc = RETURN_CODES["OK"]
+    for check in checks:
+        try:
+            check_rc = _run_check(check, base_url_path, cache, delta, interval)
+        except Exception as e:
+            check_rc = RETURN_CODES["UNKNOWN"]
+            print("UNKNOWN: Got the following unhandled exception {0}".format(str(e)[:256]))
+        print("{0}: {1}".format(STATUSES[check_rc], check["name"]))
+        rc = max(rc, check_rc)
+    return rc
+
+
+def _get_parser():
+    """Return an argparse parser.
+
+    :return: an argparse.ArgumentParser that would take in appropriate user input
+    :rtype: :py:class:`argparse.ArgumentParser`
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--config", required=True,
+        help="JSON or YAML (.yaml, .yml) file listing the checks, e.g. "
+             "[{\"type\": \"5xx\", \"backends\": [\"api\"], \"critical_ratio\": 0.05}, {\"type\": \"up\"}]. Checks are "
+             "of type 5xx, up, latency or saturation, with the thresholds of their command in snake case.")
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser, cache=False)
+    parser.add_argument(
+        "--interval", type=int, default=60, help="Time to observe 500 rates of the 5xx checks (in seconds).")
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for each stats fetch (in seconds).")
+    return parser
+
+
+def main():
+    """Parser user input and execute the checks.
+
+    :return: Exit code (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    parser = _get_parser()
+    args = parser.parse_args()
+    try:
+        checks = load_checks(args.config)
+    except (IOError, ImportError, ValueError) as e:
+        parser.error("cannot read --config: {0}".format(e))
+    with timing.Report(enabled=args.perfdata):
+        try:
+            rc = run_checks(checks, args.base_url_path, args.username, args.password, args.interval,
+                            args.stats_socket, args.timeout)
+        except Exception as e:
+            print("UNKNOWN: Got the following unhandled exception {0}".format(str(e)[:256]))
+            rc = RETURN_CODES["UNKNOWN"]
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Check the average queue, connect, response or total time of HAProxy backends."""
+
+from __future__ import print_function
+
+import argparse
+import heapq
+import sys
+
+from . import haproxy_util, stats_cache, timing
+
+RETURN_CODES = {"OK": 0, "WARNING": 1, "CRITICAL": 2, "UNKNOWN": 3}
+
+# Averages (in milliseconds) over the last 1024 requests, reported for every backend and server.
+TIME_COLUMNS = ("qtime", "ctime", "rtime", "ttime")
+
+TIME_NAMES = {"qtime": "queue", "ctime": "connect", "rtime": "response", "ttime": "total"}
+
+
+def unknown_exception(f):
+    """A decorator to catch all other uncaught exceptions and return unknown code."""
+    def f_wrapper(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except Exception as e:
+            return _handle_unknown(str(e)[:256])
+
+    return f_wrapper
+
+
+def _get_parser():
+    """Return an argparse parser.
+
+    :return: an argparse.ArgumentParser that would take in appropriate user input
+    :rtype: :py:class:`argparse.ArgumentParser`
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--backend", dest="backends", action="append", required=True,
+        help="Backend to check the time of, may be repeated. Matches backends starting with it, or named exactly it "
+             "with a leading '=', or matching it when a glob or a regex with a leading '~'. 'all' checks every "
+             "backend separately.")
+    parser.add_argument(
+        "--metric", choices=TIME_COLUMNS, default="rtime",
+        help="Average time to check: qtime (queue), ctime (connect), rtime (response) or ttime (total).")
+    parser.add_argument(
+        "--warning-ms", type=int, default=500,
+        help="Average time (in milliseconds) above which we should throw warning.")
+    parser.add_argument(
+        "--critical-ms", type=int, default=1000,
+        help="Average time (in milliseconds) above which we should throw critical.")
+    parser.add_argument(
+        "--slowest", type=int, default=0,
+        help="Also report the N servers of the checked backends with the highest time.")
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser)
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for the stats (in seconds).")
+    return parser
+
+
+def _handle_unknown(exception_message):
+    """Print informational message regarding the check and return UNKNOWN exit code.
+
+    :return: Unknown Exit Code
+    :rtype: :py:class:`int`
+    """
+    print("UNKNOWN: Got the following unhandled exception {0}".format(exception_message))
+    return RETURN_CODES["UNKNOWN"]
+
+
+def get_latencies(snapshot, backends=None, metric="rtime", slowest=0):
+    """Return the time of every backend and the slowest servers in a snapshot of TIME_COLUMNS.
+
+    The time of a backend selecting several proxies (see :py:class:`haproxy_util.BackendSelector`) is the highest
+    of their times, since averages of different proxies cannot be added up.
+
+    :return: (backend -> average time in milliseconds, [(time, proxy/server)] of the slowest servers, slowest first)
+    :rtype: :py:class:`tuple(dict, list)`
+    """
+    i = snapshot.columns.index(metric)
+    latencies = dict((backend, times[i]) for backend, times in snapshot.filter(
+        lambda pxname, svname: svname == "BACKEND").max_by_backend(backends).items())
+    servers = snapshot.filter(lambda pxname, svname: svname != "BACKEND")
+    slowest_servers = heapq.nlargest(slowest, zip(servers.values[i], ("/".join(key) for key in servers.keys)))
+    return latencies, slowest_servers
+
+
+@unknown_exception
+def _check_latencies(backends, metric, warning_ms, critical_ms, base_url_path, username, password, slowest=0,
+                     stats_socket=None, timeout=5, cache=None):
+    """Print informational message for every backend and return the most severe exit code.
+
+    All backends are checked from a single fetch of the stats, None checks every backend. The slowest servers are
+    only reported and do not affect the status of the check.
+
+    :return: Exit Code (depending on severity)
+    :rtype: :py:class:`int`
+    """
+    selector = haproxy_util.get_selector(backends)
+    with haproxy_util.HAProxyStatsClient(base_url_path, username, password, stats_socket, timeout, cache) as client:
+        snapshot = client.snapshot(selector, servers=bool(slowest), columns=TIME_COLUMNS)
+    latencies, slowest_servers = get_latencies(snapshot, selector, metric, slowest)
+
+    if not backends and not latencies:
+        return _handle_unknown("Did not find any backends")
+    rc = RETURN_CODES["OK"]
+    for backend in backends or sorted(latencies):
+        if backend not in latencies:
+            rc = max(rc, _handle_unknown("Did not find backends starting with {0}".format(backend)))
+            continue
+        latency = latencies[backend]
+        if latency > critical_ms:
+            status = "CRITICAL"
+        elif latency > warning_ms:
+            status = "WARNING"
+        else:
+            status = "OK"
+        print("{backend} has average {name} time of {latency} ms.Thresholds: warning: {warning_ms}, critical: "
+              "{critical_ms}".format(backend=backend, name=TIME_NAMES[metric], latency=latency,
+                                     warning_ms=warning_ms, critical_ms=critical_ms))
+        rc = max(rc, RETURN_CODES[status])
+    for latency, server in slowest_servers:
+        print("Server {server} has average {name} time of {latency} ms".format(
+            server=server, name=TIME_NAMES[metric], latency=latency))
+    return rc
+
+
+def main():
+    """Parser user input and execute the check.
+
+    :return: Exit code (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    parser = _get_parser()
+    args = parser.parse_args()
+    with timing.Report(enabled=args.perfdata):
+        rc = _check_latencies(backends=None if "all" in args.backends else args.backends,
+                              metric=args.metric,
+                              warning_ms=args.warning_ms,
+                              critical_ms=args.critical_ms,
+                              base_url_path=args.base_url_path,
+                              username=args.username,
+                              password=args.password,
+                              slowest=args.slowest,
+                              stats_socket=args.stats_socket,
+                              timeout=args.timeout,
+                              cache=stats_cache.StatsCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None)
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
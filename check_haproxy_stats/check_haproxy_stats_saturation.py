@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Check the session usage and queue depth of HAProxy backends and of their servers."""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from . import haproxy_util, stats_cache, timing
+from .check_haproxy_stats_up import SensuCheckStatus
+
+# Current sessions, their limit (maxconn of a server, fullconn of a backend) and requests queued for a free session.
+SATURATION_COLUMNS = ('scur', 'slim', 'qcur')
+
+
+def get_saturation(stats_csv, backends=None):
+    """Return the sessions, session limit and queue of each requested backend and of every server of them.
+
+    Backends are selected like :py:func:`check_haproxy_stats_up.count_services_up` does: exact names unless written
+    as a glob or a regex, every backend without any. The BACKEND rows selected by a backend are summed under it. The
+    stats are read in a single pass, keeping only the three columns of the rows selected.
+
+    :return: (backend -> (scur, slim, qcur), (pxname, svname) -> (scur, slim, qcur))
+    :rtype: :py:class:`tuple(dict, dict)`
+    """
+    selector = haproxy_util.get_selector(backends, default='exact')
+
+    def row_filter(pxname, svname):
+        return svname != 'FRONTEND' and bool(selector.match(pxname))
+
+    found_backends, found_servers = {}, {}
+    rows = 0
+    with timing.span('parse'):
+        for pxname, svname, scur, slim, qcur in haproxy_util.iter_stats(
+                stats_csv, ('pxname', 'svname') + SATURATION_COLUMNS, row_filter):
+            rows += 1
+            counters = (scur or 0, slim or 0, qcur or 0)  # columns missing from older HAProxy versions are None
+            if svname != 'BACKEND':
+                found_servers[pxname, svname] = counters
+                continue
+            for backend in selector.match(pxname):
+                found = found_backends.get(backend)
+                found_backends[backend] = counters if found is None else tuple(map(sum, zip(found, counters)))
+    timing.count('rows', rows)
+    return found_backends, found_servers
+
+
+def get_haproxy_saturation_for_backends(
+        base_url_path, username=None, password=None, backends=None, stats_socket=None, timeout=5, cache=None):
+    stats_csv = haproxy_util.fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, cache)
+    return get_saturation(stats_csv, backends)
+
+
+def _check_saturation(
+        sensu_status, kind, found, warning_sessions, critical_sessions, warning_queue, critical_queue, print_ok):
+    """Update sensu_status with the session usage and queue of every found backend or server.
+
+    Both are relative to the session limit: a queue of 1.0 is as many requests waiting as there are sessions. A
+    backend or server without a session limit cannot be saturated and is skipped.
+    """
+    for key in sorted(found):
+        scur, slim, qcur = found[key]
+        if not slim:
+            continue
+        name = key if kind == 'Backend' else '/'.join(key)
+        ok = True
+        sessions = float(scur) / slim
+        queue = float(qcur) / slim
+        if sessions >= critical_sessions:
+            ok = False
+            sensu_status.update_status(
+                'CRITICAL', '{} {} has a critical session usage ({}% of {} sessions)'.format(
+                    kind, name, int(sessions * 100), slim))
+        elif sessions >= warning_sessions:
+            ok = False
+            sensu_status.update_status(
+                'WARNING', '{} {} has a warning session usage ({}% of {} sessions)'.format(
+                    kind, name, int(sessions * 100), slim))
+        if queue >= critical_queue:
+            ok = False
+            sensu_status.update_status(
+                'CRITICAL', '{} {} has a critical queue ({} requests for {} sessions)'.format(
+                    kind, name, qcur, slim))
+        elif queue >= warning_queue:
+            ok = False
+            sensu_status.update_status(
+                'WARNING', '{} {} has a warning queue ({} requests for {} sessions)'.format(
+                    kind, name, qcur, slim))
+        if ok and print_ok:
+            sensu_status.update_status(
+                'OK', '{} {} has an ok session usage ({}% of {} sessions) and queue ({} requests)'.format(
+                    kind, name, int(sessions * 100), slim, qcur))
+
+
+def check_haproxy_saturation(
+        base_url_path, username=None, password=None, backends=None, warning_sessions=0.8, critical_sessions=0.95,
+        warning_queue=0.5, critical_queue=1.0, servers=True, print_ok=False, stats_socket=None, timeout=5,
+        cache=None):
+    """Check the session usage and queue of backends, and of their servers unless servers is false.
+
+    Every backend and server is checked from a single fetch of the stats, see :py:func:`get_saturation`.
+
+    :return: Exit code (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    sensu_status = SensuCheckStatus()
+    try:
+        found_backends, found_servers = get_haproxy_saturation_for_backends(
+            base_url_path, username, password, backends, stats_socket, timeout, cache)
+    except Exception as ex:
+        sensu_status.update_status('UNKNOWN', 'Unknown exception: {}'.format(str(ex)))
+        return sensu_status.status
+
+    missing_backends = set(backends or ()) - set(found_backends)
+    if missing_backends:
+        sensu_status.update_status(
+            'CRITICAL', 'There are missing backends that were requested to be monitored: {}'.format(missing_backends))
+    thresholds = (warning_sessions, critical_sessions, warning_queue, critical_queue, print_ok)
+    _check_saturation(sensu_status, 'Backend', found_backends, *thresholds)
+    if servers:
+        _check_saturation(sensu_status, 'Server', found_servers, *thresholds)
+    return sensu_status.status
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser)
+    parser.add_argument(
+        "--backend", dest="backends", action="append", default=[],
+        help="Backend to check the saturation of, may be repeated. Matches the backend named exactly it, or the "
+             "backends matching it when a glob or a regex with a leading '~'. Defaults to all backends")
+    parser.add_argument(
+        "--warning-sessions", type=float, default=0.8,
+        help="Share of the session limit in use at or above which we should throw warning.")
+    parser.add_argument(
+        "--critical-sessions", type=float, default=0.95,
+        help="Share of the session limit in use at or above which we should throw critical.")
+    parser.add_argument(
+        "--warning-queue", type=float, default=0.5,
+        help="Requests queued per session of the limit at or above which we should throw warning.")
+    parser.add_argument(
+        "--critical-queue", type=float, default=1.0,
+        help="Requests queued per session of the limit at or above which we should throw critical.")
+    parser.add_argument(
+        "--no-servers", dest="servers", action="store_false", help="Only check backends, not their servers.")
+    parser.add_argument("--print-ok", action="store_true", default=False)
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for the stats (in seconds).")
+    return parser
+
+
+def main():
+    """Parser user input and execute the check.
+
+    :return: Exit code (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    parser = _get_parser()
+    args = parser.parse_args()
+    with timing.Report(enabled=args.perfdata):
+        rc = check_haproxy_saturation(
+            base_url_path=args.base_url_path,
+            username=args.username,
+            password=args.password,
+            backends=args.backends,
+            warning_sessions=args.warning_sessions,
+            critical_sessions=args.critical_sessions,
+            warning_queue=args.warning_queue,
+            critical_queue=args.critical_queue,
+            servers=args.servers,
+            print_ok=args.print_ok,
+            stats_socket=args.stats_socket,
+            timeout=args.timeout,
+            cache=stats_cache.StatsCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None,
+        )
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
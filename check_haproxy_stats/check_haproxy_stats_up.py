@@ -3,10 +3,11 @@
 from __future__ import print_function
 
 import argparse
+from array import array
 from collections import defaultdict
 import sys
 
-import haproxystats
+from . import haproxy_util, stats_cache, timing
 
 
 class SensuCheckStatus:
@@ -16,35 +17,49 @@ class SensuCheckStatus:
     def update_status(self, new_status, message):
         if self.RETURN_CODES[new_status] > self.status:
             self.status = self.RETURN_CODES[new_status]
+        self.print_status(new_status, message)
+
+    def print_status(self, new_status, message):
+        """Print a status line without affecting the status of the check."""
         print('{}: {}'.format(new_status, message))
 
 
-def get_haproxy_services_up_count_for_backends(base_url_path, username=None, password=None, backends=None):
-    hs = haproxystats.HAProxyServer(base_url_path, username, password)
-    found_backend_stats = defaultdict(dict)
-    for listener in hs.listeners:  # a list of services found
-        if not backends or listener.pxname in backends:
-            if listener.status not in ['no check', 'MAINT']:  # ignore servers that aren't checked for status
-                backend = found_backend_stats[listener.pxname]
-                if 'count' not in backend:
-                    backend['count'] = 0
-                    backend['up_count'] = 0
-                backend['count'] += 1
-                if 'UP' in listener.status:
-                    backend['up_count'] += 1
-    return found_backend_stats
+def count_services_up(stats_csv, backends=None):
+    """Return the number of checked servers, and of those up, of each requested backend.
 
+    Backends are exact names unless written as a glob (``api-*``) or a regex, see
+    :py:class:`haproxy_util.BackendSelector`. With no backends requested every backend is counted.
 
-def check_haproxy_up_rates(
-        base_url_path, username=None, password=None, backends=None, warning_percent=0.9, critical_percent=0.6,
-        warning_down=None, critical_down=None, print_ok=False):
-    sensu_status = SensuCheckStatus()
-    try:
-        found_backend_stats = get_haproxy_services_up_count_for_backends(base_url_path, username, password, backends)
-    except Exception as ex:
-        sensu_status.update_status('UNKNOWN', 'Unknown exception: {}'.format(str(ex)))
-        return sensu_status.status
+    :return: backend -> {'count': servers checked, 'up_count': servers up}
+    :rtype: :py:class:`dict`
+    """
+    selector = haproxy_util.get_selector(backends, default='exact')
 
+    def row_filter(pxname, svname):  # a list of services found
+        return svname not in ('FRONTEND', 'BACKEND') and bool(selector.match(pxname))
+
+    keys, up = [], array(haproxy_util.INT64)
+    with timing.span('parse'):
+        for pxname, svname, status in haproxy_util.iter_stats(stats_csv, ('pxname', 'svname', 'status'), row_filter):
+            if status not in ['no check', 'MAINT']:  # ignore servers that aren't checked for status
+                keys.append((pxname, svname))
+                up.append('UP' in status)
+    timing.count('rows', len(keys))
+    servers = haproxy_util.Snapshot(keys, ('count', 'up_count'), (array(haproxy_util.INT64, [1]) * len(keys), up))
+    up_counts = dict((pxname, {'count': count, 'up_count': up_count})
+                     for pxname, (count, up_count) in servers.sum_by_backend().items())
+    return defaultdict(dict, haproxy_util.group_up_counts(up_counts, selector))
+
+
+def get_haproxy_services_up_count_for_backends(
+        base_url_path, username=None, password=None, backends=None, stats_socket=None, timeout=5, cache=None):
+    stats_csv = haproxy_util.fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, cache)
+    return count_services_up(stats_csv, backends)
+
+
+def _check_backends_up_rates(
+        sensu_status, found_backend_stats, backends, warning_percent, critical_percent, warning_down, critical_down,
+        print_ok, location=''):
     if backends:  # if we get extra backends from get_haproxy_services_up_count_for_backends, delete them (e.g. tests)
         extra_backends = set(found_backend_stats.keys()) - set(backends)
         for extra_backend in extra_backends:
@@ -53,7 +68,9 @@ def check_haproxy_up_rates(
     if backends and set(found_backend_stats.keys()) != set(backends):
         # Critial, there is a backend not found that was explicitly listed to monitor
         missing_backends = set(backends) - set(found_backend_stats.keys())
-        sensu_status.update_status('CRITICAL', 'There are missing backends that were requested to be monitored: {}'.format(missing_backends))
+        sensu_status.update_status(
+            'CRITICAL',
+            'There are missing backends that were requested to be monitored{}: {}'.format(location, missing_backends))
 
     for backend_name in found_backend_stats:
         backend_ok = True
@@ -64,43 +81,124 @@ def check_haproxy_up_rates(
             backend_ok = False
             sensu_status.update_status(
                 'CRITICAL',
-                'Backend {} has a critical percentage of services up ({}% / {})'.format(
-                    backend_name, int(up_percent * 100), backend['count']))
+                'Backend {}{} has a critical percentage of services up ({}% / {})'.format(
+                    backend_name, location, int(up_percent * 100), backend['count']))
         elif up_percent < warning_percent:
             backend_ok = False
             sensu_status.update_status(
                 'WARNING',
-                'Backend {} has a warning percentage of services up ({}% / {})'.format(
-                    backend_name, int(up_percent * 100), backend['count']))
+                'Backend {}{} has a warning percentage of services up ({}% / {})'.format(
+                    backend_name, location, int(up_percent * 100), backend['count']))
         if critical_down and down_count >= critical_down:
             backend_ok = False
             sensu_status.update_status(
                 'CRITICAL',
-                'Backend {} has a critical number of services down ({} / {})'.format(
-                    backend_name, down_count, backend['count']))
+                'Backend {}{} has a critical number of services down ({} / {})'.format(
+                    backend_name, location, down_count, backend['count']))
         elif warning_down and down_count >= warning_down:
             backend_ok = False
             sensu_status.update_status(
                 'WARNING',
-                'Backend {} has a warning number of services down ({} / {})'.format(
-                    backend_name, down_count, backend['count']))
+                'Backend {}{} has a warning number of services down ({} / {})'.format(
+                    backend_name, location, down_count, backend['count']))
         if backend_ok and print_ok:
             sensu_status.update_status(
                 'OK',
-                'Backend {} has a ok percentage of services up ({}% / {})'.format(
-                    backend_name, int(up_percent * 100), backend['count']))
+                'Backend {}{} has a ok percentage of services up ({}% / {})'.format(
+                    backend_name, location, int(up_percent * 100), backend['count']))
+
+
+def _check_fleet_up_rates(
+        sensu_status, endpoints, username, password, backends, warning_percent, critical_percent, warning_down,
+        critical_down, print_ok, timeout, cache=None):
+    def get_up_count(endpoint):
+        return get_haproxy_services_up_count_for_backends(
+            endpoint, username, password, backends, timeout=timeout, cache=cache)
+
+    nodes = haproxy_util.fan_out(get_up_count, endpoints, timeout)
+    cluster_backend_stats = defaultdict(lambda: {'count': 0, 'up_count': 0})
+    answered = 0
+    for endpoint in endpoints:
+        found_backend_stats, error = nodes[endpoint]
+        if error is not None:  # only this node is unknown, the rest of the fleet is still checked
+            sensu_status.print_status('UNKNOWN', 'Node {} could not be checked: {}'.format(endpoint, error))
+            continue
+        answered += 1
+        _check_backends_up_rates(
+            sensu_status, found_backend_stats, backends, warning_percent, critical_percent, warning_down,
+            critical_down, print_ok, ' on {}'.format(endpoint))
+        for backend_name, backend in found_backend_stats.items():
+            cluster_backend_stats[backend_name]['count'] += backend['count']
+            cluster_backend_stats[backend_name]['up_count'] += backend['up_count']
+
+    if not answered:
+        sensu_status.update_status('UNKNOWN', 'None of the {} nodes could be checked'.format(len(endpoints)))
+        return
+    _check_backends_up_rates(
+        sensu_status, cluster_backend_stats, backends, warning_percent, critical_percent, warning_down,
+        critical_down, print_ok, ' across {} nodes'.format(answered))
+
 
+def check_haproxy_up_rates(
+        base_url_path, username=None, password=None, backends=None, warning_percent=0.9, critical_percent=0.6,
+        warning_down=None, critical_down=None, print_ok=False, stats_socket=None, timeout=5, daemon_socket=None,
+        cache=None):
+    """Check the up percentage of backends on one stats endpoint, or on a list of them queried concurrently.
+
+    With several endpoints every node is checked on its own and the fleet is checked as a whole. A node that
+    cannot be queried is reported UNKNOWN without affecting the status of the check, unless no node answered.
+    With daemon_socket the up counts come from the check-haproxy-statsd daemon when it can answer. With a cache (see
+    :py:class:`stats_cache.StatsCache`) the stats are shared with the checks run at the same time.
+
+    :return: Exit code (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    sensu_status = SensuCheckStatus()
+    endpoints = base_url_path if isinstance(base_url_path, (list, tuple)) else [base_url_path]
+    if len(endpoints) > 1:
+        if stats_socket or daemon_socket:
+            sensu_status.update_status(
+                'UNKNOWN', '--stats-socket and --daemon-socket only support a single --base-url-path')
+            return sensu_status.status
+        _check_fleet_up_rates(
+            sensu_status, endpoints, username, password, backends, warning_percent, critical_percent, warning_down,
+            critical_down, print_ok, timeout, cache)
+        return sensu_status.status
+
+    try:
+        found_backend_stats = None
+        if daemon_socket:
+            try:
+                found_backend_stats = haproxy_util.query_daemon(
+                    daemon_socket, {'check': 'up', 'backends': backends})['backends']
+            except Exception:  # daemon down or still collecting, fetch directly
+                pass
+        if found_backend_stats is None:
+            found_backend_stats = get_haproxy_services_up_count_for_backends(
+                endpoints[0], username, password, backends, stats_socket, timeout, cache)
+    except Exception as ex:
+        sensu_status.update_status('UNKNOWN', 'Unknown exception: {}'.format(str(ex)))
+        return sensu_status.status
+
+    _check_backends_up_rates(
+        sensu_status, found_backend_stats, backends, warning_percent, critical_percent, warning_down, critical_down,
+        print_ok)
     return sensu_status.status
 
 
 def _get_parser():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument(
+        "--base-url-path", dest="base_url_paths", action="append", default=[],
+        help="Stats endpoint, may be repeated to check a fleet of nodes concurrently. Defaults to "
+             "127.0.0.1/haproxy/stats")
     parser.add_argument("--username", help="Username to login to haproxy stats page.")
     parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser)
     parser.add_argument(
         "--backend", dest="backends", action="append", default=[],
-        help="Backend to check up percent. Defaults to all backends")
+        help="Backend to check up percent, may be repeated. Matches the backend named exactly it, or the backends "
+             "matching it when a glob or a regex with a leading '~'. Defaults to all backends")
     parser.add_argument(
         "--warning-percent", type=float, default=0.9,
         help="Up percentage (non-inclusive), below which we should throw warning.")
@@ -112,6 +210,11 @@ def _get_parser():
     parser.add_argument(
         "--critical-down", type=int, help="Down count at or above which we should throw critical.")
     parser.add_argument("--print-ok", action="store_true", default=False)
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for each node (in seconds).")
+    parser.add_argument(
+        "--daemon-socket",
+        help="Ask the check-haproxy-statsd daemon listening on this socket, fetching the stats directly only if it "
+             "cannot answer.")
     return parser
 
 
@@ -123,17 +226,22 @@ def main():
     """
     parser = _get_parser()
     args = parser.parse_args()
-    rc = check_haproxy_up_rates(
-        base_url_path=args.base_url_path,
-        username=args.username,
-        password=args.password,
-        backends=args.backends,
-        warning_percent=args.warning_percent,
-        critical_percent=args.critical_percent,
-        warning_down=args.warning_down,
-        critical_down=args.critical_down,
-        print_ok=args.print_ok,
-    )
+    with timing.Report(enabled=args.perfdata):
+        rc = check_haproxy_up_rates(
+            base_url_path=args.base_url_paths or ["127.0.0.1/haproxy/stats"],
+            username=args.username,
+            password=args.password,
+            backends=args.backends,
+            warning_percent=args.warning_percent,
+            critical_percent=args.critical_percent,
+            warning_down=args.warning_down,
+            critical_down=args.critical_down,
+            print_ok=args.print_ok,
+            stats_socket=args.stats_socket,
+            timeout=args.timeout,
+            daemon_socket=args.daemon_socket,
+            cache=stats_cache.StatsCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None,
+        )
     return rc
 
 
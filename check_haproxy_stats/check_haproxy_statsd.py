@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Poll the HAProxy stats on a fixed cadence and answer checks from the snapshots kept in memory."""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+from . import check_haproxy_stats_up
+from . import haproxy_util
+from . import sample_ring
+
+log = logging.getLogger(__name__)
+
+
+class StatsCollector(object):
+    """Keep the counters sampled over the last history seconds and answer checks from them.
+
+    The hrsp counters of every backend go to a :py:class:`sample_ring.SampleStore`, so any window it covers can be
+    answered, while only the newest up counts are kept.
+    """
+
+    def __init__(self, fetch, poll_interval=10, history=900):
+        self.fetch = fetch
+        self.poll_interval = poll_interval
+        self.history = history
+        # One sample more than history holds, so a sample polled late still leaves one history seconds old
+        self.store = sample_ring.SampleStore(int(history // poll_interval) + 2)
+        self.latest = None  # (timestamp, backend -> up counts)
+        self.lock = threading.Lock()
+
+    def poll(self):
+        """Fetch the stats once and add them to the samples."""
+        timestamp = time.time()  # when HAProxy was asked, however long the fetch takes
+        stats_csv = self.fetch()
+        request_stats = haproxy_util.parse_request_stats(stats_csv)
+        up_counts = dict(check_haproxy_stats_up.count_services_up(stats_csv))
+        with self.lock:
+            self.store.add(timestamp, request_stats)
+            self.latest = (timestamp, up_counts)
+
+    def run(self):
+        """Poll forever, every poll_interval seconds."""
+        while True:
+            started = time.time()
+            try:
+                self.poll()
+            except Exception:
+                log.exception("Failed to poll the stats")
+            time.sleep(max(self.poll_interval - (time.time() - started), 0))
+
+    def _check_fresh(self):
+        """Refuse to answer from samples the poller failed to refresh."""
+        if self.latest is None:
+            raise ValueError("No stats collected yet")
+        if time.time() - self.latest[0] > 3 * self.poll_interval:
+            raise ValueError("Stats are stale, last collected at {0}".format(self.latest[0]))
+
+    def get_hrsp_5xx_ratios(self, backends, interval):
+        """Return the 5xx ratios between the newest sample and the newest one at least interval seconds older.
+
+        :return: (backend -> ratio of requests that have 5xx HTTP codes, seconds the ratios were observed over)
+        :rtype: :py:class:`tuple(dict, float)`
+        """
+        with self.lock:
+            self._check_fresh()
+            return self.store.get_hrsp_5xx_ratios(backends, interval)
+
+    def get_up_counts(self, backends):
+        """Return the up counts of backends in the newest sample, every backend if None.
+
+        Backends are selected like :py:func:`check_haproxy_stats_up.count_services_up` does.
+        """
+        with self.lock:
+            self._check_fresh()
+            up_counts = self.latest[1]
+        return haproxy_util.group_up_counts(up_counts, backends)
+
+    def _get_window(self, backends, window):
+        try:
+            ratios, interval = self.get_hrsp_5xx_ratios(backends, window)
+            return {"ratios": ratios, "interval": interval}
+        except ValueError as e:
+            return {"error": str(e)}
+
+    def handle(self, request):
+        """Return the response to a request of a check."""
+        try:
+            if request.get("check") == "5xx" and "windows" in request:
+                self._check_fresh()
+                return {"windows": [self._get_window(request.get("backends"), w) for w in request["windows"]]}
+            if request.get("check") == "5xx":
+                ratios, interval = self.get_hrsp_5xx_ratios(request.get("backends"), request["interval"])
+                return {"ratios": ratios, "interval": interval}
+            if request.get("check") == "up":
+                return {"backends": self.get_up_counts(request.get("backends"))}
+            return {"error": "Unknown check {0}".format(request.get("check"))}
+        except (KeyError, ValueError) as e:
+            return {"error": str(e)}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = self.server.collector.handle(request)
+        except ValueError as e:
+            response = {"error": "Invalid request: {0}".format(e)}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class StatsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answer requests of checks (see :py:func:`haproxy_util.query_daemon`) on a UNIX socket."""
+
+    daemon_threads = True
+
+    def __init__(self, path, collector):
+        if os.path.exists(path):  # left behind by a previous run
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+        self.collector = collector
+
+
+def _get_parser():
+    """Return an argparse parser.
+
+    :return: an argparse.ArgumentParser that would take in appropriate user input
+    :rtype: :py:class:`argparse.ArgumentParser`
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser, cache=False, perfdata=False)
+    parser.add_argument("--listen", default="/var/run/check-haproxy-statsd.sock",
+                        help="UNIX socket to answer checks on (their --daemon-socket).")
+    parser.add_argument("--poll-interval", type=int, default=10, help="Time between polls of the stats (in seconds).")
+    parser.add_argument("--history", type=int, default=900, help="Time to keep polled stats for (in seconds).")
+    return parser
+
+
+def main():
+    """Parse user input, poll the stats in the background and serve checks until interrupted."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = _get_parser().parse_args()
+
+    client = haproxy_util.HAProxyStatsClient(args.base_url_path, args.username, args.password, args.stats_socket)
+    collector = StatsCollector(client.fetch, args.poll_interval, args.history)
+    poller = threading.Thread(target=collector.run)
+    poller.daemon = True
+    poller.start()
+
+    server = StatsServer(args.listen, collector)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        client.close()
+        os.unlink(args.listen)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Run one of the HAProxy checks: check-haproxy-stats <subcommand> [options].
+
+Only the module of the requested subcommand is imported, so listing the subcommands or running a check never pays
+for the others. The former console scripts (check-haproxy-stats-5xx, ...) are kept as aliases of the subcommands.
+"""
+
+from __future__ import print_function
+
+import importlib
+import sys
+
+# subcommand -> (module implementing it, alias kept as its own console script, description)
+SUBCOMMANDS = [
+    ("5xx", "check_haproxy_stats_5xx", "check-haproxy-stats-5xx", "Check the HTTP 5xx ratio of backends."),
+    ("up", "check_haproxy_stats_up", "check-haproxy-stats-up", "Check the share of servers up in backends."),
+    ("latency", "check_haproxy_stats_latency", "check-haproxy-stats-latency", "Check the response times of backends."),
+    ("saturation", "check_haproxy_stats_saturation", "check-haproxy-stats-saturation",
+     "Check the session usage and queues of backends."),
+    ("batch", "check_haproxy_stats_batch", "check-haproxy-stats-batch", "Run the checks of a config file at once."),
+    ("metrics-5xx", "metrics_haproxy_stats_5xx", "metrics-haproxy-stats-5xx", "Send response code ratios to gmond."),
+    ("record", "stats_recording", "record-haproxy-stats", "Record the stats to replay them offline."),
+    ("history", "counter_history", "haproxy-stats-history",
+     "Keep the counters in a ring file and query past windows."),
+    ("statsd", "check_haproxy_statsd", "check-haproxy-statsd", "Poll the stats and answer checks from memory."),
+    ("prometheus", "prometheus_haproxy_stats", "prometheus-haproxy-stats", "Export the stats to Prometheus."),
+]
+
+
+def _usage():
+    lines = [__doc__.splitlines()[0], "", "subcommands:"]
+    lines.extend("  {0:<12} {1} (alias: {2})".format(name, description, alias)
+                 for name, _, alias, description in SUBCOMMANDS)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Dispatch to the main() of the subcommand named by the first argument.
+
+    :return: Exit code of the subcommand (depending on severity).
+    :rtype: :py:class:`int`
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(_usage())
+        return 0
+    modules = dict((name, module) for name, module, _, _ in SUBCOMMANDS)
+    if argv[0] not in modules:
+        print("Unknown subcommand {0}\n\n{1}".format(argv[0], _usage()), file=sys.stderr)
+        return 2
+
+    module = importlib.import_module("." + modules[argv[0]], __package__)
+    sys.argv = ["check-haproxy-stats " + argv[0]] + argv[1:]  # parsed by the subcommand, prog included
+    return module.main()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+"""Keep the counters of every backend in a fixed-size ring file, to compute ratios over any past window."""
+
+from __future__ import print_function
+
+import argparse
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+from . import check_haproxy_stats_up, haproxy_util
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"HAPXHIST"
+
+VERSION = 1
+
+# magic, version, backend slots, samples per backend; padded to HEADER_SIZE.
+HEADER = struct.Struct("<8sIII")
+
+HEADER_SIZE = 64
+
+NAME_SIZE = 128
+
+# name of the backend (NUL padded, empty when the slot is free), index of its oldest sample, number of samples.
+SLOT = struct.Struct("<{0}sQQ".format(NAME_SIZE))
+
+STATUS_COLUMNS = ("count", "up_count")
+
+# timestamp, HRSP_COLUMNS and STATUS_COLUMNS of a backend.
+RECORD = struct.Struct("<d{0}q".format(len(haproxy_util.HRSP_COLUMNS) + len(STATUS_COLUMNS)))
+
+COUNTERS = len(haproxy_util.HRSP_COLUMNS)
+
+# Share of the interval by which the oldest sample of the interval of a check may fall short of it, so that the jitter
+# between the runs of a check does not miss the sample of the previous run.
+INTERVAL_TOLERANCE = 0.1
+
+
+class HistoryFile(object):
+    """Fixed-size ring file of (timestamp, hrsp counters, servers checked, servers up) samples of every backend.
+
+    The file is memory-mapped and made of fixed-width records: a header, a table of ``slots`` backends, then a ring
+    of ``capacity`` records per backend. Its size never changes, appending a sample of a backend writes one record
+    and its slot in place, and a window is read with a binary search over the records of a backend, so neither
+    writers nor readers ever load or parse the whole history. Writers hold an exclusive lock on the file, readers
+    a shared one, so checks and pollers can share it.
+
+    slots and capacity only size a new file, an existing one keeps its own. Once every slot is taken, a new backend
+    takes the slot of the backend sampled least recently. Backends named longer than NAME_SIZE bytes cannot be kept.
+    """
+
+    def __init__(self, path, slots=128, capacity=1440, writable=False):
+        self.path = path
+        self.writable = writable
+        if writable:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        else:
+            self.fd = os.open(path, os.O_RDONLY)
+        try:
+            if writable:
+                self._create(slots, capacity)
+            header = os.read(self.fd, HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("{0} is not a history file".format(path))
+            magic, version, self.slots, self.capacity = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("{0} is not a history file of version {1}".format(path, VERSION))
+            self.records_offset = HEADER_SIZE + self.slots * SLOT.size
+            size = self.records_offset + self.slots * self.capacity * RECORD.size
+            if os.fstat(self.fd).st_size < size:
+                raise ValueError("{0} is truncated".format(path))
+            self.map = mmap.mmap(self.fd, size, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self._slot_by_name = {}
+
+    def _create(self, slots, capacity):
+        """Lay out an empty file of slots backends of capacity samples, unless another writer already did."""
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, HEADER_SIZE + slots * (SLOT.size + capacity * RECORD.size))
+                os.write(self.fd, HEADER.pack(MAGIC, VERSION, slots, capacity))
+                os.lseek(self.fd, 0, os.SEEK_SET)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def _lock(self, operation):
+        fcntl.flock(self.fd, operation)
+
+    def _read_slot(self, slot):
+        name, start, size = SLOT.unpack_from(self.map, HEADER_SIZE + slot * SLOT.size)
+        return name.rstrip(b"\0").decode("utf-8"), start, size
+
+    def _write_slot(self, slot, name, start, size):
+        SLOT.pack_into(self.map, HEADER_SIZE + slot * SLOT.size, name.encode("utf-8"), start, size)
+
+    def _read_record(self, slot, index):
+        record = RECORD.unpack_from(self.map, self.records_offset + (slot * self.capacity + index) * RECORD.size)
+        return record[0], record[1:COUNTERS + 1], record[COUNTERS + 1:]
+
+    def _scan(self):
+        """Map the name of every backend to its slot, from the table of the file."""
+        self._slot_by_name = {}
+        for slot in range(self.slots):
+            name = self._read_slot(slot)[0]
+            if name:
+                self._slot_by_name[name] = slot
+
+    def _find_slot(self, backend):
+        """Return the slot of backend, None if it has none, rescanning the table when another writer changed it."""
+        slot = self._slot_by_name.get(backend)
+        if slot is None or self._read_slot(slot)[0] != backend:
+            self._scan()
+            slot = self._slot_by_name.get(backend)
+        return slot
+
+    def _allocate_slot(self, backend, keep):
+        """Give backend a free slot, or the slot of the backend sampled least recently that is not in keep."""
+        newest = []
+        for slot in range(self.slots):
+            name, start, size = self._read_slot(slot)
+            if not name:
+                newest = [(float("-inf"), slot)]
+                break
+            if name not in keep:
+                newest.append((self._read_record(slot, (start + size - 1) % self.capacity)[0] if size else 0, slot))
+        if not newest:
+            raise ValueError("{0} has no slot left for backend {1}".format(self.path, backend))
+        slot = min(newest)[1]
+        self._write_slot(slot, backend, 0, 0)
+        self._slot_by_name[backend] = slot
+        return slot
+
+    def append(self, timestamp, request_stats, up_counts=None):
+        """Add the counters of every backend (see :py:func:`haproxy_util.get_request_stats_for_backends`) sampled at
+        timestamp, with the servers checked and up of every backend in up_counts (see
+        :py:func:`check_haproxy_stats_up.count_services_up`).
+
+        Each backend takes one record. Its samples are dropped when its counters went backwards (e.g. HAProxy
+        reloaded) or timestamp is older than its newest sample.
+
+        :raises ValueError: nothing appended, if a backend is named longer than NAME_SIZE bytes or the file has too
+            few slots for the backends
+        """
+        if not self.writable:
+            raise ValueError("{0} is opened read-only".format(self.path))
+        too_long = sorted(backend for backend in request_stats if len(backend.encode("utf-8")) > NAME_SIZE)
+        if too_long:
+            raise ValueError("{0} cannot keep backends named longer than {1} bytes: {2}".format(
+                self.path, NAME_SIZE, ", ".join(too_long)))
+        up_counts = up_counts or {}
+        self._lock(fcntl.LOCK_EX)
+        try:
+            new = [backend for backend in request_stats if self._find_slot(backend) is None]
+            if new and len(new) > sum(1 for slot in range(self.slots) if self._read_slot(slot)[0] not in request_stats):
+                raise ValueError("{0} has {1} slots, too few for {2} backends".format(
+                    self.path, self.slots, len(request_stats)))
+            for backend, counters in request_stats.items():
+                slot = self._find_slot(backend)
+                if slot is None:
+                    slot = self._allocate_slot(backend, request_stats)
+                _, start, size = self._read_slot(slot)
+                if size:
+                    newest_timestamp, newest_counters, _ = self._read_record(slot, (start + size - 1) % self.capacity)
+                    if timestamp < newest_timestamp or any(c < p for p, c in zip(newest_counters, counters)):
+                        start, size = 0, 0
+                if size == self.capacity:
+                    start, size = (start + 1) % self.capacity, size - 1
+                status = up_counts.get(backend, {})
+                offset = self.records_offset + (slot * self.capacity + (start + size) % self.capacity) * RECORD.size
+                RECORD.pack_into(self.map, offset, timestamp,
+                                 *(tuple(counters) + tuple(status.get(c, 0) for c in STATUS_COLUMNS)))
+                self._write_slot(slot, backend, start, size + 1)
+        finally:
+            self._lock(fcntl.LOCK_UN)
+
+    def backends(self):
+        """Return the names of the backends sampled in the file, sorted."""
+        self._lock(fcntl.LOCK_SH)
+        try:
+            self._scan()
+        finally:
+            self._lock(fcntl.LOCK_UN)
+        return sorted(self._slot_by_name)
+
+    def _get(self, slot, start, size, i):
+        return self._read_record(slot, (start + (i + size if i < 0 else i)) % self.capacity)
+
+    def _find(self, slot, start, size, timestamp):
+        """Return the index of the newest sample of slot taken at or before timestamp, None if every one is newer."""
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get(slot, start, size, mid)[0] <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1 if lo else None
+
+    def _window(self, slot, seconds, end, max_age, max_elapsed):
+        """Return the window of slot, None if its samples do not cover it, False if it has no sample within max_age
+        of end (the backend was gone, or not there yet)."""
+        _, start, size = self._read_slot(slot)
+        final = self._find(slot, start, size, end)
+        if final is None:
+            return False
+        final_timestamp, requests_final, status = self._get(slot, start, size, final)
+        if final_timestamp < end - max_age:
+            return False
+        initial = self._find(slot, start, size, final_timestamp - seconds)
+        if initial is None:
+            return None
+        initial_timestamp, requests_initial, _ = self._get(slot, start, size, initial)
+        if max_elapsed is not None and final_timestamp - initial_timestamp > max_elapsed:  # a gap between samples
+            return None
+        return requests_initial, requests_final, final_timestamp - initial_timestamp, status
+
+    def _newest_timestamp(self):
+        newest = None
+        for slot in self._slot_by_name.values():
+            _, start, size = self._read_slot(slot)
+            if size:
+                timestamp = self._get(slot, start, size, -1)[0]
+                newest = timestamp if newest is None else max(newest, timestamp)
+        return newest
+
+    def _windows(self, seconds, end, max_age, max_elapsed):
+        """Return the windows of the backends covering them, and the backends sampled at end not covering them."""
+        self._lock(fcntl.LOCK_SH)
+        try:
+            self._scan()
+            if end is None:
+                end = self._newest_timestamp()
+            found, uncovered = {}, []
+            for backend, slot in self._slot_by_name.items():
+                window = self._window(slot, seconds, end, seconds if max_age is None else max_age, max_elapsed) \
+                    if end is not None else False
+                if window:
+                    found[backend] = window
+                elif window is None:
+                    uncovered.append(backend)
+            return found, uncovered
+        finally:
+            self._lock(fcntl.LOCK_UN)
+
+    def windows(self, seconds, end=None, max_age=None, max_elapsed=None):
+        """Return the counters of every backend at least seconds before end, at end and the time between.
+
+        The sample of a backend at end is its newest one taken at or before end, and the window starts at its
+        newest sample at least seconds older. end defaults to the newest sample of the file. Backends without
+        samples covering seconds, without any sample within max_age (seconds by default) of end, or whose window
+        spans more than max_elapsed seconds (no bound by default) are left out.
+
+        :return: backend -> (initial counters, final counters, elapsed seconds, (servers checked, servers up) at end)
+        :rtype: :py:class:`dict`
+        """
+        return self._windows(seconds, end, max_age, max_elapsed)[0]
+
+    def get_hrsp_5xx_ratios(self, backends, seconds, end=None, max_elapsed=None):
+        """Return the 5xx ratios over the seconds before end, see :py:meth:`windows`.
+
+        Backends are grouped like :py:func:`haproxy_util.group_request_stats` does. Requested backends selecting a
+        backend sampled at end whose samples do not cover seconds are left out, rather than given the ratio of only
+        the backends covering it.
+
+        :return: (backend -> ratio of requests that have 5xx HTTP codes, seconds the ratios were observed over)
+        :rtype: :py:class:`tuple(dict, float)`
+        """
+        windows, uncovered = self._windows(seconds, end, None, max_elapsed)
+        if not windows:
+            raise ValueError("Less than {0} seconds of stats in {1}".format(seconds, self.path))
+        requests_initial = dict((backend, window[0]) for backend, window in windows.items())
+        requests_final = dict((backend, window[1]) for backend, window in windows.items())
+        hrsp_5xx_ratios = haproxy_util.get_hrsp_5xx_ratios_between(
+            haproxy_util.group_request_stats(requests_initial, backends),
+            haproxy_util.group_request_stats(requests_final, backends))
+        selector = haproxy_util.get_selector(backends)
+        for backend in set(match for pxname in uncovered for match in selector.match(pxname)):
+            hrsp_5xx_ratios.pop(backend, None)
+        return hrsp_5xx_ratios, max(window[2] for window in windows.values())
+
+    def get_up_counts(self, backends=None, end=None, max_age=300):
+        """Return the servers checked and up of backends in their newest samples at or before end.
+
+        Backends are selected like :py:func:`check_haproxy_stats_up.count_services_up` does. Backends without any
+        sample within max_age seconds of end are left out.
+
+        :return: backend -> {'count': servers checked, 'up_count': servers up}
+        :rtype: :py:class:`dict`
+        """
+        up_counts = dict((pxname, dict(zip(STATUS_COLUMNS, window[3])))
+                         for pxname, window in self.windows(0, end, max_age).items())
+        return haproxy_util.group_up_counts(up_counts, backends)
+
+
+def append_stats(history, stats_csv, timestamp, backends=None):
+    """Append the counters and the servers up of the backends of stats_csv, fetched at timestamp, to history.
+
+    Only the proxies selected by one of the requested backends (see :py:class:`haproxy_util.BackendSelector`) are
+    appended, every backend without any.
+
+    :return: backend -> (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    request_stats = haproxy_util.parse_request_stats(stats_csv)
+    if backends:
+        selector = haproxy_util.get_selector(backends)
+        request_stats = dict((pxname, counters) for pxname, counters in request_stats.items()
+                             if selector.match(pxname))
+    history.append(timestamp, request_stats, check_haproxy_stats_up.count_services_up(stats_csv))
+    return request_stats
+
+
+def get_hrsp_5xx_ratios_history(backends, base_url_path, username, password, interval, history_file,
+                                stats_socket=None, timeout=5, cache=None, slots=128, capacity=1440, max_state_age=300):
+    """Return ratio of requests that has 5xx code over the last interval seconds of the samples in history_file.
+
+    Every call appends the current counters of the requested backends to history_file, laid out with slots and
+    capacity when new (see :py:class:`HistoryFile`). The ratios start at the newest sample
+    at least interval seconds old, less INTERVAL_TOLERANCE of interval, and no older than max_state_age seconds. When
+    a requested backend has no samples covering that (first runs, a gap between runs, or HAProxy reloaded) this falls
+    back to sampling every backend over interval seconds
+    like :py:func:`haproxy_util.get_hrsp_5xx_ratios`, appending both samples.
+
+    :return: (backend -> ratio of requests that have 5xx HTTP codes, seconds the ratios were observed over)
+    :rtype: :py:class:`tuple(dict, float)`
+    """
+    with HistoryFile(history_file, slots, capacity, writable=True) as history:
+        stats_csv = haproxy_util.fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, cache)
+        requested = haproxy_util.group_request_stats(
+            append_stats(history, stats_csv, haproxy_util.now(), backends), backends)
+        try:
+            hrsp_5xx_ratios, elapsed = history.get_hrsp_5xx_ratios(
+                backends, interval * (1 - INTERVAL_TOLERANCE), max_elapsed=max_state_age)
+        except ValueError:
+            hrsp_5xx_ratios, elapsed = {}, 0
+        if not set(requested) - set(hrsp_5xx_ratios):
+            return hrsp_5xx_ratios, elapsed
+
+        haproxy_util.sleep(interval)
+        stats_final = haproxy_util.fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, cache)
+        requests_final = haproxy_util.group_request_stats(
+            append_stats(history, stats_final, haproxy_util.now(), backends), backends)
+    return haproxy_util.get_hrsp_5xx_ratios_between(requested, requests_final), interval
+
+
+def record_history(path, fetch, poll_interval=10, duration=None, slots=128, capacity=1440, backends=None):
+    """Append the stats returned by fetch to the history file every poll_interval seconds, for duration seconds or
+    until interrupted.
+
+    Only the backends selected by backends are appended, see :py:func:`append_stats`. A fetch that fails is skipped,
+    the next one is still appended.
+
+    :return: number of samples appended
+    :rtype: :py:class:`int`
+    """
+    started = time.time()
+    appended = 0
+    with HistoryFile(path, slots, capacity, writable=True) as history:
+        while duration is None or time.time() - started < duration:
+            polled = time.time()
+            try:
+                append_stats(history, fetch(), polled, backends)
+                appended += 1
+            except Exception:
+                log.exception("Failed to append the stats")
+            time.sleep(max(poll_interval - (time.time() - polled), 0))
+    return appended
+
+
+def query_history(path, backends, window, end=None):
+    """Print the 5xx ratio over window seconds before end, and the servers up at end, of every backend.
+
+    :return: Exit code, 1 when the history does not cover window.
+    :rtype: :py:class:`int`
+    """
+    with HistoryFile(path) as history:
+        try:
+            hrsp_5xx_ratios, elapsed = history.get_hrsp_5xx_ratios(backends, window, end)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        up_counts = history.get_up_counts(backends, end)
+    for backend in sorted(hrsp_5xx_ratios):
+        status = up_counts.get(backend)
+        print("{0} has 5xx ratio of {1:.4f} over {2} seconds{3}".format(
+            backend, hrsp_5xx_ratios[backend], int(round(elapsed)),
+            ", {up_count} of {count} servers up".format(**status) if status else ""))
+    return 0
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "action", choices=("record", "query"),
+        help="record: append the stats to --history-file every --poll-interval seconds. query: print the 5xx ratio "
+             "over --window seconds and the servers up of every backend from --history-file.")
+    parser.add_argument("--history-file", required=True, help="Ring file of the counters of every backend.")
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser, cache=False, perfdata=False)
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for each stats fetch (in seconds).")
+    parser.add_argument("--poll-interval", type=float, default=10, help="Time between two samples (in seconds).")
+    parser.add_argument("--duration", type=float, help="Time to record for (in seconds), until interrupted if unset.")
+    parser.add_argument(
+        "--slots", type=int, default=128, help="Backends a new --history-file has room for.")
+    parser.add_argument(
+        "--capacity", type=int, default=1440, help="Samples of every backend a new --history-file keeps.")
+    parser.add_argument(
+        "--backend", dest="backends", action="append",
+        help="Backend to record or query, may be repeated. Matches backends starting with it, or named exactly it "
+             "with a leading '=', or matching it when a glob or a regex with a leading '~'. Defaults to all "
+             "backends")
+    parser.add_argument("--window", type=float, default=60, help="Time to compute the 5xx ratios over (in seconds).")
+    parser.add_argument(
+        "--end", type=float,
+        help="Unix time the window ends at, or seconds before now when negative. Defaults to the newest sample.")
+    return parser
+
+
+def main():
+    """Parser user input and record or query the history.
+
+    :return: Exit code.
+    :rtype: :py:class:`int`
+    """
+    args = _get_parser().parse_args()
+    if args.action == "query":
+        end = time.time() + args.end if args.end is not None and args.end < 0 else args.end
+        return query_history(args.history_file, args.backends, args.window, end)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    client = haproxy_util.HAProxyStatsClient(
+        args.base_url_path, args.username, args.password, args.stats_socket, args.timeout)
+    try:
+        record_history(args.history_file, client.fetch, args.poll_interval, args.duration, args.slots, args.capacity,
+                       args.backends)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
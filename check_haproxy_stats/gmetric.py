@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Send metrics to gmond the way the gmetric command does, without forking it.
+
+Every metric is announced with a Ganglia 3.1 metadata packet followed by its value as a string packet, both
+XDR-encoded and sent over UDP to gmond's udp_recv_channel.
+"""
+
+import socket
+import struct
+
+GMETADATA_FULL = 128
+GMETRIC_STRING = 128 + 5
+
+SLOPES = {"zero": 0, "positive": 1, "negative": 2, "both": 3, "unspecified": 4}
+
+
+def _pack_uint(value):
+    return struct.pack(">I", value)
+
+
+def _pack_string(value):
+    """Return value XDR-encoded as a length followed by its bytes padded to a multiple of 4."""
+    data = value.encode("utf-8")
+    return _pack_uint(len(data)) + data + b"\0" * (-len(data) % 4)
+
+
+def pack_metadata(host, name, metric_type="float", units="", slope="both", tmax=60, dmax=0, group=None):
+    """Return the metadata packet announcing metric name of host.
+
+    :return: XDR-encoded Ganglia_metadata_msg
+    :rtype: :py:class:`bytes`
+    """
+    extra = [("GROUP", group)] if group else []
+    packet = [_pack_uint(GMETADATA_FULL), _pack_string(host), _pack_string(name), _pack_uint(0),  # not spoofed
+              _pack_string(metric_type), _pack_string(name), _pack_string(units), _pack_uint(SLOPES[slope]),
+              _pack_uint(tmax), _pack_uint(dmax), _pack_uint(len(extra))]
+    for key, value in extra:
+        packet.extend([_pack_string(key), _pack_string(value)])
+    return b"".join(packet)
+
+
+def pack_value(host, name, value):
+    """Return the packet carrying the value of metric name of host, formatted as a string.
+
+    :return: XDR-encoded Ganglia_value_msg
+    :rtype: :py:class:`bytes`
+    """
+    return b"".join([_pack_uint(GMETRIC_STRING), _pack_string(host), _pack_string(name), _pack_uint(0),
+                     _pack_string("%s"), _pack_string(value)])
+
+
+def send_metrics(metrics, gmond_host="127.0.0.1", gmond_port=8649, host=None, metric_type="float", units="",
+                 slope="both", tmax=60, dmax=0, group=None):
+    """Send the metadata and value packets of every (name, value) of metrics from a single UDP socket.
+
+    :return: number of packets sent
+    :rtype: :py:class:`int`
+    """
+    host = host or socket.gethostname()
+    address = (gmond_host, gmond_port)
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    try:
+        for name, value in metrics:
+            s.sendto(pack_metadata(host, name, metric_type, units, slope, tmax, dmax, group), address)
+            s.sendto(pack_value(host, name, value), address)
+            sent += 2
+    finally:
+        s.close()
+    return sent
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""Fetch and sample the stats of HAProxy from asyncio, many checks of many HAProxy sharing one event loop.
+
+Needs Python 3.5 or later, no other module of the package imports it. Parsing and ratios are those of
+:py:mod:`haproxy_util`, only waiting on HAProxy and between samples is asynchronous, e.g.::
+
+    async def check_all(hosts):
+        return await asyncio.gather(*(haproxy_async.get_hrsp_5xx_ratio("api", host + "/haproxy/stats", None, None, 60)
+                                      for host in hosts))
+"""
+
+import asyncio
+import base64
+import weakref
+
+from . import check_haproxy_stats_up, haproxy_util
+
+# The fetcher of every event loop the functions below were called from without one.
+_fetchers = weakref.WeakKeyDictionary()
+
+
+async def _query_socket(path, command):
+    """Return the output of command on the HAProxy runtime API or master CLI listening on path.
+
+    :return: output of the command
+    :rtype: :py:class:`str`
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write(command.encode("utf-8") + b"\n")
+        output = await reader.read()
+    finally:
+        writer.close()
+    return output.decode("utf-8")
+
+
+async def fetch_stats_sockets(stats_sockets):
+    """Return the CSV stats of every HAProxy process merged, see :py:func:`haproxy_util.fetch_stats_sockets`.
+
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    queries = []
+    for stats_socket in stats_sockets:
+        if stats_socket.startswith(haproxy_util.MASTER_PREFIX):
+            master_socket = stats_socket[len(haproxy_util.MASTER_PREFIX):]
+            pids = haproxy_util._parse_worker_pids(await _query_socket(master_socket, "show proc"))
+            queries.extend((master_socket, "@!{0} show stat".format(pid)) for pid in pids)
+        else:
+            queries.append((stats_socket, "show stat"))
+    stats_csvs = await asyncio.gather(*(_query_socket(path, command) for path, command in queries))
+    return stats_csvs[0] if len(stats_csvs) == 1 else haproxy_util.merge_stats_csv(stats_csvs)
+
+
+def _dechunk(body):
+    """Return the body of an HTTP response sent with ``Transfer-Encoding: chunked`` as is."""
+    chunks = []
+    while body:
+        size, _, body = body.partition(b"\r\n")
+        size = int(size.split(b";")[0], 16)
+        if not size:
+            break
+        chunks.append(body[:size])
+        body = body[size + 2:]
+    return b"".join(chunks)
+
+
+async def fetch_stats_http(base_url_path, username=None, password=None):
+    """Return the CSV export of the HAProxy stats page at base_url_path (``host[:port]/path``).
+
+    The page is asked for over a connection of its own, closed once read.
+
+    :raises IOError: if the stats page answered with an error
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    host_port, _, path = base_url_path.partition("/")
+    host, _, port = host_port.partition(":")
+    headers = ["GET /{0};csv;norefresh HTTP/1.0".format(path + "/" if path else ""), "Host: " + host_port]
+    if username and password:
+        credentials = base64.b64encode("{0}:{1}".format(username, password).encode("utf-8")).decode("ascii")
+        headers.append("Authorization: Basic " + credentials)
+    reader, writer = await asyncio.open_connection(host, int(port or 80))
+    try:
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("utf-8"))
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, _, head = head.partition(b"\r\n")
+    status = int(status_line.split()[1])
+    if status >= 400:
+        raise IOError("{0} answered {1}".format(base_url_path, status_line.decode("utf-8", "replace")))
+    if b"transfer-encoding: chunked" in head.lower():
+        body = _dechunk(body)
+    return body.decode("utf-8")
+
+
+class _Fetch(object):
+    """The stats of one fetch, and what was parsed from them, shared by every check the fetch was made for."""
+
+    def __init__(self, stats_csv):
+        self.stats_csv = stats_csv
+        self.parsed = {}
+
+    def parse(self, parse):
+        """Return parse(stats), computed by the first check asking for it."""
+        if parse not in self.parsed:
+            self.parsed[parse] = parse(self.stats_csv)
+        return self.parsed[parse]
+
+
+class AsyncStatsFetcher(object):
+    """Fetch the stats of many HAProxy concurrently, with at most max_concurrency fetches of each one at a time.
+
+    A fetch waiting for its turn is shared by every check asking for the same stats meanwhile, so thousands of
+    checks of an HAProxy make a handful of fetches, while none of them is given stats fetched before it asked. The
+    stats of a fetch are parsed once for all of them too. Fetches are bounded per stats page or set of stats
+    sockets, and each must be read within timeout seconds.
+    """
+
+    def __init__(self, max_concurrency=2, timeout=5):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.fetches = 0
+        self._semaphores = {}
+        self._queued = {}
+
+    async def fetch(self, base_url_path, username=None, password=None, stats_socket=None):
+        """Return the CSV stats from the stats socket(s) if given, the HTTP stats page otherwise.
+
+        :return: CSV stats, header line included
+        :rtype: :py:class:`str`
+        """
+        return (await self._get_fetch(base_url_path, username, password, stats_socket)).stats_csv
+
+    async def parse(self, parse, base_url_path, username=None, password=None, stats_socket=None):
+        """Return parse(CSV stats) of a fetch, parse being called once per fetch whatever the number of checks.
+
+        The result is shared by those checks, and must not be modified.
+        """
+        return (await self._get_fetch(base_url_path, username, password, stats_socket)).parse(parse)
+
+    async def _get_fetch(self, base_url_path, username, password, stats_socket):
+        key = (haproxy_util._get_source(base_url_path, stats_socket), username, password)
+        queued = self._queued.get(key)
+        if queued is None:
+            queued = self._queued[key] = asyncio.ensure_future(
+                self._fetch(key, base_url_path, username, password, stats_socket))
+        return await asyncio.shield(queued)
+
+    async def _fetch(self, key, base_url_path, username, password, stats_socket):
+        semaphore = self._semaphores.get(key[0])
+        if semaphore is None:
+            semaphore = self._semaphores[key[0]] = asyncio.Semaphore(self.max_concurrency)
+        async with semaphore:
+            del self._queued[key]  # checks asking from now on need a fetch started after they asked
+            self.fetches += 1
+            if stats_socket:
+                fetch = fetch_stats_sockets(stats_socket if isinstance(stats_socket, (list, tuple)) else [stats_socket])
+            else:
+                fetch = fetch_stats_http(base_url_path, username, password)
+            return _Fetch(await asyncio.wait_for(fetch, self.timeout))
+
+
+def get_fetcher(fetcher=None):
+    """Return fetcher, or the :py:class:`AsyncStatsFetcher` shared by every call on the running event loop."""
+    if fetcher is not None:
+        return fetcher
+    loop = asyncio.get_event_loop()
+    fetcher = _fetchers.get(loop)
+    if fetcher is None:
+        fetcher = _fetchers[loop] = AsyncStatsFetcher()
+    return fetcher
+
+
+async def get_request_stats_for_backends(backends=None, base_url_path="127.0.0.1/haproxy/stats", username="",
+                                         password="", stats_socket=None, fetcher=None):
+    """Return the response code counters of many backends from a single fetch of the stats.
+
+    See :py:func:`haproxy_util.get_request_stats_for_backends`. The counters of every backend are parsed once per
+    fetch, and summed for the backends requested by each check.
+
+    :return: backend -> (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    request_stats = await get_fetcher(fetcher).parse(
+        haproxy_util.parse_request_stats, base_url_path, username, password, stats_socket)
+    return haproxy_util.group_request_stats(request_stats, backends) if backends else dict(request_stats)
+
+
+async def get_request_stats(backend, base_url_path="127.0.0.1/haproxy/stats", username="", password="",
+                            stats_socket=None, fetcher=None):
+    """Return tuple of number of requests with (1xx, 2xx, 3xx, 4xx, 5xx, other response codes).
+
+    See :py:func:`haproxy_util.get_request_stats`.
+
+    :return: (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`tuple(int, int, int, int, int, int)`
+    """
+    matches = await get_request_stats_for_backends([backend], base_url_path, username, password, stats_socket,
+                                                   fetcher)
+    if backend not in matches:
+        raise ValueError("Did not find backends starting with {0}".format(backend))
+    return matches[backend]
+
+
+async def get_hrsp_5xx_ratio(backend, base_url_path, username, password, interval, stats_socket=None, fetcher=None):
+    """Return ratio of requests that has 5xx code during specified interval seconds.
+
+    The event loop runs the other checks while this one waits for interval to pass.
+
+    :return: Ratio of requests that have 5xx HTTP codes
+    :rtype: :py:class:`float`
+    """
+    requests_initial = await get_request_stats(backend, base_url_path, username, password, stats_socket, fetcher)
+    await asyncio.sleep(interval)
+    requests_final = await get_request_stats(backend, base_url_path, username, password, stats_socket, fetcher)
+    return haproxy_util._get_hrsp_5xx_ratio_between(requests_initial, requests_final)
+
+
+async def get_haproxy_services_up_count_for_backends(
+        base_url_path, username=None, password=None, backends=None, stats_socket=None, fetcher=None):
+    """Return the number of checked servers, and of those up, of each requested backend.
+
+    See :py:func:`check_haproxy_stats_up.count_services_up`, the servers of every backend being counted once per
+    fetch.
+
+    :return: backend -> {'count': servers checked, 'up_count': servers up}
+    :rtype: :py:class:`dict`
+    """
+    up_counts = await get_fetcher(fetcher).parse(
+        check_haproxy_stats_up.count_services_up, base_url_path, username, password, stats_socket)
+    return haproxy_util.group_up_counts(up_counts, backends) if backends else dict(up_counts)
@@ -1,42 +1,1135 @@
 #!/usr/bin/env python
 
-import haproxystats
+import errno
+import fcntl
+import fnmatch
+import json
+import math
+import operator
+import os
+import re
+import socket
+import tempfile
 import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import groupby
 
+from . import timing
 
-def get_request_stats(backend, base_url_path="127.0.0.1/haproxy/stats", username="", password=""):
+# requests and multiprocessing.pool are imported by the functions needing them: together they are most of the
+# start-up time of a check, and checks reading the stats socket or exiting early never use them.
+
+HRSP_COLUMNS = ("hrsp_1xx", "hrsp_2xx", "hrsp_3xx", "hrsp_4xx", "hrsp_5xx", "hrsp_other")
+
+# Stats columns holding text, every other column is converted to an int.
+STRING_COLUMNS = frozenset([
+    "pxname", "svname", "status", "tracked", "check_status", "last_chk", "last_agt", "agent_status", "check_desc",
+    "agent_desc", "addr", "cookie", "mode", "algo",
+])
+
+
+# Counters and current gauges that add up across processes, every other column is taken from a single process.
+SUMMED_COLUMNS = frozenset(HRSP_COLUMNS + (
+    "qcur", "scur", "stot", "bin", "bout", "dreq", "dresp", "ereq", "econ", "eresp", "wretr", "wredis", "chkfail",
+    "chkdown", "lbtot", "rate", "req_rate", "req_tot", "cli_abrt", "srv_abrt", "comp_in", "comp_out", "comp_byp",
+    "comp_rsp", "conn_rate", "conn_tot", "intercepted", "dcon", "dses", "wrew", "connect", "reuse", "eint",
+))
+
+# Prefix of a stats socket that is the master CLI of a master-worker HAProxy, e.g. master@/run/haproxy-master.sock
+MASTER_PREFIX = "master@"
+
+# Share of the interval a snapshot saved by a previous run must be old to start the interval of a stateful ratio, so
+# that a run right after another one (or at the same time) does not report a ratio over a second of requests.
+MIN_STATE_AGE = 0.25
+
+# Typecode of the arrays of 64 bits integers holding counters: "q", missing from the array module of Python 2, where
+# "l" is 64 bits wide on the LP64 platforms HAProxy runs on.
+try:
+    INT64 = array("q").typecode
+except ValueError:  # Python 2
+    INT64 = "l"
+
+# Where samples of the stats take the time and wait between each other: the time module, or the virtual clock of a
+# replayed recording while in use_clock.
+_clock = time
+
+
+def _query_socket(path, command, timeout=5):
+    """Return the output of command on the HAProxy runtime API or master CLI listening on path.
+
+    :return: output of the command
+    :rtype: :py:class:`str`
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+        s.sendall(command.encode("utf-8") + b"\n")
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        s.close()
+    return b"".join(chunks).decode("utf-8")
+
+
+def fetch_stats_socket(stats_socket, timeout=5):
+    """Return the CSV output of ``show stat`` on the HAProxy runtime API (stats socket).
+
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    return _query_socket(stats_socket, "show stat", timeout)
+
+
+def get_worker_pids(master_socket, timeout=5):
+    """Return the PIDs of the current and old workers listed by ``show proc`` on the master CLI.
+
+    :return: PIDs of the workers, current ones first
+    :rtype: :py:class:`list`
+    """
+    return _parse_worker_pids(_query_socket(master_socket, "show proc", timeout))
+
+
+def _parse_worker_pids(show_proc):
+    """Return the PIDs of the workers listed in the output of ``show proc``, current ones first."""
+    pids = []
+    for line in _iter_lines(show_proc):
+        fields = line.split()
+        if len(fields) > 1 and not line.startswith("#") and fields[1] == "worker":
+            pids.append(fields[0])
+    return pids
+
+
+def merge_stats_csv(stats_csvs):
+    """Return the CSV stats of many HAProxy processes merged into the CSV stats of a single one.
+
+    Rows are matched on pxname and svname. Columns of SUMMED_COLUMNS are summed, every other column keeps the value
+    of the first process having the row, so statuses come from the current workers rather than old ones draining.
+    Processes of different HAProxy versions are matched on column names.
+
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    header, merged = None, OrderedDict()
+    for stats_csv in stats_csvs:
+        lines = _iter_lines(stats_csv)
+        fields = next(lines, "").lstrip("# ").rstrip("\r\n,").split(",")
+        if header is None:
+            header = fields
+            index = dict((field, i) for i, field in enumerate(header))
+            summed = [i for i, field in enumerate(header) if field in SUMMED_COLUMNS]
+        positions = [index.get(field) for field in fields]
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            row = [""] * len(header)
+            for i, value in zip(positions, line.split(",")):
+                if i is not None:
+                    row[i] = value
+            key = (row[0], row[1])
+            totals = merged.get(key)
+            if totals is None:
+                merged[key] = row
+                continue
+            for i in summed:
+                if row[i]:
+                    totals[i] = str(_to_int(totals[i]) + _to_int(row[i]))
+    lines = ["# " + ",".join(header or []) + ","]
+    lines.extend(",".join(row) + "," for row in merged.values())
+    return "\n".join(lines) + "\n"
+
+
+def fetch_stats_sockets(stats_sockets, timeout=5):
+    """Return the CSV stats of every HAProxy process merged, see :py:func:`merge_stats_csv`.
+
+    stats_sockets are the stats sockets of every process (nbproc), or master CLIs prefixed with MASTER_PREFIX whose
+    every worker is queried through ``@!<pid>``. All processes are queried concurrently, and the stats of a single
+    one are returned as is.
+
+    :raises Exception: the error of the first process that could not be queried
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    queries = []
+    for stats_socket in stats_sockets:
+        if stats_socket.startswith(MASTER_PREFIX):
+            master_socket = stats_socket[len(MASTER_PREFIX):]
+            queries.extend((master_socket, "@!{0} show stat".format(pid))
+                           for pid in get_worker_pids(master_socket, timeout))
+        else:
+            queries.append((stats_socket, "show stat"))
+    if len(queries) == 1:
+        return _query_socket(queries[0][0], queries[0][1], timeout)
+
+    results = fan_out(lambda query: _query_socket(query[0], query[1], timeout), queries, timeout)
+    stats_csvs = []
+    for query in queries:
+        stats_csv, error = results[query]
+        if error:
+            raise error
+        stats_csvs.append(stats_csv)
+    return merge_stats_csv(stats_csvs)
+
+
+def query_daemon(daemon_socket, request, timeout=1):
+    """Send request to the check-haproxy-statsd daemon listening on daemon_socket and return its response.
+
+    Requests and responses are a single line of JSON each.
+
+    :raises ValueError: if the daemon could not answer the request
+    :return: Response of the daemon
+    :rtype: :py:class:`dict`
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(daemon_socket)
+        s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        f = s.makefile("rb")
+        try:
+            line = f.readline()
+        finally:
+            f.close()
+    finally:
+        s.close()
+    response = json.loads(line.decode("utf-8"))
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response
+
+
+def fetch_stats_http(base_url_path, username=None, password=None, timeout=5, session=None):
+    """Return the CSV export of the HAProxy stats page at base_url_path (``host[:port]/path``).
+
+    With a requests session (see :py:class:`HAProxyStatsClient`) its connection and credentials are reused.
+
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    url = "http://{0}/;csv;norefresh".format(base_url_path)
+    if session is not None:
+        r = session.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.text
+
+    import requests
+
+    auth = (username, password) if username and password else None
+    r = requests.get(url, auth=auth, timeout=timeout)
+    r.raise_for_status()
+    return r.text
+
+
+def _get_source(base_url_path, stats_socket=None):
+    """Return the name of where the stats are fetched from: the stats socket(s) if given, base_url_path otherwise."""
+    return ",".join(stats_socket) if isinstance(stats_socket, (list, tuple)) else stats_socket or base_url_path
+
+
+def fetch_stats_csv(base_url_path, username=None, password=None, stats_socket=None, timeout=5, cache=None,
+                    session=None):
+    """Return the CSV stats from the stats socket if given, the HTTP stats page otherwise.
+
+    stats_socket may also be a master CLI or a list of sockets whose stats are merged, see
+    :py:func:`fetch_stats_sockets`. With a cache (see :py:class:`stats_cache.StatsCache`) the stats fetched by
+    another check a moment ago are reused, and with a session the stats page is read like
+    :py:func:`fetch_stats_http` does.
+
+    :return: CSV stats, header line included
+    :rtype: :py:class:`str`
+    """
+    with timing.span("fetch"):
+        if cache is not None:
+            stats_csv = cache.get(_get_source(base_url_path, stats_socket),
+                                  lambda: _fetch_stats_csv(base_url_path, username, password, stats_socket, timeout,
+                                                           session))
+        else:
+            stats_csv = _fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, session)
+    timing.count("bytes", len(stats_csv))
+    return stats_csv
+
+
+def _fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, session):
+    if stats_socket:
+        return fetch_stats_sockets(stats_socket if isinstance(stats_socket, (list, tuple)) else [stats_socket], timeout)
+    return fetch_stats_http(base_url_path, username, password, timeout, session)
+
+
+def add_stats_source_arguments(parser, cache=True, perfdata=True):
+    """Add the options choosing how the stats are read to the argparse parser of a command.
+
+    Adds ``--stats-socket``, and unless disabled ``--cache-dir`` and ``--cache-ttl`` (see
+    :py:class:`stats_cache.StatsCache`) and ``--perfdata`` (see :py:class:`timing.Timings`).
+    """
+    parser.add_argument(
+        "--stats-socket", action="append",
+        help="HAProxy stats socket (e.g. /run/haproxy.sock) to use instead of --base-url-path. May be repeated for "
+             "the socket of every process (nbproc), or be the master CLI (e.g. master@/run/haproxy-master.sock) to "
+             "merge the stats of every worker.")
+    if cache:
+        parser.add_argument(
+            "--cache-dir",
+            help="Share the stats fetched with the other checks run at the same time through this directory, so "
+                 "that HAProxy is asked once per --cache-ttl whatever the number of checks.")
+        parser.add_argument(
+            "--cache-ttl", type=float, default=5,
+            help="Age (in seconds) above which the stats in --cache-dir are fetched again.")
+    if perfdata:
+        parser.add_argument(
+            "--perfdata", action="store_true",
+            help="Append the time spent fetching, parsing, aggregating and sleeping, and the bytes and rows read, as "
+                 "performance data (e.g. '| fetch_ms=12.345 parse_ms=1.234 rows=120 bytes=4567').")
+
+
+class HAProxyStatsClient(object):
+    """Fetch the stats of one HAProxy repeatedly, keeping the HTTP connection and the credentials between fetches.
+
+    The stats page is read through a requests session, created by the first fetch over HTTP: every later sample
+    reuses its keep-alive connection instead of a new TCP (and TLS) handshake, and asks for a gzip-compressed page.
+    Stats sockets and the cache are used like :py:func:`fetch_stats_csv` does. Closing the client closes the
+    connection, e.g.::
+
+        with HAProxyStatsClient("127.0.0.1/haproxy/stats") as client:
+            initial = client.snapshot(["api"])
+            time.sleep(60)
+            ratios = client.snapshot(["api"]).delta(initial).ratios("hrsp_5xx", ["api"])
+    """
+
+    def __init__(self, base_url_path="127.0.0.1/haproxy/stats", username=None, password=None, stats_socket=None,
+                 timeout=5, cache=None):
+        self.base_url_path = base_url_path
+        self.username = username
+        self.password = password
+        self.stats_socket = stats_socket
+        self.timeout = timeout
+        self.cache = cache
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get_session(self):
+        if self.session is None:
+            import requests
+
+            self.session = requests.Session()
+            self.session.headers["Accept-Encoding"] = "gzip"
+            if self.username and self.password:
+                self.session.auth = (self.username, self.password)
+        return self.session
+
+    def fetch(self):
+        """Return the CSV stats, see :py:func:`fetch_stats_csv`.
+
+        :return: CSV stats, header line included
+        :rtype: :py:class:`str`
+        """
+        session = None if self.stats_socket else self._get_session()
+        return fetch_stats_csv(self.base_url_path, self.username, self.password, self.stats_socket, self.timeout,
+                               self.cache, session)
+
+    def snapshot(self, backends=None, servers=False, columns=HRSP_COLUMNS):
+        """Return a snapshot of the response code counters of backends, see :py:func:`parse_snapshot`.
+
+        :rtype: :py:class:`Snapshot`
+        """
+        return parse_snapshot(self.fetch(), backends, servers, columns)
+
+    def request_stats(self, backends=None):
+        """Return the response code counters of backends, see :py:func:`get_request_stats_for_backends`.
+
+        :return: backend -> (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+        :rtype: :py:class:`dict`
+        """
+        return parse_request_stats(self.fetch(), backends)
+
+    def close(self):
+        """Close the connection to the stats page, if any."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+def _to_int(value):
+    """Return value of a numeric stats column as an int, empty cells (not applicable) being 0."""
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _iter_lines(text):
+    """Yield the lines of text one at a time without copying the whole text."""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+
+def iter_stats(stats_csv, columns, row_filter=None):
+    """Yield a tuple of the requested columns for every row of the CSV stats.
+
+    The header is read once to locate the columns, and only those are converted. Rows for which
+    ``row_filter(pxname, svname)`` is false are skipped before the rest of the line is even split. Columns missing
+    from the header (older HAProxy versions) are yielded as None.
+
+    :param stats_csv: CSV stats text or an iterable of its lines, header first
+    :param columns: names of the columns to project, e.g. ``("pxname", "svname", "status")``
+    :return: generator of tuples with one value per column
+    """
+    lines = _iter_lines(stats_csv) if isinstance(stats_csv, (str, type(u""))) else iter(stats_csv)
+    fields = next(lines, "").lstrip("# ").rstrip("\r\n,").split(",")
+    positions = dict((field, i) for i, field in enumerate(fields))
+    projection = [(positions.get(c), str if c in STRING_COLUMNS else _to_int) for c in columns]
+    maxsplit = max([i for i, _ in projection if i is not None] or [0]) + 1  # never split the unused tail
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        if row_filter is not None:
+            pxname, svname, _ = line.split(",", 2)
+            if not row_filter(pxname, svname):
+                continue
+        values = line.split(",", maxsplit)
+        yield tuple(None if i is None else convert(values[i]) for i, convert in projection)
+
+
+class BackendSelector(object):
+    """Index of the requested backends, telling which of them select a proxy name.
+
+    Each requested backend is read as:
+
+    * ``=name``: the proxy named exactly name
+    * ``~regex``: proxies whose name matches regex from its start
+    * a glob, i.e. containing ``*``, ``?`` or ``[``: proxies whose whole name matches it
+    * any other name: proxies starting with it when default is "prefix", named exactly it when default is "exact"
+
+    Exact names and prefixes are hashed (a prefix is looked up once per distinct prefix length), so a proxy costs a
+    few dict lookups however many backends are requested. Only regexes and globs are tried one by one, and the
+    result is kept per proxy name. With no backends requested every proxy is selected under its own name.
+    """
+
+    def __init__(self, backends=None, default="prefix"):
+        if default not in ("prefix", "exact"):
+            raise ValueError("Unknown backend matching {0}".format(default))
+        self.backends = tuple(backends or ())
+        self.exact = {}
+        self.prefixes = {}
+        self.patterns = []
+        for backend in self.backends:
+            if backend.startswith("="):
+                self.exact.setdefault(backend[1:], []).append(backend)
+            elif backend.startswith("~"):
+                self.patterns.append((re.compile(backend[1:]), backend))
+            elif any(c in backend for c in "*?["):
+                self.patterns.append((re.compile(fnmatch.translate(backend)), backend))
+            elif default == "exact":
+                self.exact.setdefault(backend, []).append(backend)
+            else:
+                self.prefixes.setdefault(backend, []).append(backend)
+        self.prefix_lengths = sorted(set(len(prefix) for prefix in self.prefixes))
+        self.matches = {}
+
+    def __bool__(self):
+        return bool(self.backends)
+
+    __nonzero__ = __bool__
+
+    def match(self, pxname):
+        """Return the requested backends selecting the proxy pxname, (pxname,) if no backend was requested.
+
+        :rtype: :py:class:`tuple`
+        """
+        matches = self.matches.get(pxname)
+        if matches is None:
+            if not self.backends:
+                matches = (pxname,)
+            else:
+                found = list(self.exact.get(pxname, ()))
+                for length in self.prefix_lengths:
+                    if length > len(pxname):
+                        break
+                    found.extend(self.prefixes.get(pxname[:length], ()))
+                found.extend(backend for regex, backend in self.patterns if regex.match(pxname))
+                matches = tuple(OrderedDict.fromkeys(found))
+            self.matches[pxname] = matches
+        return matches
+
+
+def get_selector(backends=None, default="prefix"):
+    """Return backends as a :py:class:`BackendSelector`, building it unless it already is one.
+
+    :rtype: :py:class:`BackendSelector`
+    """
+    return backends if isinstance(backends, BackendSelector) else BackendSelector(backends, default)
+
+
+def _to_array(values):
+    """Return values as an array of 64 bits integers, counting values that are not integers as 0."""
+    try:
+        return array(INT64, values)
+    except TypeError:  # a column missing from the stats (None) or holding text
+        return array(INT64, [value if isinstance(value, int) else 0 for value in values])
+
+
+class Snapshot(object):
+    """Numeric stats columns of the rows of one fetch of the stats, stored as one flat array per column.
+
+    Rows are keyed by (pxname, svname). Deltas, per backend sums and ratios work a column at a time over every row,
+    rather than building and summing a tuple per row.
+    """
+
+    def __init__(self, keys, columns, values):
+        self.keys = keys
+        self.columns = tuple(columns)
+        self.values = tuple(values)
+        self.index = dict((key, i) for i, key in enumerate(keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_csv(cls, stats_csv, columns=HRSP_COLUMNS, row_filter=None):
+        """Return a snapshot of columns of the rows of the CSV stats, see :py:func:`iter_stats` for row_filter.
+
+        :rtype: :py:class:`Snapshot`
+        """
+        columns = tuple(columns)
+        with timing.span("parse"):
+            rows = list(iter_stats(stats_csv, ("pxname", "svname") + columns, row_filter))
+        timing.count("rows", len(rows))
+        if not rows:
+            return cls([], columns, [array(INT64) for _ in columns])
+        transposed = list(zip(*rows))
+        return cls(list(zip(transposed[0], transposed[1])), columns, [_to_array(v) for v in transposed[2:]])
+
+    def delta(self, other):
+        """Return the increase of every column since the other (older) snapshot, for the rows found in both.
+
+        :rtype: :py:class:`Snapshot`
+        """
+        with timing.span("aggregate"):
+            if self.keys == other.keys:  # same configuration, subtract whole columns
+                return Snapshot(self.keys, self.columns, [array(INT64, map(operator.sub, final, initial))
+                                                          for final, initial in zip(self.values, other.values)])
+            rows = [(i, other.index[key]) for i, key in enumerate(self.keys) if key in other.index]
+            return Snapshot([self.keys[i] for i, _ in rows], self.columns,
+                            [array(INT64, [final[i] - initial[j] for i, j in rows])
+                             for final, initial in zip(self.values, other.values)])
+
+    def _reduce_by_backend(self, backends, reduce):
+        selector = get_selector(backends)
+        results = {}
+        start = 0
+        with timing.span("aggregate"):
+            for pxname, rows in groupby(pxname for pxname, _ in self.keys):  # the rows of a proxy are contiguous
+                end = start + len(list(rows))
+                values = tuple(reduce(column[start:end]) for column in self.values)
+                start = end
+                for backend in selector.match(pxname):
+                    previous = results.get(backend)
+                    results[backend] = values if previous is None else tuple(map(reduce, zip(previous, values)))
+        return results
+
+    def sum_by_backend(self, backends=None):
+        """Return every column summed over the rows selected by each requested backend, see group_request_stats.
+
+        backends may be a :py:class:`BackendSelector`. With no backends requested the rows are summed per pxname.
+        Backends matching no row are left out.
+
+        :return: backend -> (sum of every column)
+        :rtype: :py:class:`dict`
+        """
+        return self._reduce_by_backend(backends, sum)
+
+    def max_by_backend(self, backends=None):
+        """Return the maximum of every column over the rows selected by each requested backend, e.g. of gauges.
+
+        See :py:meth:`sum_by_backend` for how rows are selected.
+
+        :return: backend -> (maximum of every column)
+        :rtype: :py:class:`dict`
+        """
+        return self._reduce_by_backend(backends, max)
+
+    def shares(self, backends=None):
+        """Return the share of every column in the total of the columns, for each backend of :py:meth:`sum_by_backend`.
+
+        :return: backend -> (share of every column, all 0.0 without any count)
+        :rtype: :py:class:`dict`
+        """
+        shares = {}
+        for backend, sums in self.sum_by_backend(backends).items():
+            total = sum(sums)
+            shares[backend] = tuple(float(value) / total for value in sums) if total else (0.0,) * len(sums)
+        return shares
+
+    def ratios(self, column, backends=None):
+        """Return the share of column in the total of the columns for each backend, e.g. of hrsp_5xx in a delta.
+
+        :return: backend -> ratio
+        :rtype: :py:class:`dict`
+        """
+        i = self.columns.index(column)
+        return dict((backend, shares[i]) for backend, shares in self.shares(backends).items())
+
+    def filter(self, row_filter):
+        """Return a snapshot of the rows for which ``row_filter(pxname, svname)`` is true.
+
+        :rtype: :py:class:`Snapshot`
+        """
+        rows = [i for i, (pxname, svname) in enumerate(self.keys) if row_filter(pxname, svname)]
+        return Snapshot([self.keys[i] for i in rows], self.columns,
+                        [array(INT64, [column[i] for i in rows]) for column in self.values])
+
+
+def group_request_stats(request_stats, backends=None):
+    """Return the counters of request_stats (backend -> counters) summed for each requested backend.
+
+    See :py:class:`BackendSelector` for how backends select proxies, backends may also be one. With no backends
+    requested request_stats is returned as is. Backends matching nothing are left out.
+
+    :return: backend -> (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    if not backends:
+        return request_stats
+    selector = get_selector(backends)
+    matches = {}
+    for pxname, counters in request_stats.items():
+        for backend in selector.match(pxname):
+            _add_counters(matches, backend, counters)
+    return matches
+
+
+def group_up_counts(up_counts, backends=None):
+    """Return the servers checked and up of up_counts (pxname -> up counts) summed for each requested backend.
+
+    Backends are exact names unless written as a glob or a regex, see :py:class:`BackendSelector`, and may also be
+    one. With no backends requested up_counts is returned as is. Backends matching nothing are left out.
+
+    :return: backend -> {'count': servers checked, 'up_count': servers up}
+    :rtype: :py:class:`dict`
+    """
+    if not backends:
+        return up_counts
+    selector = get_selector(backends, default="exact")
+    selected = {}
+    for pxname, counts in up_counts.items():
+        for backend in selector.match(pxname):
+            totals = selected.setdefault(backend, {"count": 0, "up_count": 0})
+            totals["count"] += counts["count"]
+            totals["up_count"] += counts["up_count"]
+    return selected
+
+
+def parse_snapshot(stats_csv, backends=None, servers=False, columns=HRSP_COLUMNS):
+    """Return a snapshot of the response code counters (or other columns) of the BACKEND rows of backends.
+
+    Only the rows of proxies selected by one of the requested backends (see :py:class:`BackendSelector`) are kept,
+    every backend without any. With servers the rows of their servers are kept too.
+
+    :rtype: :py:class:`Snapshot`
+    """
+    selector = get_selector(backends)
+
+    def row_filter(pxname, svname):
+        return (svname == "BACKEND" or servers and svname != "FRONTEND") and bool(selector.match(pxname))
+
+    return Snapshot.from_csv(stats_csv, columns, row_filter)
+
+
+def parse_request_stats(stats_csv, backends=None):
+    """Return the response code counters of backends in the CSV stats.
+
+    See :py:func:`get_request_stats_for_backends` for how backends are matched.
+
+    :return: backend -> (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    selector = get_selector(backends)
+    return parse_snapshot(stats_csv, selector).sum_by_backend(selector)
+
+
+def get_request_stats_for_backends(backends=None, base_url_path="127.0.0.1/haproxy/stats", username="", password="",
+                                   stats_socket=None, timeout=5, cache=None):
+    """Return the response code counters of many backends from a single fetch of the stats.
+
+    Like :py:func:`get_request_stats`, each requested backend sums every backend it selects: by default the ones
+    starting with it, see :py:class:`BackendSelector` for exact names, globs and regexes. With no backends requested
+    every backend is returned under its own name. Backends matching nothing are left out.
+
+    :return: backend -> (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    return parse_request_stats(
+        fetch_stats_csv(base_url_path, username, password, stats_socket, timeout, cache), backends)
+
+
+def get_request_stats(backend, base_url_path="127.0.0.1/haproxy/stats", username="", password="", stats_socket=None,
+                      cache=None):
     """Return tuple of number of requests with (1xx, 2xx, 3xx, 4xx, 5xx, other response codes).
 
     :return: (number of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
     :rtype: :py:class:`tuple(int, int, int, int, int, int)`
     """
-    h = haproxystats.HAProxyServer(base_url_path, username, password)
-    matches = []
-    for b in h.backends:
-        if b.name.startswith(backend):
-            matches.append((b.hrsp_1xx, b.hrsp_2xx, b.hrsp_3xx, b.hrsp_4xx, b.hrsp_5xx, b.hrsp_other))
-    if not matches:
+    matches = get_request_stats_for_backends([backend], base_url_path, username, password, stats_socket, cache=cache)
+    if backend not in matches:
         raise ValueError("Did not find backends starting with {0}".format(backend))
-    return tuple(map(sum, zip(*matches)))
+    return matches[backend]
 
 
-def get_hrsp_5xx_ratio(backend, base_url_path, username, password, interval):
-    """Return ratio of requests that has 5xx code during specified interval seconds.
+@contextmanager
+def use_clock(clock):
+    """Take the time of samples from ``clock.time()`` and wait between them with ``clock.sleep()`` within the block.
+
+    E.g. the clock of a :py:class:`stats_recording.StatsReplay` makes the functions sampling the stats over an
+    interval read a recording without waiting. The clock is shared by every thread.
+    """
+    global _clock
+    previous, _clock = _clock, clock
+    try:
+        yield clock
+    finally:
+        _clock = previous
+
+
+def now():
+    """Return the time samples of the stats are taken at, that of the clock of :py:func:`use_clock` if any.
 
-    :return: Ratio of requests that have 5xx HTTP codes
     :rtype: :py:class:`float`
     """
-    requests_initial = get_request_stats(backend, base_url_path, username, password)
-    time.sleep(interval)
-    requests_final = get_request_stats(backend, base_url_path, username, password)
+    return _clock.time()
+
 
+def sleep(interval):
+    """Sleep interval seconds between two samples of the stats, timed as the sleep span of :py:mod:`timing`.
+
+    Sleeps on the clock of :py:func:`use_clock` if any.
+    """
+    with timing.span("sleep"):
+        _clock.sleep(interval)
+
+
+def _get_hrsp_5xx_ratio_between(requests_initial, requests_final):
+    """Return ratio of requests that has 5xx code between two results of get_request_stats.
+
+    :return: Ratio of requests that have 5xx HTTP codes
+    :rtype: :py:class:`float`
+    """
     total_requests_during_interval = sum(requests_final) - sum(requests_initial)
     hrsp_5xx_during_interval = requests_final[4] - requests_initial[4]
 
     # division by zero avoidance
     if total_requests_during_interval == 0:
-        hrsp_5xx_ratio_interval = 0.00
+        return 0.00
+    return float(hrsp_5xx_during_interval) / total_requests_during_interval
+
+
+def get_hrsp_5xx_ratio(backend, base_url_path, username, password, interval, stats_socket=None, cache=None):
+    """Return ratio of requests that has 5xx code during specified interval seconds.
+
+    :return: Ratio of requests that have 5xx HTTP codes
+    :rtype: :py:class:`float`
+    """
+    requests_initial = get_request_stats(backend, base_url_path, username, password, stats_socket, cache)
+    sleep(interval)
+    requests_final = get_request_stats(backend, base_url_path, username, password, stats_socket, cache)
+    return _get_hrsp_5xx_ratio_between(requests_initial, requests_final)
+
+
+def get_hrsp_5xx_ratios_between(requests_initial, requests_final):
+    """Return the 5xx ratio of every backend present in both results of get_request_stats_for_backends.
+
+    :return: backend -> ratio of requests that have 5xx HTTP codes
+    :rtype: :py:class:`dict`
+    """
+    return dict((backend, _get_hrsp_5xx_ratio_between(requests_initial[backend], final))
+                for backend, final in requests_final.items() if backend in requests_initial)
+
+
+def get_hrsp_5xx_ratios(backends, base_url_path, username, password, interval, stats_socket=None, timeout=5,
+                        cache=None):
+    """Return ratio of requests that has 5xx code during specified interval seconds for many backends.
+
+    Every backend is computed from the same two fetches of the stats, see :py:func:`get_request_stats_for_backends`
+    for how backends are matched.
+
+    :return: backend -> ratio of requests that have 5xx HTTP codes
+    :rtype: :py:class:`dict`
+    """
+    selector = get_selector(backends)
+    with HAProxyStatsClient(base_url_path, username, password, stats_socket, timeout, cache) as client:
+        snapshot_initial = client.snapshot(selector)
+        sleep(interval)
+        snapshot_final = client.snapshot(selector)
+    return snapshot_final.delta(snapshot_initial).ratios("hrsp_5xx", selector)
+
+
+def _get_hrsp_ratios_between(requests_initial, requests_final):
+    """Return ratio of requests of every response code class between two results of get_request_stats.
+
+    :return: (ratio of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`tuple(float, float, float, float, float, float)`
+    """
+    during_interval = [final - initial for initial, final in zip(requests_initial, requests_final)]
+    total_requests_during_interval = sum(during_interval)
+
+    # division by zero avoidance
+    if total_requests_during_interval == 0:
+        return (0.00,) * len(during_interval)
+    return tuple(float(requests) / total_requests_during_interval for requests in during_interval)
+
+
+def get_hrsp_ratios_between(requests_initial, requests_final):
+    """Return the ratios of every response code class of every backend present in both results.
+
+    :return: backend -> (ratio of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    return dict((backend, _get_hrsp_ratios_between(requests_initial[backend], final))
+                for backend, final in requests_final.items() if backend in requests_initial)
+
+
+def get_hrsp_ratios(backends, base_url_path, username, password, interval, stats_socket=None, timeout=5,
+                    cache=None):
+    """Return ratio of requests of every response code class during specified interval seconds for many backends.
+
+    :return: backend -> (ratio of requests with 1xx, 2xx, 3xx, 4xx, 5xx, other response codes)
+    :rtype: :py:class:`dict`
+    """
+    selector = get_selector(backends)
+    with HAProxyStatsClient(base_url_path, username, password, stats_socket, timeout, cache) as client:
+        snapshot_initial = client.snapshot(selector)
+        sleep(interval)
+        snapshot_final = client.snapshot(selector)
+    return snapshot_final.delta(snapshot_initial).shares(selector)
+
+
+def find_hrsp_5xx_outliers(delta, backends=None, min_requests=100, threshold=3.0):
+    """Return the servers whose 5xx ratio in a delta of snapshots is an outlier among the servers of their backend.
+
+    Every server that served at least min_requests is compared with its peers, the other servers selected by the same
+    backend (see :py:class:`BackendSelector`): it is an outlier when its ratio is more than threshold binomial
+    standard deviations above the pooled ratio of its peers. The totals of every backend are summed in a single pass
+    over the server rows, after which each server is compared in constant time.
+
+    :return: backend -> [(proxy/server, requests, ratio, ratio of its peers, deviations)], most deviant first
+    :rtype: :py:class:`dict`
+    """
+    with timing.span("aggregate"):
+        return _find_hrsp_5xx_outliers(delta, get_selector(backends), min_requests, threshold)
+
+
+def _find_hrsp_5xx_outliers(delta, selector, min_requests, threshold):
+    errors_column = delta.values[delta.columns.index("hrsp_5xx")]
+    servers, totals = [], {}
+    for row, counters in enumerate(zip(*delta.values)):
+        pxname, svname = delta.keys[row]
+        if svname in ("FRONTEND", "BACKEND") or min(counters) < 0:  # counters reset, e.g. the server was re-added
+            continue
+        requests, errors = sum(counters), errors_column[row]
+        for backend in selector.match(pxname):
+            _add_counters(totals, backend, (requests, errors))
+            servers.append((backend, "{0}/{1}".format(pxname, svname), requests, errors))
+
+    outliers = {}
+    for backend, server, requests, errors in servers:
+        peers_requests, peers_errors = [total - own for total, own in zip(totals[backend], (requests, errors))]
+        if requests < min_requests or not peers_requests:
+            continue
+        expected = (peers_errors + 0.5) / (peers_requests + 1.0)  # smoothed, a flawless pool still has a deviation
+        ratio = float(errors) / requests
+        deviations = (ratio - expected) / math.sqrt(expected * (1 - expected) / requests)
+        if deviations > threshold:
+            outliers.setdefault(backend, []).append(
+                (server, requests, ratio, float(peers_errors) / peers_requests, deviations))
+    for found in outliers.values():
+        found.sort(key=lambda outlier: -outlier[4])
+    return outliers
+
+
+def get_hrsp_5xx_ratios_and_outliers(backends, base_url_path, username, password, interval, stats_socket=None,
+                                     timeout=5, cache=None, min_requests=100, threshold=3.0):
+    """Return the 5xx ratio of backends and their outlier servers during interval seconds, from the same two fetches.
+
+    See :py:func:`find_hrsp_5xx_outliers` for min_requests and threshold.
+
+    :return: (backend -> ratio of requests that have 5xx HTTP codes, backend -> outlier servers)
+    :rtype: :py:class:`tuple(dict, dict)`
+    """
+    selector = get_selector(backends)
+    with HAProxyStatsClient(base_url_path, username, password, stats_socket, timeout, cache) as client:
+        snapshot_initial = client.snapshot(selector, servers=True)
+        sleep(interval)
+        snapshot_final = client.snapshot(selector, servers=True)
+    delta = snapshot_final.delta(snapshot_initial)
+    return (delta.filter(lambda pxname, svname: svname == "BACKEND").ratios("hrsp_5xx", selector),
+            find_hrsp_5xx_outliers(delta, selector, min_requests, threshold))
+
+
+def get_hrsp_5xx_ratio_bounds(errors, requests, deviations=3.0):
+    """Return the Wilson score interval of the 5xx ratio of a backend, deviations standard deviations wide.
+
+    :return: (lowest, highest) 5xx ratio the requests seen are likely to come from, (0.0, 1.0) without any
+    :rtype: :py:class:`tuple(float, float)`
+    """
+    if requests <= 0:
+        return 0.0, 1.0
+    ratio = float(errors) / requests
+    z2 = deviations * deviations
+    center = (ratio + z2 / (2 * requests)) / (1 + z2 / requests)
+    spread = deviations * math.sqrt(ratio * (1 - ratio) / requests + z2 / (4.0 * requests * requests)) / (
+        1 + z2 / requests)
+    return max(center - spread, 0.0), min(center + spread, 1.0)
+
+
+def _is_hrsp_5xx_ratio_decided(counters, warning_ratio, critical_ratio, deviations):
+    """Return whether the 5xx ratio of counters is surely above critical_ratio, or surely below warning_ratio."""
+    lowest, highest = get_hrsp_5xx_ratio_bounds(counters[4], sum(counters), deviations)
+    return lowest > critical_ratio or highest < warning_ratio
+
+
+def get_hrsp_5xx_ratios_adaptive(backends, base_url_path, username, password, interval, warning_ratio, critical_ratio,
+                                 sample_interval=5, deviations=3.0, stats_socket=None, timeout=5, cache=None):
+    """Return the 5xx ratio of backends sampled every sample_interval seconds, stopping once each one is decided.
+
+    Like :py:func:`get_hrsp_5xx_ratios` the stats are sampled for up to interval seconds, but the ratios are
+    computed against the first sample every sample_interval seconds. As soon as every backend found has a ratio
+    deviations standard deviations above critical_ratio, or below warning_ratio (see
+    :py:func:`get_hrsp_5xx_ratio_bounds`), the ratios are returned without waiting for the rest of interval: a
+    backend failing badly is reported within seconds, a healthy backend serving many requests too, while a ratio
+    close to the thresholds, or a backend with little traffic, is still sampled over the whole interval.
+
+    :return: (backend -> ratio of requests that have 5xx HTTP codes, seconds sampled)
+    :rtype: :py:class:`tuple(dict, float)`
+    """
+    selector = get_selector(backends)
+    with HAProxyStatsClient(base_url_path, username, password, stats_socket, timeout, cache) as client:
+        snapshot_initial = client.snapshot(selector)
+        started = now()
+        while True:
+            sleep(max(min(sample_interval, started + interval - now()), 0))
+            counters = client.snapshot(selector).delta(snapshot_initial).sum_by_backend(selector)
+            elapsed = now() - started
+            if elapsed >= interval or counters and all(
+                    _is_hrsp_5xx_ratio_decided(c, warning_ratio, critical_ratio, deviations)
+                    for c in counters.values()):
+                break
+    return (dict((backend, float(c[4]) / sum(c) if sum(c) else 0.0) for backend, c in counters.items()),
+            min(elapsed, interval))
+
+
+def fan_out(f, endpoints, timeout=5):
+    """Call f(endpoint) for every endpoint concurrently, giving up on endpoints not done within timeout seconds.
+
+    The threads are joined before returning, so that none outlives the check: f must itself give up soon after
+    timeout, like the fetches given timeout do.
+
+    :return: endpoint -> (result, None) on success, endpoint -> (None, exception) on failure
+    :rtype: :py:class:`dict`
+    """
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(len(endpoints))
+    try:
+        pending = [(endpoint, pool.apply_async(f, (endpoint,))) for endpoint in endpoints]
+        deadline = time.time() + timeout
+        results = {}
+        for endpoint, async_result in pending:
+            try:
+                results[endpoint] = async_result.get(max(deadline - time.time(), 0)), None
+            except Exception as e:
+                if not str(e):  # multiprocessing.TimeoutError has no message
+                    e = type(e)("timed out after {0} seconds".format(timeout))
+                results[endpoint] = None, e
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def _add_counters(totals, key, counters):
+    """Add counters to the ones kept under key in totals."""
+    previous = totals.get(key)
+    totals[key] = counters if previous is None else tuple(map(sum, zip(previous, counters)))
+
+
+def get_hrsp_5xx_ratios_for_endpoints(backends, endpoints, username, password, interval, timeout=5, cache=None):
+    """Return ratio of requests that has 5xx code during specified interval seconds on every node of a fleet.
+
+    Every node is sampled concurrently at the start and at the end of the interval. The cluster-wide ratio of a
+    backend sums its requests on every node that answered both times.
+
+    :return: (endpoint -> (backend -> ratio, None) or (None, exception), backend -> cluster-wide ratio)
+    :rtype: :py:class:`tuple(dict, dict)`
+    """
+    clients = dict((endpoint, HAProxyStatsClient(endpoint, username, password, timeout=timeout, cache=cache))
+                   for endpoint in endpoints)
+
+    def fetch(endpoint):
+        return clients[endpoint].request_stats(backends)
+
+    try:
+        requests_initial = fan_out(fetch, endpoints, timeout)
+        sleep(interval)
+        requests_final = fan_out(fetch, endpoints, timeout)
+    finally:
+        for client in clients.values():
+            client.close()
+
+    nodes = {}
+    cluster_initial, cluster_final = {}, {}
+    for endpoint in endpoints:
+        (initial, error), (final, final_error) = requests_initial[endpoint], requests_final[endpoint]
+        if error or final_error:
+            nodes[endpoint] = None, error or final_error
+            continue
+        nodes[endpoint] = get_hrsp_5xx_ratios_between(initial, final), None
+        for backend, counters in final.items():
+            if backend in initial:
+                _add_counters(cluster_initial, backend, initial[backend])
+                _add_counters(cluster_final, backend, counters)
+    return nodes, get_hrsp_5xx_ratios_between(cluster_initial, cluster_final)
+
+
+def _get_state_key(base_url_path, backend):
+    """Return the key under which snapshots of backend are kept in a state file."""
+    return "{0} {1}".format(base_url_path, backend)
+
+
+def _read_state(state_file):
+    """Return the content of state_file, or an empty dict if it is missing or unreadable."""
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return {}
+    except ValueError:  # truncated or corrupt, start over
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def _write_state(state_file, state):
+    """Atomically replace state_file with state so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(state_file)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.rename(tmp_path, state_file)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def swap_snapshots(state_file, timestamp, counters_by_key):
+    """Store counters taken at timestamp under their keys in state_file and return the snapshots they replace.
+
+    The read-modify-write is serialized with an exclusive lock on ``<state_file>.lock`` so concurrent checks
+    sharing a state file do not lose each other's snapshots.
+
+    :return: key -> (timestamp, counters) of the previous snapshot, for keys that had one
+    :rtype: :py:class:`dict`
+    """
+    with open(state_file + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            state = _read_state(state_file)
+            previous = dict((key, state[key]) for key in counters_by_key if state.get(key))
+            for key, counters in counters_by_key.items():
+                state[key] = {"timestamp": timestamp, "counters": list(counters)}
+            _write_state(state_file, state)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return dict((key, (p["timestamp"], tuple(p["counters"]))) for key, p in previous.items())
+
+
+def swap_snapshot(state_file, key, timestamp, counters):
+    """Store counters taken at timestamp under key in state_file and return the snapshot it replaces.
+
+    :return: (timestamp, counters) of the previous snapshot, or None if there was none
+    :rtype: :py:class:`tuple(float, tuple)`
+    """
+    return swap_snapshots(state_file, timestamp, {key: counters}).get(key)
+
+
+def _is_usable_snapshot(previous, timestamp, requests_final, min_state_age, max_state_age):
+    """Return whether a previous snapshot can serve as the start of the interval ending at timestamp."""
+    if previous is None:
+        return False
+    previous_timestamp, requests_initial = previous
+    counters_reset = any(f < i for i, f in zip(requests_initial, requests_final))  # e.g. HAProxy reloaded
+    fresh = min_state_age <= timestamp - previous_timestamp <= max_state_age and timestamp > previous_timestamp
+    return fresh and len(requests_initial) == len(requests_final) and not counters_reset
+
+
+def get_hrsp_5xx_ratios_stateful(backends, base_url_path, username, password, interval, state_file,
+                                 max_state_age=300, stats_socket=None, timeout=5, cache=None):
+    """Return ratio of requests that has 5xx code since the snapshots saved in state_file by the previous run.
+
+    Every call saves the current counters for the next run. When any backend has no usable previous snapshot (first
+    run, snapshot older than max_state_age seconds or younger than MIN_STATE_AGE of interval, or counters went
+    backwards after an HAProxy reload) this falls back to sampling every backend over interval seconds like
+    :py:func:`get_hrsp_5xx_ratios`.
+
+    :return: (backend -> ratio of requests that have 5xx HTTP codes, seconds the ratios were observed over)
+    :rtype: :py:class:`tuple(dict, float)`
+    """
+    source = _get_source(base_url_path, stats_socket)
+    timestamp = now()
+    requests_final = get_request_stats_for_backends(
+        backends, base_url_path, username, password, stats_socket, timeout, cache)
+    previous = swap_snapshots(state_file, timestamp, dict(
+        (_get_state_key(source, backend), counters) for backend, counters in requests_final.items()))
+
+    requests_initial = {}
+    for backend, counters in requests_final.items():
+        snapshot = previous.get(_get_state_key(source, backend))
+        if not _is_usable_snapshot(snapshot, timestamp, counters, MIN_STATE_AGE * interval, max_state_age):
+            break
+        requests_initial[backend] = snapshot
     else:
-        hrsp_5xx_ratio_interval = float(hrsp_5xx_during_interval) / total_requests_during_interval
+        elapsed = timestamp - min([saved for saved, _ in requests_initial.values()] or [timestamp])
+        return get_hrsp_5xx_ratios_between(
+            dict((backend, counters) for backend, (_, counters) in requests_initial.items()), requests_final), elapsed
+
+    requests_initial = requests_final
+    sleep(interval)
+    timestamp = now()
+    requests_final = get_request_stats_for_backends(
+        backends, base_url_path, username, password, stats_socket, timeout, cache)
+    swap_snapshots(state_file, timestamp, dict(
+        (_get_state_key(source, backend), counters) for backend, counters in requests_final.items()))
+    return get_hrsp_5xx_ratios_between(requests_initial, requests_final), interval
+
 
-    return hrsp_5xx_ratio_interval
+def get_hrsp_5xx_ratio_stateful(backend, base_url_path, username, password, interval, state_file,
+                                max_state_age=300, stats_socket=None):
+    """Return ratio of requests that has 5xx code since the snapshot saved in state_file by the previous run.
+
+    See :py:func:`get_hrsp_5xx_ratios_stateful`.
+
+    :return: (ratio of requests that have 5xx HTTP codes, seconds the ratio was observed over)
+    :rtype: :py:class:`tuple(float, float)`
+    """
+    ratios, elapsed = get_hrsp_5xx_ratios_stateful(
+        [backend], base_url_path, username, password, interval, state_file, max_state_age, stats_socket)
+    if backend not in ratios:
+        raise ValueError("Did not find backends starting with {0}".format(backend))
+    return ratios[backend], elapsed
@@ -4,10 +4,11 @@ from __future__ import print_function
 
 import argparse
 import socket
-import subprocess
 import sys
 
+from . import gmetric
 from . import haproxy_util
+from . import stats_cache
 
 RETURN_CODES = {"OK": 0, "WARNING": 1, "CRITICAL": 2, "UNKNOWN": 3}
 
@@ -31,33 +32,57 @@ def _get_parser():
     :rtype: :py:class:`argparse.ArgumentParser`
     """
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("--backend", required=True, help="Backend to check 5xx ratio.")
+    parser.add_argument(
+        "--backend", dest="backends", action="append", required=True,
+        help="Backend to report response code ratios of, may be repeated. Matches backends starting with it, or "
+             "named exactly it with a leading '=', or matching it when a glob or a regex with a leading '~'. 'all' "
+             "reports every backend separately.")
     parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
     parser.add_argument("--username", help="Username to login to haproxy stats page.")
     parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser, perfdata=False)
     parser.add_argument("--interval", type=int, default=60, help="Time to observe 500 rates (in seconds).")
-    parser.add_argument("--gmetric-path", default="/usr/bin/gmetric", help="Path to gmetic bin")
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for the stats (in seconds).")
+    parser.add_argument("--gmond-host", default="127.0.0.1", help="Host of the gmond udp_recv_channel.")
+    parser.add_argument("--gmond-port", type=int, default=8649, help="Port of the gmond udp_recv_channel.")
+    parser.add_argument(
+        "--gmetric-path", help="Deprecated and ignored, the metrics are sent to gmond without running gmetric.")
     parser.add_argument("--gmetric-tmax", type=int, default=120, help="gmetric tmax setting")
     parser.add_argument("--gmetric-dmax", type=int, default=150, help="gmetric dmax setting")
     return parser
 
 
 @unknown_exception
-def _report_haproxy_rates(backend, base_url_path, username, password, interval, gmetric_path,
-                          gmetric_dmax, gmetric_tmax):
-    """Return appropriate exit code and print informational message.
+def _report_haproxy_rates(backends, base_url_path, username, password, interval, gmond_host, gmond_port,
+                          gmetric_dmax, gmetric_tmax, stats_socket=None, timeout=5, cache=None):
+    """Send the percent of requests of every response code class of every backend to gmond.
+
+    All backends are computed from the same pair of stats snapshots, None reports every backend. The metrics of a run
+    are sent together from one UDP socket instead of running gmetric once per value.
 
     :return: Exit Code (depending on success)
     :rtype: :py:class:`int`
     """
-    # hostname = socket.gethostname()
-    # hrsp_5xx_ratio_interval = haproxy_util.get_hrsp_5xx_ratio(backend, base_url_path, username, password, interval)
-    # hrsp_5xx_percent_interval = "{0:.2f}".format(hrsp_5xx_ratio_interval * 100)  # convert it to percent
-    # command = [gmetric_path, "-d", str(gmetric_dmax), "-x", str(gmetric_tmax), "-n",
-    #            "haproxy_{0}_{1}_5xx_percent".format(hostname, backend), "-v", str(hrsp_5xx_percent_interval), "-s",
-    #            "both", "-g", "haproxy", "-t", "float"]
-    # subprocess.check_call(command)
-    return 0
+    hostname = socket.gethostname()
+    hrsp_ratios = haproxy_util.get_hrsp_ratios(
+        backends, base_url_path, username, password, interval, stats_socket, timeout, cache)
+    rc = RETURN_CODES["OK"]
+    for backend in backends or ():
+        if backend not in hrsp_ratios:
+            print("Did not find backends starting with {0}".format(backend))
+            rc = RETURN_CODES["UNKNOWN"]
+    if not hrsp_ratios:
+        print("Did not find any backends")
+        return RETURN_CODES["UNKNOWN"]
+
+    metrics = []
+    for backend in sorted(hrsp_ratios):
+        for column, ratio in zip(haproxy_util.HRSP_COLUMNS, hrsp_ratios[backend]):
+            metrics.append(("haproxy_{0}_{1}_{2}_percent".format(hostname, backend, column[len("hrsp_"):]),
+                            "{0:.2f}".format(ratio * 100)))  # convert it to percent
+    gmetric.send_metrics(metrics, gmond_host, gmond_port, host=hostname, slope="both", tmax=gmetric_tmax,
+                         dmax=gmetric_dmax, group="haproxy")
+    return rc
 
 
 def main():
@@ -68,15 +93,21 @@ def main():
     """
     parser = _get_parser()
     args = parser.parse_args()
+    if args.cache_dir and args.cache_ttl >= args.interval:
+        parser.error("--cache-ttl must be shorter than --interval, or both samples would be the same stats")
     rc = _report_haproxy_rates(
-        backend=args.backend,
+        backends=None if "all" in args.backends else args.backends,
         base_url_path=args.base_url_path,
         username=args.username,
         password=args.password,
         interval=args.interval,
-        gmetric_path=args.gmetric_path,
+        gmond_host=args.gmond_host,
+        gmond_port=args.gmond_port,
         gmetric_dmax=args.gmetric_dmax,
-        gmetric_tmax=args.gmetric_tmax)
+        gmetric_tmax=args.gmetric_tmax,
+        stats_socket=args.stats_socket,
+        timeout=args.timeout,
+        cache=stats_cache.StatsCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None)
     return rc
 
 
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Export the response code counters and server counts of HAProxy to Prometheus on /metrics."""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import socketserver
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import SocketServer as socketserver
+
+from . import check_haproxy_stats_up
+from . import haproxy_util
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Suffix closing the labels of haproxy_http_responses_total for every response code class.
+_CODE_SUFFIXES = tuple('code="{0}"}} '.format(column[len("hrsp_"):]) for column in haproxy_util.HRSP_COLUMNS)
+
+
+def _escape(value):
+    """Return value escaped to be used as a label value."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _header(name, metric_type, help_text):
+    return ["# HELP {0} {1}".format(name, help_text), "# TYPE {0} {1}".format(name, metric_type)]
+
+
+def render_metrics(stats_csv):
+    """Return the exposition lines of the counters of every row and the server counts of every backend.
+
+    Label strings are built once per row and every sample is a plain concatenation. This runs once per snapshot,
+    not once per scrape, see :py:class:`SnapshotCache`.
+
+    :return: lines of the Prometheus text format, without trailing newlines
+    :rtype: :py:class:`list`
+    """
+    lines = _header("haproxy_http_responses_total", "counter", "HTTP responses by class of status code.")
+    for row in haproxy_util.iter_stats(stats_csv, ("pxname", "svname") + haproxy_util.HRSP_COLUMNS):
+        prefix = 'haproxy_http_responses_total{{proxy="{0}",server="{1}",'.format(_escape(row[0]), _escape(row[1]))
+        for suffix, value in zip(_CODE_SUFFIXES, row[2:]):
+            lines.append(prefix + suffix + str(value or 0))
+
+    up_counts = check_haproxy_stats_up.count_services_up(stats_csv)
+    lines.extend(_header("haproxy_backend_servers_up", "gauge", "Checked servers of the backend that are up."))
+    lines.extend('haproxy_backend_servers_up{{backend="{0}"}} {1}'.format(_escape(backend), counts["up_count"])
+                 for backend, counts in sorted(up_counts.items()))
+    lines.extend(_header("haproxy_backend_servers_down", "gauge", "Checked servers of the backend that are not up."))
+    lines.extend('haproxy_backend_servers_down{{backend="{0}"}} {1}'.format(
+        _escape(backend), counts["count"] - counts["up_count"]) for backend, counts in sorted(up_counts.items()))
+    return lines
+
+
+class SnapshotCache(object):
+    """Serve the rendered metrics of one fetch of the stats to every scrape within refresh_interval seconds.
+
+    Only one scrape refreshes an expired snapshot; concurrent scrapes wait for it and are served the same snapshot,
+    so HAProxy is never asked for the stats more than once per refresh_interval however many scrapers there are.
+    """
+
+    def __init__(self, fetch, refresh_interval=5):
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.snapshot = None  # (timestamp, body)
+        self.lock = threading.Lock()
+
+    def _is_fresh(self, snapshot):
+        return snapshot is not None and time.time() - snapshot[0] < self.refresh_interval
+
+    def get(self):
+        """Return the body of the current snapshot, refreshing it first if it has expired.
+
+        :return: metrics in the Prometheus text format
+        :rtype: :py:class:`bytes`
+        """
+        snapshot = self.snapshot
+        if not self._is_fresh(snapshot):
+            with self.lock:
+                snapshot = self.snapshot
+                if not self._is_fresh(snapshot):  # not refreshed by the scrape holding the lock before us
+                    snapshot = self.snapshot = (time.time(), self._render())
+        return snapshot[1]
+
+    def _render(self):
+        started = time.time()
+        try:
+            lines = render_metrics(self.fetch())
+            up = 1
+        except Exception:
+            log.exception("Failed to fetch the stats")
+            lines, up = [], 0
+        lines.extend(_header("haproxy_up", "gauge", "Whether the last fetch of the stats succeeded."))
+        lines.append("haproxy_up {0}".format(up))
+        lines.extend(_header("haproxy_scrape_duration_seconds", "gauge", "Time spent fetching and parsing the stats."))
+        lines.append("haproxy_scrape_duration_seconds {0:.6f}".format(time.time() - started))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.cache.get()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Serve the snapshots of a :py:class:`SnapshotCache` on /metrics."""
+
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        HTTPServer.__init__(self, address, _RequestHandler)
+        self.cache = cache
+
+
+def _get_parser():
+    """Return an argparse parser.
+
+    :return: an argparse.ArgumentParser that would take in appropriate user input
+    :rtype: :py:class:`argparse.ArgumentParser`
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser, cache=False, perfdata=False)
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for the stats (in seconds).")
+    parser.add_argument("--listen", default="0.0.0.0:9101", help="Address and port to serve /metrics on.")
+    parser.add_argument("--refresh-interval", type=int, default=5,
+                        help="Time scrapes are served the same fetch of the stats for (in seconds).")
+    return parser
+
+
+def main():
+    """Parse user input and serve /metrics until interrupted."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = _get_parser().parse_args()
+
+    client = haproxy_util.HAProxyStatsClient(
+        args.base_url_path, args.username, args.password, args.stats_socket, args.timeout)
+    host, _, port = args.listen.rpartition(":")
+    server = MetricsServer((host, int(port)), SnapshotCache(client.fetch, args.refresh_interval))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Keep the response code counters of every backend sampled over time, to compute ratios over any window."""
+
+from array import array
+
+from . import haproxy_util
+
+COUNTERS = len(haproxy_util.HRSP_COLUMNS)
+
+
+class SampleRing(object):
+    """Fixed-size ring buffer of (timestamp, hrsp counters) samples of one backend, oldest first.
+
+    Timestamps and counters are kept in two flat arrays allocated once, rather than a tuple and a dict per sample.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array("d", [0.0]) * capacity
+        self.counters = array(haproxy_util.INT64, [0]) * (capacity * COUNTERS)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def get(self, i):
+        """Return (timestamp, counters) of the i-th oldest sample, negative i counting from the newest."""
+        slot = self._slot(i + self.size if i < 0 else i)
+        return self.timestamps[slot], tuple(self.counters[slot * COUNTERS:(slot + 1) * COUNTERS])
+
+    def append(self, timestamp, counters):
+        """Add the newest sample, dropping the oldest one when full and all of them when counters went backwards."""
+        if self.size and any(c < p for p, c in zip(self.get(-1)[1], counters)):  # e.g. HAProxy reloaded
+            self.size = 0
+        if self.size == self.capacity:
+            self.start = self._slot(1)
+            self.size -= 1
+        slot = self._slot(self.size)
+        self.timestamps[slot] = timestamp
+        self.counters[slot * COUNTERS:(slot + 1) * COUNTERS] = array(haproxy_util.INT64, counters)
+        self.size += 1
+
+    def find(self, timestamp):
+        """Return the index of the newest sample taken at or before timestamp, None if every sample is newer."""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[self._slot(mid)] <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1 if lo else None
+
+    def window(self, seconds):
+        """Return the counters at least seconds before the newest sample, the newest counters and the time between.
+
+        :return: (initial counters, final counters, elapsed seconds), None if the ring does not cover seconds
+        :rtype: :py:class:`tuple(tuple, tuple, float)`
+        """
+        if not self.size:
+            return None
+        final_timestamp, requests_final = self.get(-1)
+        i = self.find(final_timestamp - seconds)
+        if i is None:
+            return None
+        initial_timestamp, requests_initial = self.get(i)
+        return requests_initial, requests_final, final_timestamp - initial_timestamp
+
+
+class SampleStore(object):
+    """A :py:class:`SampleRing` per backend, all fed by a single sampler of the stats."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rings = {}
+
+    def add(self, timestamp, request_stats):
+        """Add the counters of every backend (see :py:func:`haproxy_util.parse_request_stats`) sampled at timestamp.
+
+        Backends that are no longer in the stats are forgotten.
+        """
+        for backend in set(self.rings) - set(request_stats):
+            del self.rings[backend]
+        for backend, counters in request_stats.items():
+            ring = self.rings.get(backend)
+            if ring is None:
+                ring = self.rings[backend] = SampleRing(self.capacity)
+            ring.append(timestamp, counters)
+
+    def get_hrsp_5xx_ratios(self, backends, window):
+        """Return the 5xx ratios over the last window seconds, see :py:func:`haproxy_util.group_request_stats`.
+
+        Requested backends selecting a backend whose ring does not cover window yet are left out, rather than given
+        the ratio of only the backends it covers.
+
+        :return: (backend -> ratio of requests that have 5xx HTTP codes, seconds the ratios were observed over)
+        :rtype: :py:class:`tuple(dict, float)`
+        """
+        requests_initial, requests_final, elapsed, uncovered = {}, {}, 0, []
+        for backend, ring in self.rings.items():
+            span = ring.window(window)
+            if span is not None:
+                requests_initial[backend], requests_final[backend], seconds = span
+                elapsed = max(elapsed, seconds)
+            else:
+                uncovered.append(backend)
+        if not requests_final:
+            raise ValueError("Less than {0} seconds of stats collected".format(window))
+        hrsp_5xx_ratios = haproxy_util.get_hrsp_5xx_ratios_between(
+            haproxy_util.group_request_stats(requests_initial, backends),
+            haproxy_util.group_request_stats(requests_final, backends))
+        selector = haproxy_util.get_selector(backends)
+        for backend in set(match for pxname in uncovered for match in selector.match(pxname)):
+            hrsp_5xx_ratios.pop(backend, None)
+        return hrsp_5xx_ratios, elapsed
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Share the stats fetched by one check with the checks started at the same moment, through files on disk."""
+
+import errno
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+
+class StatsCache(object):
+    """Raw stats payloads kept in directory for ttl seconds, keyed by the endpoint they were fetched from.
+
+    A payload missing or older than ttl is fetched by a single process holding an exclusive lock on
+    ``<payload>.lock``. Processes asking for it meanwhile wait on the lock and reuse the payload written by that
+    process, so a burst of checks costs HAProxy one fetch per endpoint.
+    """
+
+    def __init__(self, directory, ttl=5):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, "stats-{0}.csv".format(hashlib.sha1(key.encode("utf-8")).hexdigest()))
+
+    def _read_fresh(self, path):
+        """Return the payload at path if it was written less than ttl seconds ago, None otherwise."""
+        try:
+            with open(path, "rb") as f:
+                if time.time() - os.fstat(f.fileno()).st_mtime >= self.ttl:
+                    return None
+                return f.read().decode("utf-8")
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def _write(self, path, payload):
+        """Atomically replace the payload at path so readers never see a partial one."""
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload.encode("utf-8"))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key, fetch):
+        """Return the payload cached under key, calling fetch() to refresh it if it is missing or expired.
+
+        :return: CSV stats, header line included
+        :rtype: :py:class:`str`
+        """
+        path = self._path(key)
+        payload = self._read_fresh(path)
+        if payload is not None:
+            return payload
+
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # wait for the process already fetching it, if any
+            try:
+                payload = self._read_fresh(path)
+                if payload is None:
+                    payload = fetch()
+                    self._write(path, payload)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return payload
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""Record the stats of HAProxy to a file, to replay them offline through the checks and haproxy_util."""
+
+import argparse
+import gzip
+import json
+import logging
+import sys
+import time
+
+from . import haproxy_util
+
+log = logging.getLogger(__name__)
+
+
+def _diff_line(previous, line):
+    """Return the cells of line differing from previous as [index, cell, ...], or line when cells were added."""
+    cells, previous_cells = line.split(","), previous.split(",")
+    if len(cells) != len(previous_cells):
+        return line
+    changes = []
+    for j, (cell, previous_cell) in enumerate(zip(cells, previous_cells)):
+        if cell != previous_cell:
+            changes.extend((j, cell))
+    return changes
+
+
+def _patch_line(previous, change):
+    """Return the line previous changed by an output of :py:func:`_diff_line`."""
+    if not isinstance(change, list):
+        return change
+    cells = previous.split(",")
+    for j, cell in zip(change[::2], change[1::2]):
+        cells[j] = cell
+    return ",".join(cells)
+
+
+class StatsRecorder(object):
+    """Append timestamped CSV stats to a recording, each one stored as the cells changed since the previous one.
+
+    A recording is a gzip file of JSON lines. A keyframe, ``{"t": timestamp, "csv": stats}``, starts every recorder
+    and comes back every keyframe_interval snapshots, any other snapshot is ``{"t": timestamp, "n": number of lines,
+    "d": [[line index, [cell index, cell, ...] or the whole new line], ...]}``. Since most cells of consecutive
+    snapshots are the same, a snapshot of thousands of rows mostly takes the counters that moved. Recorders opened
+    on an existing recording append to it.
+    """
+
+    def __init__(self, path, keyframe_interval=60):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.file = gzip.open(path, "ab", compresslevel=6)
+        self.lines = None
+        self.recorded = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, stats_csv, timestamp=None):
+        """Append stats_csv fetched at timestamp (now by default) to the recording."""
+        timestamp = time.time() if timestamp is None else timestamp
+        lines = stats_csv.split("\n")
+        if self.lines is None or self.recorded % self.keyframe_interval == 0:
+            entry = {"t": timestamp, "csv": stats_csv}
+        else:
+            previous = self.lines
+            entry = {"t": timestamp, "n": len(lines), "d": [
+                [i, line if i >= len(previous) else _diff_line(previous[i], line)]
+                for i, line in enumerate(lines) if i >= len(previous) or previous[i] != line]}
+        self.file.write((json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8"))
+        self.file.flush()
+        self.lines = lines
+        self.recorded += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path):
+    """Yield every snapshot of a recording, oldest first.
+
+    :return: generator of (timestamp, CSV stats)
+    """
+    lines = None
+    with gzip.open(path, "rb") as f:
+        for entry in f:
+            entry = json.loads(entry.decode("utf-8"))
+            if "csv" in entry:
+                lines = entry["csv"].split("\n")
+            elif lines is None:
+                raise ValueError("{0} does not start with a keyframe".format(path))
+            else:
+                del lines[entry["n"]:]
+                lines.extend([""] * (entry["n"] - len(lines)))
+                for i, change in entry["d"]:
+                    lines[i] = _patch_line(lines[i], change)
+            yield entry["t"], "\n".join(lines)
+
+
+class StatsReplay(object):
+    """Replay a recording on a virtual clock, as a cache of the stats and the clock of haproxy_util while entered.
+
+    See :py:func:`haproxy_util.use_clock`. The clock starts at the first snapshot, ``sleep()`` moves it forward at
+    once, and every fetch through the cache gets the last snapshot recorded at the time of the clock. Replaying an
+    hour of stats through a check sampling them every minute then takes the time of parsing them, e.g.::
+
+        with StatsReplay("haproxy.rec.gz") as replay:
+            while not replay.finished:
+                ratio = haproxy_util.get_hrsp_5xx_ratio("api", "replay", None, None, 60, cache=replay)
+    """
+
+    def __init__(self, path):
+        self.snapshots = read_recording(path)
+        self.now, self.stats_csv = next(self.snapshots)
+        self.next = next(self.snapshots, None)
+        self._using_clock = None
+
+    def __enter__(self):
+        self._using_clock = haproxy_util.use_clock(self)
+        self._using_clock.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._using_clock.__exit__(*exc_info)
+
+    @property
+    def finished(self):
+        """Whether the clock is past the last snapshot."""
+        return self.next is None
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        while self.next is not None and self.next[0] <= self.now:
+            _, self.stats_csv = self.next
+            self.next = next(self.snapshots, None)
+
+    def get(self, key, fetch):
+        """Return the stats at the time of the clock, whatever they are asked to be fetched from."""
+        return self.stats_csv
+
+
+def record_stats(path, fetch, poll_interval=10, duration=None, keyframe_interval=60):
+    """Record the stats returned by fetch every poll_interval seconds, for duration seconds or until interrupted.
+
+    A fetch that fails is skipped, the next one is still recorded.
+
+    :return: number of snapshots recorded
+    :rtype: :py:class:`int`
+    """
+    started = time.time()
+    with StatsRecorder(path, keyframe_interval) as recorder:
+        while duration is None or time.time() - started < duration:
+            polled = time.time()
+            try:
+                recorder.record(fetch(), polled)
+            except Exception:
+                log.exception("Failed to record the stats")
+            time.sleep(max(poll_interval - (time.time() - polled), 0))
+        return recorder.recorded
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--output", required=True, help="Recording to append the stats to (gzip).")
+    parser.add_argument("--base-url-path", default="127.0.0.1/haproxy/stats")
+    parser.add_argument("--username", help="Username to login to haproxy stats page.")
+    parser.add_argument("--password", help="Password to login to haproxy stats page.")
+    haproxy_util.add_stats_source_arguments(parser, cache=False, perfdata=False)
+    parser.add_argument("--timeout", type=int, default=5, help="Time to wait for each stats fetch (in seconds).")
+    parser.add_argument("--poll-interval", type=float, default=10, help="Time between two snapshots (in seconds).")
+    parser.add_argument("--duration", type=float, help="Time to record for (in seconds), until interrupted if unset.")
+    parser.add_argument(
+        "--keyframe-interval", type=int, default=60,
+        help="Store every this many snapshots whole, the others as the lines changed since the previous snapshot.")
+    return parser
+
+
+def main():
+    """Parser user input and record the stats.
+
+    :return: Exit code.
+    :rtype: :py:class:`int`
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = _get_parser().parse_args()
+    client = haproxy_util.HAProxyStatsClient(
+        args.base_url_path, args.username, args.password, args.stats_socket, args.timeout)
+    try:
+        record_stats(args.output, client.fetch, args.poll_interval, args.duration, args.keyframe_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
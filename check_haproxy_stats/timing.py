@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Timing spans and counts of the hot paths of a check, reported to hooks.
+
+Library code wraps its steps in :py:func:`span` (fetch, parse, aggregate, sleep) and reports sizes with
+:py:func:`count` (rows, bytes). Both are reported to every hook added with :py:func:`add_hook`, as
+``hook(name, value)`` with spans named ``<step>_ms`` and valued in milliseconds. Without any hook nothing is timed:
+a span is a shared no-op context manager and a count a single test. :py:class:`Timings` is a hook summing what is
+reported while it is entered, e.g.::
+
+    with timing.Timings() as timings:
+        haproxy_util.get_hrsp_5xx_ratios(["api"], "127.0.0.1/haproxy/stats", None, None, 60)
+    print("| " + timings.perfdata())
+
+A command reports its own timings by running the check in a :py:class:`Report`, which appends them to the first line
+it prints.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+_clock = getattr(time, "perf_counter", time.time)
+
+_hooks = []
+
+
+def add_hook(hook):
+    """Report every span and count to ``hook(name, value)`` from now on, from any thread."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Stop reporting to hook."""
+    _hooks.remove(hook)
+
+
+def _report(name, value):
+    for hook in list(_hooks):
+        hook(name, value)
+
+
+class _Span(object):
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        _report(self.name, (_clock() - self.started) * 1000.0)
+
+
+class _NoSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Return a context manager reporting the milliseconds spent in it as ``<name>_ms``, if anything listens.
+
+    :rtype: context manager
+    """
+    return _Span(name + "_ms") if _hooks else _NO_SPAN
+
+
+def count(name, value):
+    """Report value (e.g. a number of rows or bytes) as name, if anything listens."""
+    if _hooks:
+        _report(name, value)
+
+
+class Timings(object):
+    """A hook summing every span and count reported while it is entered, in the order they are first reported.
+
+    A Timings not enabled is never added as a hook, so that a check records its timings only when asked to.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, name, value):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def __enter__(self):
+        if self.enabled:
+            add_hook(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            remove_hook(self)
+
+    def perfdata(self):
+        """Return the values as Nagios performance data, e.g. ``fetch_ms=12.345 parse_ms=1.234 rows=120``.
+
+        :rtype: :py:class:`str`
+        """
+        return " ".join("{0}={1}".format(name, "{0:.3f}".format(value) if isinstance(value, float) else value)
+                        for name, value in self.values.items())
+
+
+class Report(object):
+    """Time a whole check as ``check_ms`` and append its performance data to the first line it prints.
+
+    What the check prints to stdout while a Report is entered is held back, then printed on exit with
+    `` | <perfdata>`` after its first line, as the Nagios plugin output format expects. A Report not enabled neither
+    times nor holds back anything.
+    """
+
+    def __init__(self, enabled=True):
+        self.timings = Timings(enabled)
+        self._span = _NO_SPAN
+        self._stdout = None
+
+    def __enter__(self):
+        self.timings.__enter__()
+        if self.timings.enabled:
+            self._stdout, sys.stdout = sys.stdout, StringIO()
+        self._span = span("check")
+        self._span.__enter__()
+        return self.timings
+
+    def __exit__(self, *exc_info):
+        self._span.__exit__(*exc_info)
+        self.timings.__exit__(*exc_info)
+        if self.timings.enabled:
+            output, sys.stdout = sys.stdout.getvalue(), self._stdout
+            lines = output.splitlines() or [""]
+            lines[0] = "{0} | {1}".format(lines[0], self.timings.perfdata()).lstrip()
+            sys.stdout.write("\n".join(lines) + "\n")
@@ -10,7 +10,7 @@ with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
 requirements = [
-    "haproxy-stats",
+    "requests",
     "future",
 ]
 
@@ -36,10 +36,21 @@ setup(
             "check-haproxy-stats-5xx = check_haproxy_stats.check_haproxy_stats_5xx:main",
             "metrics-haproxy-stats-5xx = check_haproxy_stats.metrics_haproxy_stats_5xx:main",
             "check-haproxy-stats-up = check_haproxy_stats.check_haproxy_stats_up:main",
+            "check-haproxy-stats-latency = check_haproxy_stats.check_haproxy_stats_latency:main",
+            "check-haproxy-stats-saturation = check_haproxy_stats.check_haproxy_stats_saturation:main",
+            "check-haproxy-stats-batch = check_haproxy_stats.check_haproxy_stats_batch:main",
+            "check-haproxy-statsd = check_haproxy_stats.check_haproxy_statsd:main",
+            "prometheus-haproxy-stats = check_haproxy_stats.prometheus_haproxy_stats:main",
+            "record-haproxy-stats = check_haproxy_stats.stats_recording:main",
+            "haproxy-stats-history = check_haproxy_stats.counter_history:main",
+            "check-haproxy-stats = check_haproxy_stats.cli:main",
         ],
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        "yaml": ["PyYAML"],
+    },
     zip_safe=False,
     keywords='check_haproxy_stats',
     classifiers=[
@@ -115,10 +115,10 @@ class TestCheck_haproxy_stats_5xx(unittest.TestCase):
 
         _check_haproxy_rates should return OK code.
         """
-        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratio") as get_hrsp_5xx_ratio:
-            get_hrsp_5xx_ratio.return_value = 0.00
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios:
+            get_hrsp_5xx_ratios.return_value = {"check-trk": 0.00}
             r = check_haproxy_stats_5xx._check_haproxy_rates(
-                backend="check-trk",
+                backends=["check-trk"],
                 warning_ratio=0.01,
                 critical_ratio=0.02,
                 base_url_path="127.0.0.1/haproxy/stats",
@@ -133,10 +133,10 @@ class TestCheck_haproxy_stats_5xx(unittest.TestCase):
 
         _check_haproxy_rates should return WARNING.
         """
-        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratio") as get_hrsp_5xx_ratio:
-            get_hrsp_5xx_ratio.return_value = 0.015
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios:
+            get_hrsp_5xx_ratios.return_value = {"check-trk": 0.015}
             r = check_haproxy_stats_5xx._check_haproxy_rates(
-                backend="check-trk",
+                backends=["check-trk"],
                 warning_ratio=0.01,
                 critical_ratio=0.02,
                 base_url_path="127.0.0.1/haproxy/stats",
@@ -150,10 +150,10 @@ class TestCheck_haproxy_stats_5xx(unittest.TestCase):
 
         _check_haproxy_rates should return CRITICAL.
         """
-        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratio") as get_hrsp_5xx_ratio:
-            get_hrsp_5xx_ratio.return_value = 0.021
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios:
+            get_hrsp_5xx_ratios.return_value = {"check-trk": 0.021}
             r = check_haproxy_stats_5xx._check_haproxy_rates(
-                backend="check-trk",
+                backends=["check-trk"],
                 warning_ratio=0.01,
                 critical_ratio=0.02,
                 base_url_path="127.0.0.1/haproxy/stats",
@@ -164,10 +164,10 @@ class TestCheck_haproxy_stats_5xx(unittest.TestCase):
 
     def test_check_haproxy_rates_test_unknown(self):
         """Test we ran into an unknown issue (ValueError), _check_haproxy_rates should return UNKNOWN code."""
-        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratio") as get_hrsp_5xx_ratio:
-            get_hrsp_5xx_ratio.side_effect = ValueError("check-trk backend cannot be found")
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios:
+            get_hrsp_5xx_ratios.side_effect = ValueError("check-trk backend cannot be found")
             r = check_haproxy_stats_5xx._check_haproxy_rates(
-                backend="check-trk",
+                backends=["check-trk"],
                 warning_ratio=0.01,
                 critical_ratio=0.02,
                 base_url_path="127.0.0.1/haproxy/stats",
@@ -176,16 +176,277 @@ class TestCheck_haproxy_stats_5xx(unittest.TestCase):
                 interval=1)
             self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
 
+    def test_check_haproxy_rates_test_state_file(self):
+        """Test --state-file uses the stateful ratio and reports the observed interval."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios_stateful") as get_hrsp_5xx_ratios_stateful, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._handle_warning") as handle_warning:
+            get_hrsp_5xx_ratios_stateful.return_value = ({"check-trk": 0.015}, 58.7)
+            check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["check-trk"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username="someone",
+                password="someone",
+                interval=60,
+                state_file="/tmp/state.json")
+            get_hrsp_5xx_ratios_stateful.assert_called_with(
+                ["check-trk"], "127.0.0.1/haproxy/stats", "someone", "someone", 60, "/tmp/state.json", 300, None, 5,
+                None)
+            handle_warning.assert_called_with("check-trk", 0.015, 0.01, 0.02, 59)
+
+    def test_check_haproxy_rates_history_file(self):
+        """Test --history-file computes the ratio from the ring file and reports the observed interval."""
+        with patch("check_haproxy_stats.counter_history.get_hrsp_5xx_ratios_history") as get_hrsp_5xx_ratios_history, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._handle_critical") as handle_critical:
+            get_hrsp_5xx_ratios_history.return_value = ({"check-trk": 0.03}, 60.2)
+            check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["check-trk"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username=None,
+                password=None,
+                interval=60,
+                history_file="/tmp/history.ring",
+                history_slots=512)
+            get_hrsp_5xx_ratios_history.assert_called_with(
+                ["check-trk"], "127.0.0.1/haproxy/stats", None, None, 60, "/tmp/history.ring", None, 5, None, 512,
+                1440, 300)
+            handle_critical.assert_called_with("check-trk", 0.03, 0.01, 0.02, 60)
+
+    def test_check_haproxy_rates_many_backends(self):
+        """Test every backend is reported and the most severe status is returned."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._get_message") as get_message:
+            get_hrsp_5xx_ratios.return_value = {"a": 0.0, "b": 0.021, "c": 0.015}
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=None,
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username="someone",
+                password="someone",
+                interval=60)
+            self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["CRITICAL"])
+            self.assertEqual(get_hrsp_5xx_ratios.call_count, 1)
+            self.assertEqual([(c[0][0], c[0][1]) for c in get_message.call_args_list],
+                             [("OK", "a"), ("CRITICAL", "b"), ("WARNING", "c")])
+
+    def test_check_haproxy_rates_outliers(self):
+        """Test outlier servers are WARNING, or CRITICAL above the critical ratio, on top of their backend."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios_and_outliers") as get_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx.print", create=True) as mock_print:
+            get_ratios.return_value = ({"a": 0.001, "b": 0.004}, {"b": [("b/srv-3", 400, 0.015, 0.001, 8.9)]})
+            kwargs = dict(backends=None, warning_ratio=0.01, critical_ratio=0.02, base_url_path="lb-1/haproxy/stats",
+                          username=None, password=None, interval=60, outliers=(100, 3.0))
+            self.assertEqual(check_haproxy_stats_5xx._check_haproxy_rates(**kwargs),
+                             check_haproxy_stats_5xx.RETURN_CODES["WARNING"])
+            get_ratios.assert_called_with(None, "lb-1/haproxy/stats", None, None, 60, None, 5, None, 100, 3.0)
+            self.assertEqual(mock_print.call_args[0][0],
+                             "b server b/srv-3 has HTTP 5xx ratio of 0.0150 over 400 requests in the past 60 seconds, "
+                             "8.9 standard deviations above its peers (0.0010)")
+
+            get_ratios.return_value = ({"a": 0.001, "b": 0.004}, {"b": [("b/srv-3", 400, 0.025, 0.001, 15.1)]})
+            self.assertEqual(check_haproxy_stats_5xx._check_haproxy_rates(**kwargs),
+                             check_haproxy_stats_5xx.RETURN_CODES["CRITICAL"])
+
+            kwargs["state_file"] = "/tmp/state.json"
+            self.assertEqual(check_haproxy_stats_5xx._check_haproxy_rates(**kwargs),
+                             check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
+
+    def test_check_haproxy_rates_early_exit(self):
+        """Test the ratios sampled adaptively are reported over the seconds they were sampled."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios_adaptive") as get_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx.print", create=True) as mock_print:
+            get_ratios.return_value = ({"a": 0.5}, 5.2)
+            kwargs = dict(backends=["a"], warning_ratio=0.01, critical_ratio=0.02, base_url_path="lb-1/haproxy/stats",
+                          username=None, password=None, interval=60, early_exit=(5, 3.0))
+            self.assertEqual(check_haproxy_stats_5xx._check_haproxy_rates(**kwargs),
+                             check_haproxy_stats_5xx.RETURN_CODES["CRITICAL"])
+            get_ratios.assert_called_with(
+                ["a"], "lb-1/haproxy/stats", None, None, 60, 0.01, 0.02, 5, 3.0, None, 5, None)
+            self.assertIn("in the past 5 seconds", mock_print.call_args[0][0])
+
+            kwargs["daemon_socket"] = "/run/check-haproxy-statsd.sock"
+            self.assertEqual(check_haproxy_stats_5xx._check_haproxy_rates(**kwargs),
+                             check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
+
+    def test_check_haproxy_rates_missing_backend(self):
+        """Test a requested backend that is not found is UNKNOWN while others are still checked."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._handle_ok") as handle_ok:
+            get_hrsp_5xx_ratios.return_value = {"a": 0.0}
+            handle_ok.return_value = check_haproxy_stats_5xx.RETURN_CODES["OK"]
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["a", "missing"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username="someone",
+                password="someone",
+                interval=60)
+            self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
+            handle_ok.assert_called_with("a", 0.0, 0.01, 0.02, 60)
+
+    def test_check_haproxy_rates_fleet(self):
+        """Test every node and the fleet are checked, a node that failed being UNKNOWN without failing the check."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios_for_endpoints") as get_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._get_message") as get_message, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._handle_unknown") as handle_unknown:
+            get_ratios.return_value = (
+                {"lb-1": ({"a": 0.0}, None), "lb-2": ({"a": 0.015}, None), "lb-3": (None, IOError("refused"))},
+                {"a": 0.0075})
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["a"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path=["lb-1", "lb-2", "lb-3"],
+                username="someone",
+                password="someone",
+                interval=60,
+                timeout=3)
+            get_ratios.assert_called_with(["a"], ["lb-1", "lb-2", "lb-3"], "someone", "someone", 60, 3, None)
+            self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["WARNING"])
+            self.assertEqual([(c[0][0], c[0][1]) for c in get_message.call_args_list],
+                             [("OK", "a on lb-1"), ("WARNING", "a on lb-2"), ("OK", "a across 2 nodes")])
+            handle_unknown.assert_called_once_with("refused on node lb-3")
+
+    def test_check_haproxy_rates_fleet_missing_backend(self):
+        """Test a backend missing from a node does not hide another backend of the node being critical."""
+        with patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios_for_endpoints") as get_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._get_message") as get_message, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._handle_unknown") as handle_unknown:
+            get_ratios.return_value = (
+                {"lb-1": ({"a": 0.5}, None), "lb-2": ({"a": 0.0, "b": 0.0}, None)}, {"a": 0.25, "b": 0.0})
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["a", "b"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path=["lb-1", "lb-2"],
+                username=None,
+                password=None,
+                interval=60)
+            self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["CRITICAL"])
+            self.assertEqual([(c[0][0], c[0][1]) for c in get_message.call_args_list],
+                             [("CRITICAL", "a on lb-1"), ("OK", "a on lb-2"), ("OK", "b on lb-2"),
+                              ("CRITICAL", "a across 2 nodes"), ("OK", "b across 2 nodes")])
+            handle_unknown.assert_called_once_with("Did not find backends starting with b on lb-1")
+
+    def test_check_haproxy_rates_daemon(self):
+        """Test the ratios of the daemon are used without fetching the stats."""
+        with patch("check_haproxy_stats.haproxy_util.query_daemon") as query_daemon, \
+                patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx._handle_critical") as handle_critical:
+            query_daemon.return_value = {"ratios": {"check-trk": 0.5}, "interval": 60.2}
+            check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["check-trk"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username="someone",
+                password="someone",
+                interval=60,
+                daemon_socket="/var/run/check-haproxy-statsd.sock")
+            query_daemon.assert_called_with(
+                "/var/run/check-haproxy-statsd.sock", {"check": "5xx", "backends": ["check-trk"], "interval": 60})
+            handle_critical.assert_called_with("check-trk", 0.5, 0.01, 0.02, 60)
+            self.assertFalse(get_hrsp_5xx_ratios.called)
+
+    def test_check_haproxy_rates_daemon_down(self):
+        """Test the stats are fetched directly when the daemon cannot answer."""
+        with patch("check_haproxy_stats.haproxy_util.query_daemon") as query_daemon, \
+                patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratios") as get_hrsp_5xx_ratios:
+            query_daemon.side_effect = IOError("No such file or directory")
+            get_hrsp_5xx_ratios.return_value = {"check-trk": 0.0}
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["check-trk"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username="someone",
+                password="someone",
+                interval=60,
+                daemon_socket="/var/run/check-haproxy-statsd.sock")
+            self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["OK"])
+            self.assertTrue(get_hrsp_5xx_ratios.called)
+
+    def test_check_haproxy_rates_windows(self):
+        """Test every window is checked with its own thresholds from a single query of the daemon."""
+        with patch("check_haproxy_stats.haproxy_util.query_daemon") as query_daemon, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx.print", create=True) as mock_print:
+            query_daemon.return_value = {"windows": [
+                {"ratios": {"check-trk": 0.08}, "interval": 60.1},
+                {"ratios": {"check-trk": 0.005}, "interval": 900},
+                {"error": "Less than 3600 seconds of stats collected"}]}
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["check-trk"],
+                warning_ratio=0.01,
+                critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats",
+                username=None,
+                password=None,
+                interval=60,
+                daemon_socket="/var/run/check-haproxy-statsd.sock",
+                windows=[(60, 0.05, 0.1), (900, 0.01, 0.02), (3600, 0.01, 0.02)])
+            query_daemon.assert_called_once_with("/var/run/check-haproxy-statsd.sock", {
+                "check": "5xx", "backends": ["check-trk"], "windows": [60, 900, 3600]})
+            self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
+            messages = [c[0][0] for c in mock_print.call_args_list]
+            self.assertIn("ratio of 0.0800 in the past 60 seconds.Thresholds: warning: 0.05", messages[0])
+            self.assertIn("ratio of 0.0050 in the past 900 seconds.Thresholds: warning: 0.01", messages[1])
+            self.assertIn("Less than 3600 seconds", messages[2])
+
+    def test_check_haproxy_rates_windows_without_daemon(self):
+        """Test windows are refused without the daemon keeping the samples."""
+        with patch("check_haproxy_stats.check_haproxy_stats_5xx.print", create=True):
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=None, warning_ratio=0.01, critical_ratio=0.02, base_url_path="127.0.0.1/haproxy/stats",
+                username=None, password=None, interval=60, windows=[(60, 0.05, 0.1)])
+        self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
+
+    def test_check_haproxy_rates_windows_history_file(self):
+        """Test windows are read from --history-file without the daemon."""
+        with patch("check_haproxy_stats.counter_history.HistoryFile") as history_file, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx.print", create=True) as mock_print:
+            history = history_file.return_value.__enter__.return_value
+            history.get_hrsp_5xx_ratios.side_effect = [({"check-trk": 0.001}, 60), ValueError("Less than 900 seconds")]
+            r = check_haproxy_stats_5xx._check_haproxy_rates(
+                backends=["check-trk"], warning_ratio=0.01, critical_ratio=0.02,
+                base_url_path="127.0.0.1/haproxy/stats", username=None, password=None, interval=60,
+                windows=[(60, 0.05, 0.1), (900, 0.01, 0.02)], history_file="/tmp/history.ring")
+        history_file.assert_called_once_with("/tmp/history.ring")
+        self.assertEqual(r, check_haproxy_stats_5xx.RETURN_CODES["UNKNOWN"])
+        messages = [c[0][0] for c in mock_print.call_args_list]
+        self.assertIn("ratio of 0.0010 in the past 60 seconds", messages[0])
+        self.assertIn("Less than 900 seconds", messages[1])
+
+    def test_parser_windows(self):
+        """Test --window is parsed into (seconds, warning ratio, critical ratio)."""
+        parser = check_haproxy_stats_5xx._get_parser()
+        args = parser.parse_args(["--backend", "all", "--window", "60:0.05:0.1", "--window", "900:0.01:0.02"])
+        self.assertEqual(args.windows, [(60, 0.05, 0.1), (900, 0.01, 0.02)])
+        with patch("sys.stderr"):
+            self.assertRaises(SystemExit, parser.parse_args, ["--backend", "all", "--window", "60:0.05"])
+
+    def test_main_all_backends(self):
+        """Test --backend all checks every backend."""
+        simulated_check = ["check-haproxys-stats-5xx", "--backend", "all"]
+        check_haproxy_stats = "check_haproxy_stats.check_haproxy_stats_5xx._check_haproxy_rates"
+        with patch.object(sys, "argv", simulated_check), patch(check_haproxy_stats) as check_haproxy_rates:
+            check_haproxy_stats_5xx.main()
+            self.assertIsNone(check_haproxy_rates.call_args[1]["backends"])
+
     def test_parser(self):
         """Test typical use of _get_parser()."""
         parser = check_haproxy_stats_5xx._get_parser()
         args = parser.parse_args(
             ["--backend", "check-trk", "--warning-ratio", "0.01", "--critical-ratio", "0.02", "--base-url-path",
              "some-url-path", "--username", "someone", "--password", "password", "--interval", "120"])
-        self.assertEqual(args.backend, "check-trk")
+        self.assertEqual(args.backends, ["check-trk"])
         self.assertEqual(args.warning_ratio, 0.01)
         self.assertEqual(args.critical_ratio, 0.02)
-        self.assertEqual(args.base_url_path, "some-url-path")
+        self.assertEqual(args.base_url_paths, ["some-url-path"])
         self.assertEqual(args.username, "someone")
         self.assertEqual(args.password, "password")
         self.assertEqual(args.interval, 120)
@@ -200,10 +461,22 @@ class TestCheck_haproxy_stats_5xx(unittest.TestCase):
 
             check_haproxy_stats_5xx.main()
             check_haproxy_rates.assert_called_with(
-                backend="check-trk",
+                backends=["check-trk"],
                 warning_ratio=0.01,
                 critical_ratio=0.02,
-                base_url_path="some-url-path",
+                base_url_path=["some-url-path"],
                 username="someone",
                 password="password",
-                interval=120)
+                interval=120,
+                state_file=None,
+                max_state_age=300,
+                stats_socket=None,
+                timeout=5,
+                daemon_socket=None,
+                windows=None,
+                cache=None,
+                outliers=None,
+                early_exit=None,
+                history_file=None,
+                history_slots=128,
+                history_capacity=1440)
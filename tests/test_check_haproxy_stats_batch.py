@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `check_haproxy_stats_batch` module."""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from check_haproxy_stats import check_haproxy_stats_batch
+from mock import patch
+
+HEADER = "# pxname,svname,qcur,scur,slim,status,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,rtime,\n"
+
+STATS_CSV_INITIAL = HEADER + (
+    "api,srv-1,0,1,10,UP,,,,,,,10,\n"
+    "api,srv-2,0,1,10,DOWN,,,,,,,10,\n"
+    "api,BACKEND,0,2,20,UP,0,100,0,0,0,0,10,\n"
+    "static,srv-1,0,1,10,UP,,,,,,,2,\n"
+    "static,BACKEND,0,1,10,UP,0,100,0,0,0,0,2,\n")
+
+STATS_CSV_FINAL = HEADER + (
+    "api,srv-1,0,1,10,UP,,,,,,,10,\n"
+    "api,srv-2,0,1,10,DOWN,,,,,,,10,\n"
+    "api,BACKEND,0,2,20,UP,0,190,0,0,10,0,10,\n"
+    "static,srv-1,0,1,10,UP,,,,,,,2,\n"
+    "static,BACKEND,0,1,10,UP,0,200,0,0,0,0,2,\n")
+
+CHECKS = [
+    {"type": "5xx", "backends": ["api", "static"], "critical_ratio": 0.05},
+    {"type": "up", "backends": "api", "warning_percent": 0.5, "critical_percent": 0.25},
+    {"name": "latency", "type": "latency", "backends": "all", "warning_ms": 5},
+    {"type": "saturation", "backends": ["missing"]},
+]
+
+
+class TestCheck_haproxy_stats_batch(unittest.TestCase):
+    """Test cases for check_haproxy_stats_batch."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_load_checks(self):
+        """Test checks are read from JSON or YAML, with the defaults of their type filled in."""
+        checks = check_haproxy_stats_batch.load_checks(self._write("checks.json", json.dumps({"checks": CHECKS})))
+        self.assertEqual(checks[0], {"name": "5xx api,static", "type": "5xx", "backends": ["api", "static"],
+                                     "warning_ratio": 0.01, "critical_ratio": 0.05})
+        self.assertEqual(checks[1]["backends"], ["api"])
+        self.assertIsNone(checks[2]["backends"])
+        self.assertEqual(checks[2]["name"], "latency")
+
+        yaml_checks = check_haproxy_stats_batch.load_checks(self._write(
+            "checks.yaml", "- {type: 5xx, backends: [api, static], critical_ratio: 0.05}\n"))
+        self.assertEqual(yaml_checks, checks[:1])
+
+    def test_load_checks_invalid(self):
+        """Test an unknown type or option is refused before anything is fetched."""
+        for config in ({"checks": [{"type": "5xx", "critical": 0.1}]}, [{"type": "down"}], {"check": []}):
+            self.assertRaises(ValueError, check_haproxy_stats_batch.load_checks,
+                              self._write("checks.json", json.dumps(config)))
+
+    def test_run_checks(self):
+        """Test every check is evaluated against the same two fetches, with one result line per check."""
+        checks = check_haproxy_stats_batch.load_checks(self._write("checks.json", json.dumps(CHECKS)))
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_http",
+                   side_effect=[STATS_CSV_INITIAL, STATS_CSV_FINAL]) as fetch_stats_http, \
+                patch("time.sleep") as time_sleep, \
+                patch("check_haproxy_stats.check_haproxy_stats_batch.print", create=True) as mock_print, \
+                patch("check_haproxy_stats.check_haproxy_stats_5xx.print", create=True), \
+                patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True), \
+                patch("check_haproxy_stats.check_haproxy_stats_latency.print", create=True):
+            rc = check_haproxy_stats_batch.run_checks(checks, "127.0.0.1/haproxy/stats", None, None, 60)
+        self.assertEqual(rc, check_haproxy_stats_batch.RETURN_CODES["CRITICAL"])
+        self.assertEqual(fetch_stats_http.call_count, 2)
+        time_sleep.assert_called_once_with(60)
+        self.assertEqual([call[0][0] for call in mock_print.call_args_list], [
+            "CRITICAL: 5xx api,static", "OK: up api", "WARNING: latency", "CRITICAL: saturation missing"])
+
+    def test_main(self):
+        """Test the checks of --config are run with a single fetch when none needs an interval."""
+        argv = ["check-haproxy-stats-batch", "--config", self._write("checks.json", json.dumps(CHECKS[1:2]))]
+        with patch.object(sys, "argv", argv), \
+                patch("check_haproxy_stats.haproxy_util.fetch_stats_http", return_value=STATS_CSV_FINAL) as fetch, \
+                patch("time.sleep") as time_sleep, \
+                patch("check_haproxy_stats.check_haproxy_stats_batch.print", create=True) as mock_print, \
+                patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True):
+            self.assertEqual(check_haproxy_stats_batch.main(), check_haproxy_stats_batch.RETURN_CODES["OK"])
+        fetch.assert_called_once_with("127.0.0.1/haproxy/stats", None, None, 5, fetch.call_args[0][4])
+        self.assertFalse(time_sleep.called)
+        mock_print.assert_called_once_with("OK: up api")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `check_haproxy_stats_latency` module."""
+import sys
+import unittest
+
+from check_haproxy_stats import check_haproxy_stats_latency
+from mock import patch
+
+STATS_CSV = (
+    "# pxname,svname,qtime,ctime,rtime,ttime,\n"
+    "http-in,FRONTEND,,,,,\n"
+    "api,srv-1,0,1,40,45,\n"
+    "api,srv-2,3,2,900,950,\n"
+    "api,BACKEND,1,1,300,320,\n"
+    "api-canary,srv-1,0,1,1500,1600,\n"
+    "api-canary,BACKEND,0,1,1500,1600,\n"
+    "static,srv-1,0,0,2,3,\n"
+    "static,BACKEND,0,0,2,3,\n"
+    "\n")
+
+
+class TestCheck_haproxy_stats_latency(unittest.TestCase):
+    """Test cases for check_haproxy_stats_latency."""
+
+    def _check(self, backends, **kwargs):
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=STATS_CSV), \
+                patch("check_haproxy_stats.check_haproxy_stats_latency.print", create=True) as mock_print:
+            rc = check_haproxy_stats_latency._check_latencies(
+                backends=backends, warning_ms=500, critical_ms=1000, base_url_path="127.0.0.1/haproxy/stats",
+                username=None, password=None, **dict({"metric": "rtime"}, **kwargs))
+        return rc, [call[0][0] for call in mock_print.call_args_list]
+
+    def test_check_latencies(self):
+        """Test every backend is checked, a prefix getting the time of its slowest backend."""
+        rc, messages = self._check(["static", "=api", "api"])
+        self.assertEqual(rc, check_haproxy_stats_latency.RETURN_CODES["CRITICAL"])
+        self.assertEqual([m.split(" ms")[0] for m in messages], [
+            "static has average response time of 2", "=api has average response time of 300",
+            "api has average response time of 1500"])
+
+    def test_check_latencies_metric(self):
+        """Test the time checked is chosen by metric."""
+        rc, messages = self._check(["=api"], metric="ttime")
+        self.assertEqual(rc, check_haproxy_stats_latency.RETURN_CODES["OK"])
+        self.assertTrue(messages[0].startswith("=api has average total time of 320 ms"))
+
+    def test_check_latencies_all_and_slowest(self):
+        """Test all backends are checked separately and the slowest servers reported without affecting the status."""
+        rc, messages = self._check(None, slowest=2)
+        self.assertEqual(rc, check_haproxy_stats_latency.RETURN_CODES["CRITICAL"])
+        self.assertEqual([m.split(" has")[0] for m in messages], [
+            "api", "api-canary", "static", "Server api-canary/srv-1", "Server api/srv-2"])
+
+    def test_check_latencies_unknown(self):
+        """Test a backend missing from the stats is UNKNOWN."""
+        rc, messages = self._check(["static", "missing"])
+        self.assertEqual(rc, check_haproxy_stats_latency.RETURN_CODES["UNKNOWN"])
+        self.assertIn("missing", messages[-1])
+
+    def test_main(self):
+        """Test the options are passed to the check."""
+        argv = ["check-haproxy-stats-latency", "--backend", "api", "--metric", "ctime", "--warning-ms", "10",
+                "--critical-ms", "20", "--slowest", "3"]
+        with patch.object(sys, "argv", argv), \
+                patch("check_haproxy_stats.check_haproxy_stats_latency._check_latencies", return_value=0) as check:
+            self.assertEqual(check_haproxy_stats_latency.main(), 0)
+            check.assert_called_once_with(
+                backends=["api"], metric="ctime", warning_ms=10, critical_ms=20,
+                base_url_path="127.0.0.1/haproxy/stats", username=None, password=None, slowest=3,
+                stats_socket=None, timeout=5, cache=None)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `check_haproxy_stats_saturation` module."""
+import sys
+import unittest
+
+from check_haproxy_stats import check_haproxy_stats_saturation
+from mock import patch
+
+STATS_CSV = (
+    "# pxname,svname,qcur,qmax,scur,smax,slim,\n"
+    "http-in,FRONTEND,,,50,90,2000,\n"
+    "api,srv-1,0,0,10,12,20,\n"
+    "api,srv-2,15,20,20,20,20,\n"
+    "api,BACKEND,5,8,30,32,100,\n"
+    "api-canary,srv-1,0,0,1,1,,\n"
+    "api-canary,BACKEND,0,0,1,1,10,\n"
+    "static,srv-1,0,0,1,1,100,\n"
+    "static,BACKEND,0,0,90,90,100,\n"
+    "\n")
+
+RETURN_CODES = check_haproxy_stats_saturation.SensuCheckStatus.RETURN_CODES
+
+
+class TestCheck_haproxy_stats_saturation(unittest.TestCase):
+    """Test cases for check_haproxy_stats_saturation."""
+
+    def test_get_saturation(self):
+        """Test the BACKEND rows selected are summed per backend and every server of them is kept."""
+        found_backends, found_servers = check_haproxy_stats_saturation.get_saturation(STATS_CSV, ["api-*"])
+        self.assertEqual(found_backends, {"api-*": (1, 10, 0)})
+        self.assertEqual(found_servers, {("api-canary", "srv-1"): (1, 0, 0)})
+
+        found_backends, found_servers = check_haproxy_stats_saturation.get_saturation(STATS_CSV)
+        self.assertEqual(sorted(found_backends), ["api", "api-canary", "static"])
+        self.assertEqual(found_servers["api", "srv-2"], (20, 20, 15))
+
+        found_backends, _ = check_haproxy_stats_saturation.get_saturation(STATS_CSV, ["~(api|static)$"])
+        self.assertEqual(found_backends, {"~(api|static)$": (120, 200, 5)})
+
+    def _check(self, **kwargs):
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=STATS_CSV), \
+                patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True) as mock_print:
+            rc = check_haproxy_stats_saturation.check_haproxy_saturation("127.0.0.1/haproxy/stats", **kwargs)
+        return rc, [call[0][0] for call in mock_print.call_args_list]
+
+    def test_check_saturation(self):
+        """Test sessions and queues are checked against the session limit of backends and servers."""
+        rc, messages = self._check()
+        self.assertEqual(rc, RETURN_CODES["CRITICAL"])
+        self.assertEqual(messages, [
+            "WARNING: Backend static has a warning session usage (90% of 100 sessions)",
+            "CRITICAL: Server api/srv-2 has a critical session usage (100% of 20 sessions)",
+            "WARNING: Server api/srv-2 has a warning queue (15 requests for 20 sessions)",
+        ])
+
+        rc, messages = self._check(backends=["api"], servers=False, print_ok=True)
+        self.assertEqual(rc, RETURN_CODES["OK"])
+        self.assertEqual(messages, [
+            "OK: Backend api has an ok session usage (30% of 100 sessions) and queue (5 requests)"])
+
+    def test_check_saturation_missing(self):
+        """Test a requested backend that is not found is CRITICAL, and a failed fetch UNKNOWN."""
+        rc, messages = self._check(backends=["missing"])
+        self.assertEqual(rc, RETURN_CODES["CRITICAL"])
+        self.assertIn("missing", messages[0])
+
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", side_effect=IOError("refused")), \
+                patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True):
+            self.assertEqual(check_haproxy_stats_saturation.check_haproxy_saturation("127.0.0.1/haproxy/stats"),
+                             RETURN_CODES["UNKNOWN"])
+
+    def test_main(self):
+        """Test the options are passed to the check."""
+        argv = ["check-haproxy-stats-saturation", "--backend", "api", "--critical-queue", "2", "--no-servers"]
+        with patch.object(sys, "argv", argv), patch(
+                "check_haproxy_stats.check_haproxy_stats_saturation.check_haproxy_saturation", return_value=0) as check:
+            self.assertEqual(check_haproxy_stats_saturation.main(), 0)
+            check.assert_called_once_with(
+                base_url_path="127.0.0.1/haproxy/stats", username=None, password=None, backends=["api"],
+                warning_sessions=0.8, critical_sessions=0.95, warning_queue=0.5, critical_queue=2.0, servers=False,
+                print_ok=False, stats_socket=None, timeout=5, cache=None)
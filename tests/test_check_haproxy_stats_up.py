@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 """Tests for `check_haproxy_stats_5xx` module."""
 import sys
+import time
 import unittest
 
 from check_haproxy_stats import check_haproxy_stats_up
@@ -210,3 +211,136 @@ class TestCheck_haproxy_stats_up(unittest.TestCase):
                 backends=['backend-1', 'no-such-backend', ]
                 )
             self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["CRITICAL"])
+
+    def test_get_haproxy_services_up_count_for_backends(self):
+        """Test up counts only consider checked servers of the requested backends."""
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv") as fetch_stats_csv:
+            fetch_stats_csv.return_value = (
+                "# pxname,svname,status,\n"
+                "http-in,FRONTEND,OPEN,\n"
+                "backend-1,srv-1,UP,\n"
+                "backend-1,srv-2,DOWN,\n"
+                "backend-1,srv-3,no check,\n"
+                "backend-1,srv-4,MAINT,\n"
+                "backend-1,BACKEND,UP,\n"
+                "backend-2,srv-1,UP 1/2,\n"
+                "backend-2,BACKEND,UP,\n")
+            r = check_haproxy_stats_up.get_haproxy_services_up_count_for_backends(
+                "127.0.0.1/haproxy/stats", backends=["backend-1"], stats_socket="/run/haproxy.sock")
+            fetch_stats_csv.assert_called_with("127.0.0.1/haproxy/stats", None, None, "/run/haproxy.sock", 5, None)
+            self.assertEqual(r, {"backend-1": {"count": 2, "up_count": 1}})
+
+            r = check_haproxy_stats_up.get_haproxy_services_up_count_for_backends("127.0.0.1/haproxy/stats")
+            self.assertEqual(r, {"backend-1": {"count": 2, "up_count": 1}, "backend-2": {"count": 1, "up_count": 1}})
+
+            r = check_haproxy_stats_up.get_haproxy_services_up_count_for_backends(
+                "127.0.0.1/haproxy/stats", backends=["backend", "backend-*"])
+            self.assertEqual(r, {"backend-*": {"count": 3, "up_count": 2}})
+
+    def test_check_haproxy_up_rates_fetch_error(self):
+        """Test a failure to fetch the stats is UNKNOWN rather than an empty OK."""
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv") as fetch_stats_csv:
+            fetch_stats_csv.side_effect = IOError("Connection refused")
+            r = check_haproxy_stats_up.check_haproxy_up_rates(base_url_path="127.0.0.1/haproxy/stats")
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["UNKNOWN"])
+
+    def test_check_haproxy_up_rates_fleet(self):
+        """Test every node and the fleet as a whole are checked, a failing node being UNKNOWN on its own."""
+        def get_backend_counts(endpoint, *args, **kwargs):
+            if endpoint == "lb-3/haproxy/stats":
+                raise IOError("Connection refused")
+            up_count = {"lb-1/haproxy/stats": 4, "lb-2/haproxy/stats": 2}[endpoint]
+            return {"backend-1": {"count": 4, "up_count": up_count}}
+
+        with patch("check_haproxy_stats.check_haproxy_stats_up.get_haproxy_services_up_count_for_backends") as \
+                get_backend_counts_mock, \
+                patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True) as print_mock:
+            get_backend_counts_mock.side_effect = get_backend_counts
+            r = check_haproxy_stats_up.check_haproxy_up_rates(
+                base_url_path=["lb-1/haproxy/stats", "lb-2/haproxy/stats", "lb-3/haproxy/stats"],
+                warning_percent=0.90,
+                critical_percent=0.60,
+                print_ok=True)
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["CRITICAL"])
+            self.assertEqual(sorted(c[0][0] for c in print_mock.call_args_list), [
+                "CRITICAL: Backend backend-1 on lb-2/haproxy/stats has a critical percentage of services up (50% / 4)",
+                "OK: Backend backend-1 on lb-1/haproxy/stats has a ok percentage of services up (100% / 4)",
+                "UNKNOWN: Node lb-3/haproxy/stats could not be checked: Connection refused",
+                "WARNING: Backend backend-1 across 2 nodes has a warning percentage of services up (75% / 8)",
+            ])
+
+    def test_check_haproxy_up_rates_fleet_all_nodes_fail(self):
+        """Test the check is UNKNOWN when no node answered."""
+        with patch("check_haproxy_stats.check_haproxy_stats_up.get_haproxy_services_up_count_for_backends") as \
+                get_backend_counts:
+            get_backend_counts.side_effect = IOError("Connection refused")
+            r = check_haproxy_stats_up.check_haproxy_up_rates(
+                base_url_path=["lb-1/haproxy/stats", "lb-2/haproxy/stats"])
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["UNKNOWN"])
+
+    def test_check_haproxy_up_rates_fleet_with_stats_socket(self):
+        """Test several nodes with a stats socket are UNKNOWN rather than only the first node being checked."""
+        with patch("check_haproxy_stats.check_haproxy_stats_up.get_haproxy_services_up_count_for_backends") as \
+                get_backend_counts:
+            r = check_haproxy_stats_up.check_haproxy_up_rates(
+                base_url_path=["lb-1/haproxy/stats", "lb-2/haproxy/stats"], stats_socket=["/run/haproxy.sock"])
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["UNKNOWN"])
+            get_backend_counts.assert_not_called()
+
+    def test_check_haproxy_up_rates_fleet_is_concurrent(self):
+        """Test nodes are queried concurrently and slow nodes time out."""
+        def get_backend_counts(endpoint, *args, **kwargs):
+            time.sleep(1.5 if endpoint == "slow" else 0.2)
+            return {"backend-1": {"count": 1, "up_count": 1}}
+
+        with patch("check_haproxy_stats.check_haproxy_stats_up.get_haproxy_services_up_count_for_backends") as \
+                get_backend_counts_mock, \
+                patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True) as print_mock:
+            get_backend_counts_mock.side_effect = get_backend_counts
+            start = time.time()
+            r = check_haproxy_stats_up.check_haproxy_up_rates(
+                base_url_path=["lb-{0}".format(i) for i in range(10)] + ["slow"], timeout=1)
+            self.assertLess(time.time() - start, 2.5)
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["OK"])
+            print_mock.assert_called_with("UNKNOWN: Node slow could not be checked: timed out after 1 seconds")
+
+    def test_main(self):
+        """Test typical use of main()."""
+        simulated_check = ["check-haproxy-stats-up", "--base-url-path", "lb-1/haproxy/stats", "--base-url-path",
+                           "lb-2/haproxy/stats", "--backend", "backend-1", "--timeout", "2"]
+        with patch.object(sys, "argv", simulated_check), \
+                patch("check_haproxy_stats.check_haproxy_stats_up.check_haproxy_up_rates") as check_haproxy_up_rates:
+            check_haproxy_stats_up.main()
+            check_haproxy_up_rates.assert_called_with(
+                base_url_path=["lb-1/haproxy/stats", "lb-2/haproxy/stats"],
+                username=None,
+                password=None,
+                backends=["backend-1"],
+                warning_percent=0.9,
+                critical_percent=0.6,
+                warning_down=None,
+                critical_down=None,
+                print_ok=False,
+                stats_socket=None,
+                timeout=2,
+                daemon_socket=None,
+                cache=None,
+            )
+
+    def test_check_haproxy_up_rates_daemon(self):
+        """Test the up counts of the daemon are used, falling back to fetching when it cannot answer."""
+        with patch("check_haproxy_stats.haproxy_util.query_daemon") as query_daemon, \
+                patch("check_haproxy_stats.check_haproxy_stats_up.get_haproxy_services_up_count_for_backends") as \
+                get_backend_counts:
+            query_daemon.return_value = {"backends": {"backend-1": {"count": 4, "up_count": 1}}}
+            get_backend_counts.return_value = {"backend-1": {"count": 4, "up_count": 4}}
+            r = check_haproxy_stats_up.check_haproxy_up_rates(
+                base_url_path="127.0.0.1/haproxy/stats", backends=["backend-1"], daemon_socket="/tmp/statsd.sock")
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["CRITICAL"])
+            query_daemon.assert_called_with("/tmp/statsd.sock", {"check": "up", "backends": ["backend-1"]})
+            self.assertFalse(get_backend_counts.called)
+
+            query_daemon.side_effect = ValueError("No stats collected yet")
+            r = check_haproxy_stats_up.check_haproxy_up_rates(
+                base_url_path="127.0.0.1/haproxy/stats", backends=["backend-1"], daemon_socket="/tmp/statsd.sock")
+            self.assertEqual(r, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["OK"])
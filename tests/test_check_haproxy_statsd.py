@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `check_haproxy_statsd` module."""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from check_haproxy_stats import check_haproxy_statsd, haproxy_util
+from mock import patch
+
+HEADER = "# pxname,svname,status,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,\n"
+
+
+def stats_csv(hrsp_2xx, hrsp_5xx, status="UP"):
+    """Return CSV stats of a check-trk backend with two servers."""
+    return "".join([
+        HEADER,
+        "check-trk,srv-1,{0},,,,,,,\n".format(status),
+        "check-trk,srv-2,UP,,,,,,,\n",
+        "check-trk,BACKEND,UP,0,{0},0,0,{1},0,\n".format(hrsp_2xx, hrsp_5xx),
+    ])
+
+
+class TestStatsCollector(unittest.TestCase):
+
+    """Test cases for check_haproxy_statsd.StatsCollector."""
+
+    def setUp(self):
+        self.payloads = []
+        self.collector = check_haproxy_statsd.StatsCollector(lambda: self.payloads.pop(0), poll_interval=10,
+                                                             history=60)
+
+    def _poll(self, timestamp, payload):
+        self.payloads.append(payload)
+        with patch("time.time", return_value=timestamp):
+            self.collector.poll()
+
+    def test_no_samples(self):
+        """Test checks get an error until the first poll."""
+        self.assertEqual(self.collector.handle({"check": "up"}), {"error": "No stats collected yet"})
+
+    def test_hrsp_5xx_ratios(self):
+        """Test ratios are computed against the newest sample at least interval seconds old."""
+        self._poll(1000, stats_csv(0, 0))
+        self._poll(1010, stats_csv(90, 10))
+        self._poll(1020, stats_csv(170, 30))
+        with patch("time.time", return_value=1021):
+            self.assertEqual(self.collector.handle({"check": "5xx", "backends": ["check"], "interval": 10}),
+                             {"ratios": {"check": 0.2}, "interval": 10})
+            self.assertEqual(self.collector.handle({"check": "5xx", "backends": None, "interval": 15}),
+                             {"ratios": {"check-trk": 0.15}, "interval": 20})
+            self.assertEqual(self.collector.handle({"check": "5xx", "backends": None, "interval": 30}),
+                             {"error": "Less than 30 seconds of stats collected"})
+
+    def test_history_and_reload(self):
+        """Test samples older than history are dropped, and all of them when counters go backwards."""
+        for i in range(10):
+            self._poll(1000 + 10 * i, stats_csv(i, 0))
+        ring = self.collector.store.rings["check-trk"]
+        self.assertEqual([ring.get(i)[0] for i in range(len(ring))], [1020, 1030, 1040, 1050, 1060, 1070, 1080, 1090])
+        self._poll(1100, stats_csv(0, 0))
+        self.assertEqual([ring.get(i)[0] for i in range(len(ring))], [1100])
+
+    def test_history_with_jitter(self):
+        """Test a window of history seconds is still covered when a poll came late."""
+        for timestamp in (990, 1000.5, 1010, 1020, 1030, 1040, 1050, 1060):
+            self._poll(timestamp, stats_csv(int(timestamp), 0))
+        with patch("time.time", return_value=1061):
+            self.assertEqual(self.collector.handle({"check": "5xx", "backends": None, "interval": 60}),
+                             {"ratios": {"check-trk": 0.0}, "interval": 70})
+
+    def test_fetch_time_is_poll_time(self):
+        """Test a sample is timestamped when the stats were asked for, not when the fetch returned."""
+        with patch("time.time", return_value=1000) as time_mock:
+            def fetch():
+                time_mock.return_value = 1003
+                return stats_csv(0, 0)
+
+            self.collector.fetch = fetch
+            self.collector.poll()
+        self.assertEqual(self.collector.latest[0], 1000)
+
+    def test_windows(self):
+        """Test every window is answered from the same samples, and windows not covered yet get an error."""
+        for i in range(7):
+            self._poll(1000 + 10 * i, stats_csv(90 * i, 10 * i * i))
+        with patch("time.time", return_value=1061):
+            response = self.collector.handle({"check": "5xx", "backends": None, "windows": [10, 60, 120]})
+        self.assertEqual(response, {"windows": [
+            {"ratios": {"check-trk": 0.55}, "interval": 10},
+            {"ratios": {"check-trk": 0.4}, "interval": 60},
+            {"error": "Less than 120 seconds of stats collected"},
+        ]})
+
+    def test_up_counts(self):
+        """Test up counts come from the newest sample and stale samples are refused."""
+        self._poll(1000, stats_csv(0, 0, status="DOWN"))
+        with patch("time.time", return_value=1005):
+            self.assertEqual(self.collector.handle({"check": "up", "backends": ["check-trk", "missing"]}),
+                             {"backends": {"check-trk": {"count": 2, "up_count": 1}}})
+            self.assertEqual(self.collector.handle({"check": "up", "backends": ["check-*"]}),
+                             {"backends": {"check-*": {"count": 2, "up_count": 1}}})
+        with patch("time.time", return_value=1100):
+            self.assertIn("stale", self.collector.handle({"check": "up"})["error"])
+
+
+class TestStatsServer(unittest.TestCase):
+
+    """Test cases for check_haproxy_statsd.StatsServer and haproxy_util.query_daemon."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "statsd.sock")
+        self.collector = check_haproxy_statsd.StatsCollector(lambda: stats_csv(10, 0))
+        self.collector.poll()
+        self.server = check_haproxy_statsd.StatsServer(self.path, self.collector)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_query_daemon(self):
+        """Test a check's request is answered over the socket."""
+        self.assertEqual(haproxy_util.query_daemon(self.path, {"check": "up", "backends": None}),
+                         {"backends": {"check-trk": {"count": 2, "up_count": 2}}})
+
+    def test_query_daemon_error(self):
+        """Test errors of the daemon are raised to the check."""
+        self.assertRaises(ValueError, haproxy_util.query_daemon, self.path, {"check": "latency"})
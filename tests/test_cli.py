@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `cli` module."""
+import os
+import subprocess
+import sys
+import unittest
+
+from check_haproxy_stats import cli
+from mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules a check must not import before it needs them: the HTTP client and the thread pool of fleet checks.
+HEAVY_MODULES = ("requests", "urllib3", "multiprocessing.pool")
+
+# Cumulative import time (in microseconds) of the package for a check, generous to absorb slow CI hosts.
+IMPORT_BUDGET_US = 150000
+
+
+def import_times(args):
+    """Return module -> cumulative import time (in microseconds) of a fresh interpreter running args."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, "-X", "importtime"] + args, cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    times = {}
+    for line in stderr.decode("utf-8").splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestCli(unittest.TestCase):
+
+    """Test cases for cli."""
+
+    def test_dispatch(self):
+        """Test the subcommand's main() is run with its own arguments."""
+        with patch("check_haproxy_stats.check_haproxy_stats_up.main", return_value=2) as up_main, \
+                patch.object(sys, "argv", ["check-haproxy-stats"]):
+            self.assertEqual(cli.main(["up", "--backend", "check-trk"]), 2)
+            self.assertEqual(sys.argv, ["check-haproxy-stats up", "--backend", "check-trk"])
+            up_main.assert_called_once_with()
+
+    def test_usage(self):
+        """Test the subcommands are listed, and unknown ones refused."""
+        with patch("check_haproxy_stats.cli.print", create=True) as mock_print:
+            self.assertEqual(cli.main([]), 0)
+            self.assertIn("check-haproxy-stats-5xx", mock_print.call_args[0][0])
+            self.assertEqual(cli.main(["queue"]), 2)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime needs Python 3.7")
+    def test_startup_imports(self):
+        """Test a check starts without importing other subcommands or heavy modules it does not use."""
+        for args in (["-m", "check_haproxy_stats.cli", "5xx", "--help"],
+                     ["-m", "check_haproxy_stats.cli", "up", "--help"],
+                     ["-m", "check_haproxy_stats.check_haproxy_stats_5xx", "--help"]):
+            times = import_times(args)
+            self.assertIn("check_haproxy_stats.haproxy_util", times)
+            for module in HEAVY_MODULES + ("check_haproxy_stats.prometheus_haproxy_stats", "http.server"):
+                self.assertNotIn(module, times, "{0} imported by {1}".format(module, " ".join(args)))
+            package = max(t for name, t in times.items() if name.startswith("check_haproxy_stats"))
+            self.assertLess(package, IMPORT_BUDGET_US, "{0} took {1} us to import".format(" ".join(args), package))
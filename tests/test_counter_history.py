@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `counter_history` module."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from check_haproxy_stats import counter_history, haproxy_util
+
+STATS_CSV = """# pxname,svname,status,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,
+api,server-1,UP,0,{ok},0,0,{errors},0,
+api,server-2,DOWN,0,0,0,0,0,0,
+api,BACKEND,UP,0,{ok},0,0,{errors},0,
+"""
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestHistoryFile(unittest.TestCase):
+
+    """Test cases for counter_history.HistoryFile."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "history.ring")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fixed_size(self):
+        """Test the file is laid out once and keeps its size and geometry however many samples are appended."""
+        with counter_history.HistoryFile(self.path, slots=4, capacity=3, writable=True) as history:
+            size = os.path.getsize(self.path)
+            for i in range(10):
+                history.append(100 + 10 * i, {"api": (0, i, 0, 0, 0, 0)})
+        self.assertEqual(os.path.getsize(self.path), size)
+        with counter_history.HistoryFile(self.path, slots=8, capacity=8, writable=True) as history:
+            self.assertEqual((history.slots, history.capacity), (4, 3))
+            self.assertEqual(history.windows(20), {"api": ((0, 7, 0, 0, 0, 0), (0, 9, 0, 0, 0, 0), 20, (0, 0))})
+            self.assertEqual(history.windows(21), {})
+
+    def test_windows(self):
+        """Test windows end at any past time and readers see the samples of writers."""
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            for i in range(6):
+                history.append(100 + 10 * i, {"api": (0, 99 * i, 0, 0, i, 0), "static": (0, i, 0, 0, 0, 0)},
+                               {"api": {"count": 2, "up_count": 2 - i % 2}})
+        with counter_history.HistoryFile(self.path) as history:
+            self.assertEqual(history.backends(), ["api", "static"])
+            self.assertEqual(history.windows(15, end=135)["api"], ((0, 99, 0, 0, 1, 0), (0, 297, 0, 0, 3, 0), 20,
+                                                                   (2, 1)))
+            self.assertEqual(history.get_hrsp_5xx_ratios(["api"], 50), ({"api": 0.01}, 50))
+            self.assertEqual(history.get_up_counts(["api"], end=125), {"api": {"count": 2, "up_count": 2}})
+            self.assertRaises(ValueError, history.get_hrsp_5xx_ratios, None, 60)
+            self.assertRaises(ValueError, history.append, 160, {"api": (0, 594, 0, 0, 6, 0)})
+
+    def test_counter_reset(self):
+        """Test counters going backwards drop every previous sample of the backend."""
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            history.append(100, {"api": (0, 10, 0, 0, 0, 0)})
+            history.append(110, {"api": (0, 1, 0, 0, 0, 0)})
+            self.assertEqual(history.windows(10), {})
+
+    def test_gone_backend(self):
+        """Test a backend gone from the stats is left out, and its slot taken once every other one is."""
+        with counter_history.HistoryFile(self.path, slots=2, capacity=10, writable=True) as history:
+            history.append(100, {"old": (0, 0, 0, 0, 0, 0), "api": (0, 0, 0, 0, 0, 0)})
+            history.append(160, {"api": (0, 10, 0, 0, 0, 0)})
+            self.assertEqual(sorted(history.windows(60)), ["api"])
+            history.append(220, {"api": (0, 20, 0, 0, 0, 0), "new": (0, 0, 0, 0, 0, 0)})
+            self.assertEqual(history.backends(), ["api", "new"])
+
+    def test_partly_covered_backend(self):
+        """Test a backend selecting a backend sampled at end that does not cover the window is left out."""
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            history.append(100, {"api": (0, 0, 0, 0, 0, 0), "static": (0, 0, 0, 0, 0, 0)})
+            history.append(130, {"api": (0, 0, 0, 0, 0, 0), "api-canary": (0, 0, 0, 0, 0, 0),
+                                 "static": (0, 0, 0, 0, 0, 0)})
+            history.append(160, {"api": (0, 100, 0, 0, 0, 0), "api-canary": (0, 0, 0, 0, 50, 0),
+                                 "static": (0, 10, 0, 0, 0, 0)})
+            self.assertEqual(history.get_hrsp_5xx_ratios(["api", "static"], 60), ({"static": 0}, 60))
+            self.assertEqual(history.get_hrsp_5xx_ratios(["api"], 30), ({"api": 1.0 / 3}, 30))
+
+    def test_too_few_slots(self):
+        """Test more new backends than slots left is an error, and none of the sample is appended."""
+        with counter_history.HistoryFile(self.path, slots=2, capacity=10, writable=True) as history:
+            history.append(100, {"api": (0, 0, 0, 0, 0, 0)})
+            self.assertRaises(ValueError, history.append, 160,
+                              dict((name, (0, 10, 0, 0, 0, 0)) for name in ("api", "static", "web")))
+            self.assertEqual(history.backends(), ["api"])
+            self.assertEqual(history.windows(60), {})
+
+    def test_name_too_long(self):
+        """Test a backend named longer than a slot holds is an error, and none of the sample is appended."""
+        long_name = "api-" + "x" * counter_history.NAME_SIZE
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            self.assertRaises(ValueError, history.append, 100,
+                              {"api": (0, 0, 0, 0, 0, 0), long_name: (0, 0, 0, 0, 0, 0)})
+            self.assertEqual(history.backends(), [])
+
+    def test_not_a_history_file(self):
+        """Test a file of another format is refused."""
+        with open(self.path, "wb") as f:
+            f.write(b"x" * 100)
+        self.assertRaises(ValueError, counter_history.HistoryFile, self.path)
+
+
+class TestGetHrsp5xxRatiosHistory(unittest.TestCase):
+
+    """Test cases for counter_history.get_hrsp_5xx_ratios_history."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "history.ring")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_samples_then_reads_history(self):
+        """Test the first run samples interval, and later runs read it from the samples appended."""
+        clock = FakeClock(1000)
+        with haproxy_util.use_clock(clock), \
+                patch("check_haproxy_stats.haproxy_util.fetch_stats_csv") as fetch_stats_csv:
+            fetch_stats_csv.side_effect = [STATS_CSV.format(ok=0, errors=0), STATS_CSV.format(ok=90, errors=10)]
+            self.assertEqual(counter_history.get_hrsp_5xx_ratios_history(
+                ["api"], "127.0.0.1/haproxy/stats", None, None, 60, self.path), ({"api": 0.1}, 60))
+            self.assertEqual(clock.now, 1060)
+
+            clock.sleep(60)
+            fetch_stats_csv.side_effect = [STATS_CSV.format(ok=189, errors=11)]
+            self.assertEqual(counter_history.get_hrsp_5xx_ratios_history(
+                ["api"], "127.0.0.1/haproxy/stats", None, None, 60, self.path), ({"api": 0.01}, 60))
+            self.assertEqual(clock.now, 1120)
+        with counter_history.HistoryFile(self.path) as history:
+            self.assertEqual(history.get_up_counts(), {"api": {"count": 2, "up_count": 1}})
+
+    def test_run_slightly_early_reads_history(self):
+        """Test a run a little less than interval after the previous one still reads the samples appended."""
+        clock = FakeClock(1000)
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            counter_history.append_stats(history, STATS_CSV.format(ok=0, errors=0), 1000.5)
+        clock.now = 1060
+        with haproxy_util.use_clock(clock), \
+                patch("check_haproxy_stats.haproxy_util.fetch_stats_csv") as fetch_stats_csv:
+            fetch_stats_csv.side_effect = [STATS_CSV.format(ok=95, errors=5)]
+            self.assertEqual(counter_history.get_hrsp_5xx_ratios_history(
+                ["api"], "127.0.0.1/haproxy/stats", None, None, 60, self.path), ({"api": 0.05}, 59.5))
+            self.assertEqual(clock.now, 1060)
+
+    def test_gap_between_runs_samples_interval(self):
+        """Test a run long after the previous one samples interval, rather than a window spanning the gap."""
+        clock = FakeClock(8260)
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            counter_history.append_stats(history, STATS_CSV.format(ok=0, errors=0), 1000)
+            counter_history.append_stats(history, STATS_CSV.format(ok=100, errors=0), 1060)
+        with haproxy_util.use_clock(clock), \
+                patch("check_haproxy_stats.haproxy_util.fetch_stats_csv") as fetch_stats_csv:
+            fetch_stats_csv.side_effect = [STATS_CSV.format(ok=9000, errors=0), STATS_CSV.format(ok=9080, errors=20)]
+            self.assertEqual(counter_history.get_hrsp_5xx_ratios_history(
+                ["api"], "127.0.0.1/haproxy/stats", None, None, 60, self.path), ({"api": 0.2}, 60))
+            self.assertEqual(clock.now, 8320)
+
+    def test_new_backend_of_a_group_samples_interval(self):
+        """Test a requested backend selecting a backend new to the history samples interval, not a partial ratio."""
+        clock = FakeClock(1060)
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            counter_history.append_stats(history, STATS_CSV.format(ok=0, errors=0), 1000)
+        canary = "api-canary,BACKEND,UP,0,0,0,0,{errors},0,\n"
+        with haproxy_util.use_clock(clock), \
+                patch("check_haproxy_stats.haproxy_util.fetch_stats_csv") as fetch_stats_csv:
+            fetch_stats_csv.side_effect = [STATS_CSV.format(ok=100, errors=0) + canary.format(errors=0),
+                                           STATS_CSV.format(ok=190, errors=0) + canary.format(errors=10)]
+            self.assertEqual(counter_history.get_hrsp_5xx_ratios_history(
+                ["api"], "127.0.0.1/haproxy/stats", None, None, 60, self.path), ({"api": 0.1}, 60))
+            self.assertEqual(clock.now, 1120)
+
+    def test_appends_requested_backends(self):
+        """Test only the backends requested are appended, so a file of few slots serves a check of few backends."""
+        stats_csv = STATS_CSV.format(ok=0, errors=0) + "".join(
+            "other-{0},BACKEND,UP,0,0,0,0,0,0,\n".format(i) for i in range(4))
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_csv", return_value=stats_csv), patch("time.sleep"):
+            counter_history.get_hrsp_5xx_ratios_history(
+                ["api"], "127.0.0.1/haproxy/stats", None, None, 60, self.path, slots=2, capacity=10)
+        with counter_history.HistoryFile(self.path) as history:
+            self.assertEqual((history.slots, history.capacity), (2, 10))
+            self.assertEqual(history.backends(), ["api"])
+
+    def test_query_history(self):
+        """Test the query prints the ratio and servers up of every backend, and fails when not covered."""
+        with counter_history.HistoryFile(self.path, writable=True) as history:
+            counter_history.append_stats(history, STATS_CSV.format(ok=0, errors=0), 100)
+            counter_history.append_stats(history, STATS_CSV.format(ok=98, errors=2), 400)
+        with patch("check_haproxy_stats.counter_history.print", create=True) as mock_print:
+            self.assertEqual(counter_history.query_history(self.path, None, 300), 0)
+            self.assertEqual(counter_history.query_history(self.path, None, 301), 1)
+        self.assertEqual(mock_print.call_args_list[0][0][0],
+                         "api has 5xx ratio of 0.0200 over 300 seconds, 1 of 2 servers up")
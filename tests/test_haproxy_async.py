@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `haproxy_async` module."""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from mock import Mock, patch
+
+try:
+    import asyncio
+
+    from check_haproxy_stats import haproxy_async
+except (ImportError, SyntaxError):  # Python 2
+    haproxy_async = None
+
+STATS_CSV = """# pxname,svname,status,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,
+api,server-1,UP,0,{ok},0,0,{errors},0,
+api,server-2,DOWN,0,0,0,0,0,0,
+api,BACKEND,UP,0,{ok},0,0,{errors},0,
+"""
+
+
+def serve_stats_page(status=200):
+    """Serve STATS_CSV on a random local port, recording the path and authorization of every request."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            requests.append((self.path, self.headers.get("Authorization")))
+            body = STATS_CSV.format(ok=90, errors=10).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, requests
+
+
+def sleep_then_return(stats_csv, delay=0.01):
+    """Return a fetch of the stats taking delay seconds, without defining a coroutine."""
+    return lambda *args: asyncio.sleep(delay, result=stats_csv)
+
+
+class AsyncTestCase(unittest.TestCase):
+
+    """Run every test on an event loop of its own."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_until_complete(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+
+@unittest.skipIf(haproxy_async is None, "asyncio needs Python 3")
+class TestFetch(AsyncTestCase):
+
+    """Test cases for the fetches of haproxy_async."""
+
+    def test_fetch_stats_http(self):
+        """Test the CSV export of the stats page is read with basic authentication."""
+        server, requests = serve_stats_page()
+        try:
+            base_url_path = "127.0.0.1:{0}/haproxy/stats".format(server.server_address[1])
+            stats_csv = self.run_until_complete(haproxy_async.fetch_stats_http(base_url_path, "someone", "password"))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(stats_csv, STATS_CSV.format(ok=90, errors=10))
+        self.assertEqual(requests, [("/haproxy/stats/;csv;norefresh", "Basic c29tZW9uZTpwYXNzd29yZA==")])
+
+    def test_fetch_stats_http_error(self):
+        """Test an error of the stats page is raised."""
+        server, _ = serve_stats_page(status=401)
+        try:
+            base_url_path = "127.0.0.1:{0}/haproxy/stats".format(server.server_address[1])
+            self.assertRaises(IOError, self.run_until_complete, haproxy_async.fetch_stats_http(base_url_path))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_fetch_stats_sockets(self):
+        """Test show stat is read from the stats socket."""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "haproxy.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        commands = []
+
+        def answer():
+            connection, _ = listener.accept()
+            commands.append(connection.recv(1024))
+            connection.sendall(STATS_CSV.format(ok=1, errors=0).encode("utf-8"))
+            connection.close()
+
+        thread = threading.Thread(target=answer)
+        thread.start()
+        try:
+            stats_csv = self.run_until_complete(haproxy_async.fetch_stats_sockets([path]))
+        finally:
+            thread.join()
+            listener.close()
+            shutil.rmtree(directory)
+        self.assertEqual(stats_csv, STATS_CSV.format(ok=1, errors=0))
+        self.assertEqual(commands, [b"show stat\n"])
+
+    def test_dechunk(self):
+        """Test a chunked body is joined."""
+        self.assertEqual(haproxy_async._dechunk(b"4\r\nabcd\r\n2;x=y\r\nef\r\n0\r\n\r\n"), b"abcdef")
+
+
+@unittest.skipIf(haproxy_async is None, "asyncio needs Python 3")
+class TestAsyncStatsFetcher(AsyncTestCase):
+
+    """Test cases for haproxy_async.AsyncStatsFetcher."""
+
+    def test_queued_fetches_are_shared(self):
+        """Test checks asking while a fetch waits for its turn share it, and later ones wait for a new fetch."""
+        fetcher = haproxy_async.AsyncStatsFetcher(max_concurrency=1)
+
+        def check_many(count):
+            return asyncio.gather(*(haproxy_async.get_request_stats("api", fetcher=fetcher) for _ in range(count)))
+
+        second = self.loop.create_future()
+        self.loop.call_later(0.005, lambda: check_many(1000).add_done_callback(lambda f: second.set_result(f.result())))
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_http", new_callable=Mock,
+                   side_effect=sleep_then_return(STATS_CSV.format(ok=90, errors=10))):
+            first, second = self.run_until_complete(asyncio.gather(check_many(1000), second))
+        self.assertEqual(set(first) | set(second), set([(0, 90, 0, 0, 10, 0)]))
+        self.assertEqual(fetcher.fetches, 2)
+
+    def test_parsed_once_per_fetch(self):
+        """Test the stats of a shared fetch are parsed once for all the checks it was made for."""
+        fetcher = haproxy_async.AsyncStatsFetcher()
+        parse = Mock(return_value={"api": (0, 1, 0, 0, 0, 0)})
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_http", new_callable=Mock,
+                   side_effect=sleep_then_return(STATS_CSV)):
+            results = self.run_until_complete(asyncio.gather(*(
+                fetcher.parse(parse, "127.0.0.1/haproxy/stats") for _ in range(100))))
+        self.assertEqual(len(results), 100)
+        parse.assert_called_once_with(STATS_CSV)
+
+    def test_fetches_are_bounded_per_endpoint(self):
+        """Test an endpoint is never fetched more than max_concurrency times at once, other endpoints meanwhile."""
+        fetcher = haproxy_async.AsyncStatsFetcher(max_concurrency=2)
+        in_flight, peaks = {}, {}
+
+        def fetch_stats_http(base_url_path, username, password):
+            in_flight[base_url_path] = in_flight.get(base_url_path, 0) + 1
+            peaks[base_url_path] = max(peaks.get(base_url_path, 0), in_flight[base_url_path])
+            future = asyncio.ensure_future(asyncio.sleep(0.01, result=STATS_CSV.format(ok=1, errors=0)))
+            future.add_done_callback(lambda _: in_flight.__setitem__(base_url_path, in_flight[base_url_path] - 1))
+            return future
+
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_http", new_callable=Mock,
+                   side_effect=fetch_stats_http):
+            self.run_until_complete(asyncio.gather(*(
+                fetcher.fetch("lb-{0}/haproxy/stats".format(i % 3), username=str(i)) for i in range(30))))
+        self.assertEqual(fetcher.fetches, 30)
+        self.assertEqual(peaks, {"lb-0/haproxy/stats": 2, "lb-1/haproxy/stats": 2, "lb-2/haproxy/stats": 2})
+
+    def test_timeout(self):
+        """Test a fetch taking longer than timeout fails."""
+        fetcher = haproxy_async.AsyncStatsFetcher(timeout=0.01)
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_http", new_callable=Mock,
+                   side_effect=sleep_then_return(STATS_CSV, delay=1)):
+            self.assertRaises(asyncio.TimeoutError, self.run_until_complete,
+                              fetcher.fetch("127.0.0.1/haproxy/stats"))
+
+
+@unittest.skipIf(haproxy_async is None, "asyncio needs Python 3")
+class TestChecks(AsyncTestCase):
+
+    """Test cases for the asynchronous equivalents of the checks."""
+
+    def test_get_hrsp_5xx_ratio(self):
+        """Test the ratio is computed between two fetches interval seconds apart."""
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_http", new_callable=Mock) as fetch_stats_http:
+            fetch_stats_http.side_effect = [sleep_then_return(STATS_CSV.format(ok=0, errors=0))(),
+                                            sleep_then_return(STATS_CSV.format(ok=95, errors=5))()]
+            started = self.loop.time()
+            ratio = self.run_until_complete(
+                haproxy_async.get_hrsp_5xx_ratio("api", "127.0.0.1/haproxy/stats", None, None, 0.05))
+        self.assertEqual(ratio, 0.05)
+        self.assertGreaterEqual(self.loop.time() - started, 0.05)
+
+    def test_get_request_stats_missing_backend(self):
+        """Test a backend missing from the stats is an error."""
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_http", new_callable=Mock,
+                   side_effect=sleep_then_return(STATS_CSV.format(ok=0, errors=0))):
+            self.assertRaises(ValueError, self.run_until_complete, haproxy_async.get_request_stats("static"))
+
+    def test_get_haproxy_services_up_count_for_backends(self):
+        """Test servers checked and up are counted from the stats socket."""
+        with patch("check_haproxy_stats.haproxy_async.fetch_stats_sockets", new_callable=Mock,
+                   side_effect=sleep_then_return(STATS_CSV.format(ok=0, errors=0))) as fetch_stats_sockets:
+            up_counts = self.run_until_complete(haproxy_async.get_haproxy_services_up_count_for_backends(
+                None, stats_socket="/run/haproxy.sock"))
+        self.assertEqual(up_counts, {"api": {"count": 2, "up_count": 1}})
+        fetch_stats_sockets.assert_called_once_with(["/run/haproxy.sock"])
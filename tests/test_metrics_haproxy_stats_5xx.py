@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Tests for `check_haproxy_stats_5xx` module."""
+import socket
+import struct
 import sys
 import unittest
 
@@ -8,61 +10,144 @@ from check_haproxy_stats import metrics_haproxy_stats_5xx
 from mock import patch
 
 
+class XdrReader(object):
+
+    """Decode the XDR fields of a Ganglia packet."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def uint(self):
+        value, = struct.unpack_from(">I", self.data, self.offset)
+        self.offset += 4
+        return value
+
+    def string(self):
+        length = self.uint()
+        value = self.data[self.offset:self.offset + length].decode("utf-8")
+        self.offset += length + (-length % 4)
+        return value
+
+
+def decode_packet(data):
+    """Return the fields of a Ganglia metadata or string value packet."""
+    reader = XdrReader(data)
+    packet_id = reader.uint()
+    fields = {"id": packet_id, "host": reader.string(), "name": reader.string(), "spoof": reader.uint()}
+    if packet_id == 128:
+        fields.update(type=reader.string(), metric_name=reader.string(), units=reader.string(), slope=reader.uint(),
+                      tmax=reader.uint(), dmax=reader.uint())
+        fields["extra"] = dict((reader.string(), reader.string()) for _ in range(reader.uint()))
+    else:
+        fields.update(format=reader.string(), value=reader.string())
+    assert reader.offset == len(data), "trailing bytes in packet"
+    return fields
+
+
 class TestMetrics_Haproxy_Stats_5xx(unittest.TestCase):
 
     """Test cases for metrics_haproxy_stats_5xx."""
 
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.settimeout(1)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
     def test_parser(self):
         """Test typical use of _get_parser()."""
         parser = metrics_haproxy_stats_5xx._get_parser()
-        args = parser.parse_args(["--backend", "check-trk", "--base-url-path", "some-url-path", "--gmetric-path",
-                                  "/usr/local/bin/gmetric", "--gmetric-tmax", "1", "--gmetric-dmax", "2", "--username",
-                                  "someone", "--password", "password", "--interval", "120"])
-        self.assertEqual(args.backend, "check-trk")
+        args = parser.parse_args(["--backend", "check-trk", "--base-url-path", "some-url-path", "--gmond-host",
+                                  "10.0.0.1", "--gmond-port", "8650", "--gmetric-tmax", "1", "--gmetric-dmax", "2",
+                                  "--username", "someone", "--password", "password", "--interval", "120"])
+        self.assertEqual(args.backends, ["check-trk"])
         self.assertEqual(args.base_url_path, "some-url-path")
         self.assertEqual(args.username, "someone")
         self.assertEqual(args.password, "password")
         self.assertEqual(args.interval, 120)
-        self.assertEqual(args.gmetric_path, "/usr/local/bin/gmetric")
+        self.assertEqual(args.gmond_host, "10.0.0.1")
+        self.assertEqual(args.gmond_port, 8650)
         self.assertEqual(args.gmetric_tmax, 1)
         self.assertEqual(args.gmetric_dmax, 2)
 
-    @unittest.skip("gmetric reporting disabled")
-    @patch("check_haproxy_stats.haproxy_util.get_hrsp_5xx_ratio")
-    @patch("subprocess.check_call")
+    def test_parser_deprecated_gmetric_path(self):
+        """Test the deprecated --gmetric-path is still accepted."""
+        parser = metrics_haproxy_stats_5xx._get_parser()
+        args = parser.parse_args(["--backend", "check-trk", "--gmetric-path", "/usr/bin/gmetric"])
+        self.assertEqual(args.backends, ["check-trk"])
+
+    @patch("check_haproxy_stats.haproxy_util.get_hrsp_ratios")
     @patch("socket.gethostname")
-    def test_report_haproxy_rates(self, socket_hostname, subprocess_check_call, get_hrsp_5xx_ratio):
-        """Test typical case of report_haproxy_rates."""
+    def test_report_haproxy_rates(self, socket_hostname, get_hrsp_ratios):
+        """Test every response code class of every backend is sent to gmond in one run."""
         socket_hostname.return_value = "host"
-        get_hrsp_5xx_ratio.return_value = 0.1
-        metrics_haproxy_stats_5xx._report_haproxy_rates(
-            backend="check-trk",
+        get_hrsp_ratios.return_value = {"check-trk": (0.0, 0.8, 0.05, 0.05, 0.1, 0.0),
+                                        "api": (0.0, 1.0, 0.0, 0.0, 0.0, 0.0)}
+        rc = metrics_haproxy_stats_5xx._report_haproxy_rates(
+            backends=["check-trk", "api"],
             base_url_path="some-url",
             username="username",
             password="password",
             interval=60,
-            gmetric_path="/usr/bin/gmetric",
+            gmond_host="127.0.0.1",
+            gmond_port=self.port,
             gmetric_dmax=120,
             gmetric_tmax=60)
-        subprocess_check_call.assert_called_with(["/usr/bin/gmetric", "-d", "120", "-x", "60", "-n",
-                                                  "haproxy_host_check-trk_5xx_percent", "-v", "10.00", "-s", "both",
-                                                  "-g", "haproxy", "-t", "float"])
+        self.assertEqual(rc, 0)
+        get_hrsp_ratios.assert_called_with(["check-trk", "api"], "some-url", "username", "password", 60, None, 5, None)
+
+        packets = [decode_packet(self.listener.recv(1500)) for _ in range(24)]
+        metadata, values = packets[0::2], packets[1::2]
+        self.assertEqual(metadata[0], {"id": 128, "host": "host", "name": "haproxy_host_api_1xx_percent", "spoof": 0,
+                                       "type": "float", "metric_name": "haproxy_host_api_1xx_percent", "units": "",
+                                       "slope": 3, "tmax": 60, "dmax": 120, "extra": {"GROUP": "haproxy"}})
+        self.assertEqual(values[10], {"id": 133, "host": "host", "name": "haproxy_host_check-trk_5xx_percent",
+                                      "spoof": 0, "format": "%s", "value": "10.00"})
+        self.assertEqual([m["name"] for m in metadata], [v["name"] for v in values])
+        self.assertEqual([(v["name"], v["value"]) for v in values[6:]], [
+            ("haproxy_host_check-trk_1xx_percent", "0.00"),
+            ("haproxy_host_check-trk_2xx_percent", "80.00"),
+            ("haproxy_host_check-trk_3xx_percent", "5.00"),
+            ("haproxy_host_check-trk_4xx_percent", "5.00"),
+            ("haproxy_host_check-trk_5xx_percent", "10.00"),
+            ("haproxy_host_check-trk_other_percent", "0.00"),
+        ])
+
+    @patch("check_haproxy_stats.haproxy_util.get_hrsp_ratios")
+    def test_report_haproxy_rates_missing(self, get_hrsp_ratios):
+        """Test backends that are found are still sent when others are missing."""
+        get_hrsp_ratios.return_value = {"check-trk": (0.0, 1.0, 0.0, 0.0, 0.0, 0.0)}
+        with patch("check_haproxy_stats.metrics_haproxy_stats_5xx.print", create=True) as mock_print:
+            rc = metrics_haproxy_stats_5xx._report_haproxy_rates(
+                backends=["check-trk", "api"], base_url_path="some-url", username=None, password=None, interval=60,
+                gmond_host="127.0.0.1", gmond_port=self.port, gmetric_dmax=120, gmetric_tmax=60)
+        self.assertEqual(rc, 3)
+        mock_print.assert_called_with("Did not find backends starting with api")
+        self.assertEqual(decode_packet(self.listener.recv(1500))["name"].split("_")[-2:], ["1xx", "percent"])
 
     def test_main(self):
         """Test typical use of main()."""
-        simulated_check = ["metrics-haproxy-stats-5xx", "--backend", "check-trk", "--base-url-path", "some-url-path",
-                           "--gmetric-path", "/usr/local/bin/gmetric", "--gmetric-tmax", "1", "--gmetric-dmax", "2",
+        simulated_check = ["metrics-haproxy-stats-5xx", "--backend", "all", "--base-url-path", "some-url-path",
+                           "--gmond-port", "8650", "--gmetric-tmax", "1", "--gmetric-dmax", "2",
                            "--username", "someone", "--password", "password", "--interval", "120"]
         report_haproxy_rates = "check_haproxy_stats.metrics_haproxy_stats_5xx._report_haproxy_rates"
         with patch.object(sys, "argv", simulated_check), patch(report_haproxy_rates) as report_haproxy_rates_call:
 
             metrics_haproxy_stats_5xx.main()
             report_haproxy_rates_call.assert_called_with(
-                backend="check-trk",
+                backends=None,
                 base_url_path="some-url-path",
                 username="someone",
                 password="password",
                 interval=120,
-                gmetric_path="/usr/local/bin/gmetric",
+                gmond_host="127.0.0.1",
+                gmond_port=8650,
                 gmetric_dmax=2,
-                gmetric_tmax=1)
+                gmetric_tmax=1,
+                stats_socket=None,
+                timeout=5,
+                cache=None)
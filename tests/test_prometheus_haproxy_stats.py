@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `prometheus_haproxy_stats` module."""
+import threading
+import unittest
+
+import requests
+from check_haproxy_stats import prometheus_haproxy_stats
+from mock import patch
+
+STATS_CSV = "".join([
+    "# pxname,svname,status,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,\n",
+    "http-in,FRONTEND,OPEN,0,20,0,1,2,0,\n",
+    "check-trk,srv-1,UP,0,10,0,1,1,0,\n",
+    "check-trk,srv-2,DOWN,0,10,0,0,1,0,\n",
+    "check-trk,srv-3,no check,0,0,0,0,0,0,\n",
+    "check-trk,BACKEND,UP,0,20,0,1,2,0,\n",
+])
+
+
+class TestPrometheus_Haproxy_Stats(unittest.TestCase):
+
+    """Test cases for prometheus_haproxy_stats."""
+
+    def test_render_metrics(self):
+        """Test the counters of every row and the server counts of every backend are rendered."""
+        lines = prometheus_haproxy_stats.render_metrics(STATS_CSV)
+        self.assertEqual(lines[:8], [
+            "# HELP haproxy_http_responses_total HTTP responses by class of status code.",
+            "# TYPE haproxy_http_responses_total counter",
+            'haproxy_http_responses_total{proxy="http-in",server="FRONTEND",code="1xx"} 0',
+            'haproxy_http_responses_total{proxy="http-in",server="FRONTEND",code="2xx"} 20',
+            'haproxy_http_responses_total{proxy="http-in",server="FRONTEND",code="3xx"} 0',
+            'haproxy_http_responses_total{proxy="http-in",server="FRONTEND",code="4xx"} 1',
+            'haproxy_http_responses_total{proxy="http-in",server="FRONTEND",code="5xx"} 2',
+            'haproxy_http_responses_total{proxy="http-in",server="FRONTEND",code="other"} 0',
+        ])
+        self.assertEqual(len(lines), 2 + 5 * 6 + 2 * 3)
+        self.assertIn('haproxy_backend_servers_up{backend="check-trk"} 1', lines)
+        self.assertIn('haproxy_backend_servers_down{backend="check-trk"} 1', lines)
+
+    def test_escape(self):
+        """Test label values are escaped."""
+        self.assertEqual(prometheus_haproxy_stats._escape('a"b\\c\nd'), 'a\\"b\\\\c\\nd')
+
+    def test_snapshot_cache_single_flight(self):
+        """Test concurrent scrapes of an expired snapshot cause a single fetch and get the same body."""
+        started, release = threading.Event(), threading.Event()
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            started.set()
+            release.wait(5)
+            return STATS_CSV
+
+        cache = prometheus_haproxy_stats.SnapshotCache(fetch, refresh_interval=60)
+        bodies = []
+        threads = [threading.Thread(target=lambda: bodies.append(cache.get())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(bodies), 10)
+        self.assertEqual(len(set(bodies)), 1)
+        self.assertIn(b"haproxy_up 1\n", bodies[0])
+
+    def test_snapshot_cache_refresh(self):
+        """Test the snapshot is refreshed once refresh_interval has passed and failed fetches are reported."""
+        fetch_results = [STATS_CSV, IOError("connection refused")]
+
+        def fetch():
+            result = fetch_results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        cache = prometheus_haproxy_stats.SnapshotCache(fetch, refresh_interval=5)
+        with patch("time.time", return_value=1000):
+            first = cache.get()
+        with patch("time.time", return_value=1004):
+            self.assertIs(cache.get(), first)
+        with patch("time.time", return_value=1005):
+            body = cache.get()
+        self.assertIn(b"haproxy_up 0\n", body)
+        self.assertNotIn(b"haproxy_http_responses_total{", body)
+        self.assertIn(b"haproxy_scrape_duration_seconds ", body)
+
+    def test_metrics_server(self):
+        """Test /metrics is served over HTTP and other paths are not found."""
+        cache = prometheus_haproxy_stats.SnapshotCache(lambda: STATS_CSV)
+        server = prometheus_haproxy_stats.MetricsServer(("127.0.0.1", 0), cache)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{0}".format(server.server_address[1])
+            r = requests.get(url + "/metrics", timeout=5)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers["Content-Type"], prometheus_haproxy_stats.CONTENT_TYPE)
+            self.assertEqual(r.content, cache.get())
+            self.assertEqual(requests.get(url + "/", timeout=5).status_code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_parser(self):
+        """Test typical use of _get_parser()."""
+        args = prometheus_haproxy_stats._get_parser().parse_args(
+            ["--stats-socket", "/run/haproxy.sock", "--listen", "127.0.0.1:9102", "--refresh-interval", "10"])
+        self.assertEqual(args.stats_socket, ["/run/haproxy.sock"])
+        self.assertEqual(args.listen, "127.0.0.1:9102")
+        self.assertEqual(args.refresh_interval, 10)
+        self.assertEqual(args.timeout, 5)
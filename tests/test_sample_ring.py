@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `sample_ring` module."""
+import unittest
+
+from check_haproxy_stats import sample_ring
+
+
+class TestSampleRing(unittest.TestCase):
+
+    """Test cases for sample_ring.SampleRing."""
+
+    def test_wrap_around(self):
+        """Test the oldest samples are overwritten once the ring is full."""
+        ring = sample_ring.SampleRing(3)
+        for i in range(5):
+            ring.append(100 + i, (0, i, 0, 0, 0, 0))
+        self.assertEqual(len(ring), 3)
+        self.assertEqual([ring.get(i) for i in range(3)],
+                         [(102, (0, 2, 0, 0, 0, 0)), (103, (0, 3, 0, 0, 0, 0)), (104, (0, 4, 0, 0, 0, 0))])
+        self.assertEqual(ring.get(-1), (104, (0, 4, 0, 0, 0, 0)))
+
+    def test_window(self):
+        """Test a window starts at the newest sample at least that old, and is None when not covered."""
+        ring = sample_ring.SampleRing(10)
+        self.assertIsNone(ring.window(10))
+        for i in range(6):
+            ring.append(100 + 10 * i, (0, 100 * i, 0, 0, i, 0))
+        self.assertEqual(ring.find(125), 2)
+        self.assertEqual(ring.window(15), ((0, 300, 0, 0, 3, 0), (0, 500, 0, 0, 5, 0), 20))
+        self.assertEqual(ring.window(50), ((0, 0, 0, 0, 0, 0), (0, 500, 0, 0, 5, 0), 50))
+        self.assertIsNone(ring.window(51))
+
+    def test_counter_reset(self):
+        """Test counters going backwards drop every previous sample."""
+        ring = sample_ring.SampleRing(10)
+        ring.append(100, (0, 10, 0, 0, 0, 0))
+        ring.append(110, (0, 1, 0, 0, 0, 0))
+        self.assertEqual(len(ring), 1)
+        self.assertIsNone(ring.window(10))
+
+
+class TestSampleStore(unittest.TestCase):
+
+    """Test cases for sample_ring.SampleStore."""
+
+    def test_get_hrsp_5xx_ratios(self):
+        """Test backends are grouped by prefix and backends gone from the stats are forgotten."""
+        store = sample_ring.SampleStore(10)
+        store.add(100, {"api": (0, 0, 0, 0, 0, 0), "api-canary": (0, 0, 0, 0, 0, 0), "old": (0, 0, 0, 0, 0, 0)})
+        store.add(160, {"api": (0, 90, 0, 0, 0, 0), "api-canary": (0, 5, 0, 0, 5, 0)})
+        self.assertEqual(sorted(store.rings), ["api", "api-canary"])
+        self.assertEqual(store.get_hrsp_5xx_ratios(["api"], 60), ({"api": 0.05}, 60))
+        self.assertRaises(ValueError, store.get_hrsp_5xx_ratios, None, 61)
+
+    def test_get_hrsp_5xx_ratios_partly_covered(self):
+        """Test a backend selecting a ring that does not cover the window is left out, not given a partial ratio."""
+        store = sample_ring.SampleStore(10)
+        store.add(100, {"api": (0, 0, 0, 0, 0, 0), "static": (0, 0, 0, 0, 0, 0)})
+        store.add(130, {"api": (0, 0, 0, 0, 0, 0), "api-canary": (0, 0, 0, 0, 0, 0), "static": (0, 0, 0, 0, 0, 0)})
+        store.add(160, {"api": (0, 100, 0, 0, 0, 0), "api-canary": (0, 0, 0, 0, 50, 0), "static": (0, 10, 0, 0, 0, 0)})
+        self.assertEqual(store.get_hrsp_5xx_ratios(["api", "static"], 60), ({"static": 0}, 60))
+        self.assertEqual(store.get_hrsp_5xx_ratios(["api"], 30), ({"api": 1.0 / 3}, 30))
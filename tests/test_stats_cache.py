@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `stats_cache` module."""
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+from check_haproxy_stats import haproxy_util, stats_cache
+
+STATS_CSV = "# pxname,svname,hrsp_5xx,\ncheck-trk,BACKEND,3,\n"
+
+
+def fetch_slowly(directory, queue):
+    """Get the stats through the cache in directory with a fetch slower than the start of every process."""
+    def fetch():
+        with open(os.path.join(directory, "fetches"), "a") as f:
+            f.write("fetch\n")
+        time.sleep(0.5)
+        return STATS_CSV
+
+    queue.put(stats_cache.StatsCache(os.path.join(directory, "cache"), ttl=60).get("127.0.0.1/haproxy/stats", fetch))
+
+
+class TestStatsCache(unittest.TestCase):
+
+    """Test cases for stats_cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_single_flight(self):
+        """Test checks started together fetch the stats once and all get them."""
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=fetch_slowly, args=(self.directory, queue)) for _ in range(8)]
+        for process in processes:
+            process.start()
+        payloads = [queue.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join()
+
+        self.assertEqual(payloads, [STATS_CSV] * len(processes))
+        with open(os.path.join(self.directory, "fetches")) as f:
+            self.assertEqual(f.read(), "fetch\n")
+        cached = [name for name in os.listdir(os.path.join(self.directory, "cache")) if not name.endswith(".lock")]
+        self.assertEqual(cached, ["stats-{0}.csv".format(hashlib.sha1(b"127.0.0.1/haproxy/stats").hexdigest())])
+
+    def test_ttl(self):
+        """Test stats are refetched once older than the ttl, and cached per endpoint."""
+        cache = stats_cache.StatsCache(self.directory, ttl=5)
+        started = time.time()
+        with patch("check_haproxy_stats.stats_cache.time.time") as now:
+            now.return_value = started
+            self.assertEqual(cache.get("lb-1", lambda: "first"), "first")
+            self.assertEqual(cache.get("lb-1", lambda: "second"), "first")
+            self.assertEqual(cache.get("lb-2", lambda: "other"), "other")
+            now.return_value += 6
+            self.assertEqual(cache.get("lb-1", lambda: "second"), "second")
+
+    def test_fetch_stats_csv(self):
+        """Test the stats are cached under the sockets they are fetched from."""
+        cache = stats_cache.StatsCache(self.directory)
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_sockets", return_value=STATS_CSV) as fetch_sockets:
+            for _ in range(2):
+                self.assertEqual(haproxy_util.fetch_stats_csv(
+                    "127.0.0.1/haproxy/stats", stats_socket=["/run/haproxy-1.sock", "/run/haproxy-2.sock"],
+                    cache=cache), STATS_CSV)
+            fetch_sockets.assert_called_once_with(["/run/haproxy-1.sock", "/run/haproxy-2.sock"], 5)
+            self.assertEqual(cache.get("/run/haproxy-1.sock,/run/haproxy-2.sock", None), STATS_CSV)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `stats_recording` module."""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from check_haproxy_stats import check_haproxy_stats_up, haproxy_util, stats_recording
+
+HEADER = "# pxname,svname,status,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,\n"
+
+
+def stats_csv(requests, errors, status="UP", extra=""):
+    return HEADER + (
+        "api,srv-1,{2},,,,,,,\n"
+        "api,srv-2,UP,,,,,,,\n"
+        "api,BACKEND,UP,0,{0},0,0,{1},0,\n{3}").format(requests, errors, status, extra)
+
+
+SNAPSHOTS = [
+    (1000, stats_csv(100, 0)),
+    (1010, stats_csv(150, 0)),
+    (1020, stats_csv(190, 10, "DOWN")),
+    (1030, stats_csv(290, 10, "DOWN", "static,BACKEND,UP,0,1,0,0,0,0,\n")),
+    (1040, stats_csv(300, 10)),
+]
+
+
+class TestStatsRecording(unittest.TestCase):
+
+    """Test cases for stats_recording."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "haproxy.rec.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _record(self, snapshots=SNAPSHOTS, keyframe_interval=3):
+        with stats_recording.StatsRecorder(self.path, keyframe_interval) as recorder:
+            for timestamp, stats in snapshots:
+                recorder.record(stats, timestamp)
+
+    def test_round_trip(self):
+        """Test snapshots are read back as recorded, only keyframes holding whole snapshots."""
+        self._record()
+        self.assertEqual(list(stats_recording.read_recording(self.path)), SNAPSHOTS)
+        with gzip.open(self.path, "rb") as f:
+            entries = [json.loads(line.decode("utf-8")) for line in f]
+        self.assertEqual(["csv" in entry for entry in entries], [True, False, False, True, False])
+        self.assertEqual(entries[1]["d"], [[3, [4, "150"]]])
+
+    def test_append(self):
+        """Test a recorder appends to an existing recording, starting with a keyframe."""
+        self._record(SNAPSHOTS[:2])
+        self._record(SNAPSHOTS[2:])
+        self.assertEqual(list(stats_recording.read_recording(self.path)), SNAPSHOTS)
+
+    def test_replay(self):
+        """Test functions sampling over an interval read the recording on the virtual clock, without sleeping."""
+        self._record()
+        ratios = []
+        with patch("time.sleep") as time_sleep, stats_recording.StatsReplay(self.path) as replay:
+            while not replay.finished:
+                ratios.append(haproxy_util.get_hrsp_5xx_ratio("api", "replay", None, None, 20, cache=replay))
+            self.assertEqual(replay.time(), 1040)
+        self.assertEqual(ratios, [0.1, 0.0])
+        self.assertFalse(time_sleep.called)
+        self.assertIs(haproxy_util._clock, haproxy_util.time)
+
+    def test_replay_check(self):
+        """Test a check reads the snapshot at the time of the virtual clock."""
+        self._record()
+        with patch("check_haproxy_stats.check_haproxy_stats_up.print", create=True) as mock_print, \
+                stats_recording.StatsReplay(self.path) as replay:
+            replay.sleep(25)
+            rc = check_haproxy_stats_up.check_haproxy_up_rates("replay", backends=["api"], cache=replay)
+        self.assertEqual(rc, check_haproxy_stats_up.SensuCheckStatus.RETURN_CODES["CRITICAL"])
+        self.assertIn("api", mock_print.call_args[0][0])
+
+    def test_record_stats(self):
+        """Test stats are recorded every poll interval for the duration, skipping failed fetches."""
+        now = [1000.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        fetches = [SNAPSHOTS[0][1], IOError("refused"), SNAPSHOTS[1][1]]
+        with patch("time.time", side_effect=lambda: now[0]), patch("time.sleep", side_effect=sleep):
+            recorded = stats_recording.record_stats(self.path, lambda: _raise_or_return(fetches.pop(0)), 10, 30)
+        self.assertEqual(recorded, 2)
+        self.assertEqual(list(stats_recording.read_recording(self.path)), [
+            (1000.0, SNAPSHOTS[0][1]), (1020.0, SNAPSHOTS[1][1])])
+
+
+def _raise_or_return(value):
+    if isinstance(value, Exception):
+        raise value
+    return value
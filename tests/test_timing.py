@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for `timing` module."""
+import re
+import sys
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from mock import Mock, patch
+from check_haproxy_stats import check_haproxy_stats_5xx, haproxy_util, timing
+
+STATS_CSV = (
+    "# pxname,svname,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,\n"
+    "check-trk,srv-1,,,,,,,\n"
+    "check-trk,BACKEND,1,20,0,2,3,0,\n"
+    "\n")
+
+
+class TestTiming(unittest.TestCase):
+
+    """Test cases for timing."""
+
+    def test_disabled(self):
+        """Test nothing is timed or reported without hooks."""
+        self.assertIs(timing.span("fetch"), timing.span("parse"))
+        with timing.Timings(enabled=False) as timings:
+            with timing.span("fetch"):
+                timing.count("rows", 3)
+        self.assertEqual(timings.perfdata(), "")
+
+    def test_hooks(self):
+        """Test spans are reported in milliseconds and counts as is to every hook until it is removed."""
+        hook = Mock()
+        timing.add_hook(hook)
+        try:
+            with patch("check_haproxy_stats.timing._clock", side_effect=[1.0, 1.25]):
+                with timing.span("fetch"):
+                    timing.count("bytes", 10)
+        finally:
+            timing.remove_hook(hook)
+        timing.count("bytes", 20)
+        self.assertEqual([call[0] for call in hook.call_args_list], [("bytes", 10), ("fetch_ms", 250.0)])
+
+    def test_get_hrsp_5xx_ratios(self):
+        """Test a check records its fetches, parsing, aggregation and sleep, summed in order as perfdata."""
+        with patch("check_haproxy_stats.haproxy_util.fetch_stats_http", return_value=STATS_CSV), \
+                patch("time.sleep"), timing.Timings() as timings:
+            haproxy_util.get_hrsp_5xx_ratios(["check-trk"], "127.0.0.1/haproxy/stats", None, None, 60)
+        self.assertEqual(list(timings.values), ["fetch_ms", "bytes", "parse_ms", "rows", "sleep_ms", "aggregate_ms"])
+        self.assertEqual(timings.values["bytes"], 2 * len(STATS_CSV))
+        self.assertEqual(timings.values["rows"], 2)
+        self.assertTrue(re.match(
+            r"^fetch_ms=\d+\.\d{3} bytes=\d+ parse_ms=\d+\.\d{3} rows=2 sleep_ms=\d+\.\d{3} aggregate_ms=\d+\.\d{3}$",
+            timings.perfdata()), timings.perfdata())
+
+    def test_main_perfdata(self):
+        """Test the perfdata of the check is appended to its first line with --perfdata, and nothing is timed
+        without it."""
+        argv = ["check-haproxy-stats-5xx", "--backend", "check-trk", "--perfdata"]
+        with patch.object(sys, "argv", argv), \
+                patch("check_haproxy_stats.haproxy_util.fetch_stats_http", return_value=STATS_CSV), \
+                patch("time.sleep"), patch.object(sys, "stdout", StringIO()) as stdout:
+            self.assertEqual(check_haproxy_stats_5xx.main(), 0)
+            lines = stdout.getvalue().splitlines()
+            self.assertEqual(len(lines), 1)
+            self.assertTrue(re.match(r"^check-trk .* \| fetch_ms=.* rows=2 .*check_ms=\d+\.\d{3}$", lines[0]), lines[0])
+            stdout.truncate(0)
+            stdout.seek(0)
+            argv.pop()
+            with patch("check_haproxy_stats.timing._report") as report:
+                self.assertEqual(check_haproxy_stats_5xx.main(), 0)
+            self.assertFalse(report.called)
+            self.assertNotIn("|", stdout.getvalue())
+
+    def test_report(self):
+        """Test the perfdata goes after the first line printed, or alone when the check printed nothing."""
+        for printed, expected in (("OK: a\nOK: b\n", r"^OK: a \| check_ms=\d+\.\d{3}\nOK: b\n$"),
+                                  ("", r"^\| check_ms=\d+\.\d{3}\n$")):
+            with patch.object(sys, "stdout", StringIO()) as stdout:
+                with timing.Report():
+                    sys.stdout.write(printed)
+                self.assertTrue(re.match(expected, stdout.getvalue()), stdout.getvalue())